@@ -8,8 +8,7 @@ from ._sample_data import (
     load_lifetime_cat_synthtetic_single_image,
 )
 from ._io import convert_to_zarr, convert_to_ome_tif
-from . import phasor, filters, _plotting, _widget
-
+from . import phasor, filters, denoise, _plotting, _widget
 
 __all__ = (
     "napari_get_reader",
@@ -18,6 +17,7 @@ __all__ = (
     "convert_to_ome_tif",
     "phasor",
     "filters",
+    "denoise",
     "_plotting",
     "_widget",
 )
@@ -0,0 +1,150 @@
+import threading
+import weakref
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PhasorCache:
+    """In-memory LRU cache of phasor results.
+
+    Entries are evicted in least recently used order once the total size
+    of the cached arrays exceeds `max_bytes`. Entries of a NumPy array are
+    also dropped when that array is garbage collected, so a new array that
+    happens to get the same `id` never hits stale results, and when a
+    checksum of a sample of their values changes, so that data edited in
+    place does not either. Keys are tuples starting with the `data_key` of
+    the FLIM array, followed by the parameters of the cached result.
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        Memory cap of the cached arrays in bytes, by default 2 GB
+    """
+
+    n_checksum_values = 2**16
+
+    def __init__(self, max_bytes=2 * 1024**3):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._finalizers = {}
+        self._checksums = {}
+        self._lock = threading.RLock()
+
+    def data_key(self, data):
+        """Identity key of a FLIM array.
+
+        Dask arrays are keyed by their graph name, which is a token of
+        their content. NumPy arrays are keyed by `id`, shape and dtype, and
+        their cached entries are dropped if a checksum of up to
+        `n_checksum_values` evenly spaced values changed since the last
+        call.
+
+        Parameters
+        ----------
+        data : np.ndarray or da.Array
+            FLIM data.
+
+        Returns
+        -------
+        tuple
+            Hashable key of the array.
+        """
+        import dask.array as da
+
+        if isinstance(data, da.Array):
+            return ("dask", data.name)
+        data_id = id(data)
+        key = ("numpy", data_id, data.shape, data.dtype.str)
+        checksum = _get_checksum(data, self.n_checksum_values)
+        with self._lock:
+            if data_id not in self._finalizers:
+                self._finalizers[data_id] = weakref.finalize(
+                    data, self._forget, data_id
+                )
+            elif self._checksums.get(data_id) != checksum:
+                # edited in place
+                self._drop(data_id)
+            self._checksums[data_id] = checksum
+        return key
+
+    def get(self, key, default=None):
+        """Get a cached value and mark it as most recently used"""
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def set(self, key, value):
+        """Cache a value (an array or a tuple/list of arrays)
+
+        Values larger than `max_bytes` are not cached.
+        """
+        nbytes = _get_nbytes(value)
+        with self._lock:
+            self._pop(key)
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def clear(self):
+        """Remove all cached values"""
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _pop(self, key):
+        if key in self._entries:
+            _, nbytes = self._entries.pop(key)
+            self.nbytes -= nbytes
+
+    def _forget(self, data_id):
+        """Remove entries of a garbage collected NumPy array"""
+        with self._lock:
+            self._finalizers.pop(data_id, None)
+            self._checksums.pop(data_id, None)
+            self._drop(data_id)
+
+    def _drop(self, data_id):
+        """Remove entries of a NumPy array"""
+        for key in list(self._entries):
+            if key[:2] == ("numpy", data_id):
+                self._pop(key)
+
+
+def _get_checksum(data, n_values):
+    """Checksum of up to `n_values` evenly spaced values of an array"""
+    if data.size > n_values:
+        indices = np.linspace(0, data.size - 1, n_values).astype(np.intp)
+        data = data[np.unravel_index(indices, data.shape)]
+    return zlib.crc32(np.ascontiguousarray(data))
+
+
+def _get_nbytes(value):
+    """Total bytes of an array or of a (nested) tuple/list of arrays"""
+    import dask.array as da
+
+    if isinstance(value, (tuple, list)):
+        return sum(_get_nbytes(item) for item in value)
+    if isinstance(value, da.Array):
+        # lazy arrays hold a graph, not their data
+        return 0
+    if hasattr(value, "nbytes"):
+        return value.nbytes
+    return np.asarray(value).nbytes
+
+
+# Cache shared by the plugin widgets
+phasor_cache = PhasorCache()
@@ -0,0 +1,410 @@
+import numpy as np
+
+
+class PhasorHistogram:
+    """Fixed-grid 2D histogram of phasor coordinates.
+
+    The histogram is built once from G and S, together with the bin index of
+    every pixel. Redrawing the histogram and selecting regions of it then
+    depend on the number of bins instead of the number of pixels: a
+    selection tests bin centers and maps the selected bins back to the
+    pixels with a lookup. Only pixels of bins crossed by the outline of the
+    selection are tested one by one. Bin edges are the same as those of
+    `np.histogram2d`.
+
+    Pixels can also be grouped in slices, like frames or channels. The
+    counts of a slice, and the counts of each cluster, are binned with the
+    bin index of the pixels, so the pixels are not binned again.
+
+    Parameters
+    ----------
+    g : array-like
+        G component of each pixel (for example the 'G' column of a features
+        table).
+    s : array-like
+        S component of each pixel.
+    bins : int, optional
+        Number of bins along each axis, by default 400
+    range : Tuple[Tuple[float, float], Tuple[float, float]], optional
+        (min, max) of G and of S. Pixels outside of it (or with NaN
+        coordinates) are not counted, by default None (range of the data)
+    x_name : str, optional
+        Name of the feature with G, by default "G"
+    y_name : str, optional
+        Name of the feature with S, by default "S"
+    slices : Dict[str, array-like], optional
+        Integer id of each pixel along named slices, like the 'frame' or
+        'channel' columns of a features table, by default None
+    """
+
+    def __init__(
+        self,
+        g,
+        s,
+        bins=400,
+        range=None,
+        x_name="G",
+        y_name="S",
+        slices=None,
+    ):
+        g = np.asarray(g)
+        s = np.asarray(s)
+        if slices is None:
+            slices = {}
+        slices = {name: np.asarray(ids) for name, ids in slices.items()}
+        self.bins = bins
+        self.x_name = x_name
+        self.y_name = y_name
+        self._range_from_data = range is None
+        if range is None:
+            range = (_get_range(g), _get_range(s))
+        self.range = range
+        self.x_edges = np.linspace(*range[0], bins + 1)
+        self.y_edges = np.linspace(*range[1], bins + 1)
+        self.counts = np.zeros((bins, bins), dtype=np.intp)
+        self._number_bins_estimate = None
+        # pixels are kept in buffers with room to append more of them
+        self._g = g[:0]
+        self._s = s[:0]
+        self._bin_index = np.empty(0, dtype=np.intp)
+        self._slices = {name: ids[:0] for name, ids in slices.items()}
+        self._slice_cache = {}
+        self._n_points = 0
+        self._add_points(g, s, slices)
+
+    @property
+    def g(self):
+        """G component of each pixel"""
+        return self._g[: self._n_points]
+
+    @property
+    def s(self):
+        """S component of each pixel"""
+        return self._s[: self._n_points]
+
+    @property
+    def bin_index(self):
+        """Flat bin index of each pixel, -1 for pixels outside the
+        histogram"""
+        return self._bin_index[: self._n_points]
+
+    @property
+    def slice_names(self):
+        """Names of the slices of the pixels"""
+        return list(self._slices)
+
+    def get_slice_ids(self, name):
+        """Id of each pixel along a slice"""
+        return self._slices[name][: self._n_points]
+
+    def get_slice_values(self, name):
+        """Sorted ids of the slices along `name`"""
+        key = ("values", name)
+        if key not in self._slice_cache:
+            self._slice_cache[key] = np.unique(self.get_slice_ids(name))
+        return self._slice_cache[key]
+
+    def get_counts(self, **selection):
+        """Counts of the pixels of a slice, like `get_counts(frame=2)`
+
+        Counts of each slice are calculated once, from the bin index of its
+        pixels. Without a selection, the counts of all pixels are returned.
+        """
+        if not selection:
+            return self.counts
+        key = ("counts",) + tuple(sorted(selection.items()))
+        if key not in self._slice_cache:
+            bin_index = self.bin_index[self._get_slice_mask(selection)]
+            self._slice_cache[key] = self._count(bin_index[bin_index >= 0])
+        return self._slice_cache[key]
+
+    def get_cluster_counts(self, cluster_ids, **selection):
+        """Counts of the pixels of each cluster (in a slice)
+
+        Parameters
+        ----------
+        cluster_ids : array-like
+            Cluster of each pixel.
+        **selection
+            Slice of the pixels to count, like `frame=2`.
+
+        Returns
+        -------
+        clusters : np.ndarray
+            Sorted ids of the clusters.
+        counts : np.ndarray
+            Counts of each cluster, with shape (clusters, bins, bins).
+        """
+        clusters, cluster_index = np.unique(
+            np.asarray(cluster_ids), return_inverse=True
+        )
+        counted = self.bin_index >= 0
+        if selection:
+            counted &= self._get_slice_mask(selection)
+        n_bins = self.bins * self.bins
+        counts = np.bincount(
+            cluster_index.ravel()[counted] * n_bins + self.bin_index[counted],
+            minlength=len(clusters) * n_bins,
+        )
+        return clusters, counts.reshape(len(clusters), self.bins, self.bins)
+
+    def _get_slice_mask(self, selection):
+        """Mask of the pixels of a slice"""
+        mask = np.ones(self._n_points, dtype=bool)
+        for name, value in selection.items():
+            mask &= self.get_slice_ids(name) == value
+        return mask
+
+    def _count(self, bin_index):
+        """Counts of each bin of the histogram, from bin indices"""
+        return np.bincount(bin_index, minlength=self.bins * self.bins).reshape(
+            self.bins, self.bins
+        )
+
+    @property
+    def histogram(self):
+        """(counts, x_edges, y_edges), like the output of `np.histogram2d`"""
+        return self.counts, self.x_edges, self.y_edges
+
+    def matches(self, x_name, y_name, n_points):
+        """Whether the histogram holds these features of this many pixels"""
+        return (
+            self.x_name == x_name
+            and self.y_name == y_name
+            and self._n_points == n_points
+        )
+
+    def rebin(self, bins):
+        """Histogram of the same pixels with another number of bins"""
+        if bins == self.bins:
+            return self
+        phasor_histogram = PhasorHistogram(
+            self.g,
+            self.s,
+            bins=bins,
+            range=self.range,
+            x_name=self.x_name,
+            y_name=self.y_name,
+            slices={name: self.get_slice_ids(name) for name in self._slices},
+        )
+        phasor_histogram._range_from_data = self._range_from_data
+        phasor_histogram._number_bins_estimate = self._number_bins_estimate
+        return phasor_histogram
+
+    def append(self, g, s, slices=None):
+        """Add pixels to the histogram
+
+        Only the new pixels are binned, with the current bin edges. If the
+        range of the histogram was taken from the data and some of the new
+        pixels fall outside of it, the histogram is rebuilt from all pixels
+        instead. The automatic number of bins is not estimated again, so
+        the grid of the plot stays the same while pixels are added.
+
+        Parameters
+        ----------
+        g : array-like
+            G component of each new pixel.
+        s : array-like
+            S component of each new pixel.
+        slices : Dict[str, array-like], optional
+            Id of each new pixel along the slices of the histogram, by
+            default None
+
+        Returns
+        -------
+        PhasorHistogram
+            This histogram, or the rebuilt one.
+        """
+        g = np.asarray(g)
+        s = np.asarray(s)
+        if slices is None:
+            slices = {}
+        if set(slices) != set(self._slices):
+            raise ValueError(
+                f"expected ids of the slices {self.slice_names}, got "
+                f"{list(slices)}"
+            )
+        slices = {name: np.asarray(ids) for name, ids in slices.items()}
+        if self._range_from_data:
+            outside = _get_outside(g, self.range[0]) | _get_outside(
+                s, self.range[1]
+            )
+            if outside.any():
+                phasor_histogram = PhasorHistogram(
+                    np.concatenate([self.g, g]),
+                    np.concatenate([self.s, s]),
+                    bins=self.bins,
+                    x_name=self.x_name,
+                    y_name=self.y_name,
+                    slices={
+                        name: np.concatenate([self.get_slice_ids(name), ids])
+                        for name, ids in slices.items()
+                    },
+                )
+                phasor_histogram._number_bins_estimate = (
+                    self._number_bins_estimate
+                )
+                return phasor_histogram
+        self._add_points(g, s, slices)
+        return self
+
+    def _add_points(self, g, s, slices):
+        """Bin pixels and add them to the buffers and counts"""
+        x_index = _get_bin_index(g, self.x_edges)
+        y_index = _get_bin_index(s, self.y_edges)
+        inside = (x_index >= 0) & (y_index >= 0)
+        bin_index = np.where(inside, x_index * self.bins + y_index, -1)
+        self.counts += self._count(bin_index[inside])
+        self._slice_cache = {}
+
+        start, stop = self._n_points, self._n_points + len(g)
+        if stop > len(self._bin_index):
+            # grow buffers geometrically, so that appending is amortized
+            capacity = max(stop, 2 * len(self._bin_index))
+            self._g = _grow(self._g, start, capacity, g.dtype)
+            self._s = _grow(self._s, start, capacity, s.dtype)
+            self._bin_index = _grow(self._bin_index, start, capacity)
+            for name, ids in slices.items():
+                self._slices[name] = _grow(
+                    self._slices[name], start, capacity, ids.dtype
+                )
+        self._g[start:stop] = g
+        self._s[start:stop] = s
+        self._bin_index[start:stop] = bin_index
+        for name, ids in slices.items():
+            self._slices[name][start:stop] = ids
+        self._n_points = stop
+
+    def estimate_number_bins(self):
+        """Automatic number of bins of the clusters plotter for G and S
+
+        It is the largest Freedman-Diaconis estimate of G and S, like in
+        `napari_clusters_plotter`. It goes through all pixels, so it is only
+        calculated once.
+        """
+        from napari_clusters_plotter._plotter_utilities import (
+            estimate_number_bins,
+        )
+
+        if self._number_bins_estimate is None:
+            self._number_bins_estimate = int(
+                max(
+                    estimate_number_bins(self.g),
+                    estimate_number_bins(self.s),
+                )
+            )
+        return self._number_bins_estimate
+
+    def select(self, vertices):
+        """Select pixels inside a polygon
+
+        Bins are selected by their centers. Pixels of bins crossed by the
+        outline of the polygon are tested one by one, so that the selection
+        is the same as testing every pixel.
+
+        Parameters
+        ----------
+        vertices : array-like
+            (x, y) vertices of the polygon, like the ones of a matplotlib
+            `LassoSelector`.
+
+        Returns
+        -------
+        np.ndarray
+            Boolean mask with one entry per pixel.
+        """
+        from matplotlib.path import Path
+
+        path = Path(vertices)
+        x_centers = (self.x_edges[:-1] + self.x_edges[1:]) / 2
+        y_centers = (self.y_edges[:-1] + self.y_edges[1:]) / 2
+        centers = np.stack(
+            np.meshgrid(x_centers, y_centers, indexing="ij"), axis=-1
+        )
+        selected_bins = path.contains_points(centers.reshape(-1, 2))
+        # pixels outside the histogram (index -1) get the last entry
+        selected_bins = np.append(selected_bins, False)
+        mask = selected_bins[self.bin_index]
+
+        outline_bins = np.append(self._get_outline_bins(vertices), False)
+        on_outline = outline_bins[self.bin_index]
+        points = np.stack([self.g[on_outline], self.s[on_outline]], axis=-1)
+        mask[on_outline] = path.contains_points(points)
+        return mask
+
+    def _get_outline_bins(self, vertices):
+        """Flat mask of the bins crossed by the outline of a polygon
+
+        Edges are sampled every half bin. A bin crossed by an edge is then
+        next to the bin of a sample, so bins around samples are included.
+        """
+        vertices = np.asarray(vertices, dtype=float).reshape(-1, 2)
+        widths = np.array(
+            [
+                (self.x_edges[-1] - self.x_edges[0]) / self.bins,
+                (self.y_edges[-1] - self.y_edges[0]) / self.bins,
+            ]
+        )
+        origin = np.array([self.x_edges[0], self.y_edges[0]])
+        # polygons are closed
+        starts = vertices
+        stops = np.roll(vertices, -1, axis=0)
+        n_samples = np.ceil(
+            np.abs(stops - starts).max(axis=1, initial=0) / widths.min() * 2
+        )
+        samples = [
+            start + np.linspace(0, 1, int(n) + 1)[:, None] * (stop - start)
+            for start, stop, n in zip(starts, stops, n_samples)
+        ]
+        samples = np.concatenate(samples + [np.empty((0, 2))])
+        samples = samples[np.isfinite(samples).all(axis=1)]
+        # bins around the histogram keep samples outside of it
+        index = np.clip(
+            np.floor((samples - origin) / widths) + 1, 0, self.bins + 1
+        )
+        index = index.astype(np.intp)
+        outline = np.zeros((self.bins + 2, self.bins + 2), dtype=bool)
+        outline[index[:, 0], index[:, 1]] = True
+        # add bins around each sample
+        around = outline.copy()
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                around[1:-1, 1:-1] |= outline[
+                    1 + dx : self.bins + 1 + dx, 1 + dy : self.bins + 1 + dy
+                ]
+        return around[1:-1, 1:-1].ravel()
+
+
+def _get_range(values):
+    """(min, max) of finite values, widened like in `np.histogram2d`"""
+    finite = values[np.isfinite(values)]
+    if len(finite) == 0:
+        return 0.0, 1.0
+    first, last = float(finite.min()), float(finite.max())
+    if first == last:
+        first, last = first - 0.5, last + 0.5
+    return first, last
+
+
+def _get_outside(values, range):
+    """Whether finite values are outside of a (min, max) range"""
+    finite = np.isfinite(values)
+    return finite & ((values < range[0]) | (values > range[1]))
+
+
+def _grow(buffer, size, capacity, dtype=None):
+    """Copy of the first `size` entries of a buffer, with more capacity"""
+    if dtype is None:
+        dtype = buffer.dtype
+    grown = np.empty(capacity, dtype=np.result_type(buffer.dtype, dtype))
+    grown[:size] = buffer[:size]
+    return grown
+
+
+def _get_bin_index(values, edges):
+    """Bin index of each value, -1 for values outside of the edges"""
+    index = np.searchsorted(edges, values, side="right") - 1
+    # last edge is included in the last bin
+    index[values == edges[-1]] = len(edges) - 2
+    index[(index < 0) | (index >= len(edges) - 1)] = -1
+    return index
@@ -1,8 +1,17 @@
 from napari.layers import Layer
 from napari_clusters_plotter._plotter import PlotterWidget
+from napari_clusters_plotter._Qt_code import SelectFrom2DHistogram
 from qtpy.QtCore import QSize
-from qtpy.QtWidgets import QHBoxLayout, QLineEdit, QLabel, QPushButton, QWidget
+from qtpy.QtWidgets import (
+    QComboBox,
+    QHBoxLayout,
+    QLineEdit,
+    QLabel,
+    QPushButton,
+    QWidget,
+)
 import numpy as np
+import re
 import warnings
 
 
@@ -32,6 +41,24 @@ class PhasorPlotterWidget(PlotterWidget):
         )
         self.tau_lines_button.clicked.connect(self.on_show_hide_tau_lines)
 
+        # Pixels shown in the phasor histogram: all of them, the ones of the
+        # current frame or the ones of a channel
+        self.histogram_slice_container = QWidget()
+        self.histogram_slice_container.setLayout(QHBoxLayout())
+        self.histogram_slice_container.layout().addWidget(
+            QLabel("Histogram of:")
+        )
+        self.histogram_slice_combobox = QComboBox()
+        self.histogram_slice_combobox.addItem("All pixels")
+        self.histogram_slice_container.layout().addWidget(
+            self.histogram_slice_combobox
+        )
+        self.histogram_slice_container.setVisible(False)
+        self.advanced_options_container.layout().addWidget(
+            self.histogram_slice_container
+        )
+        self.histogram_slice_combobox.currentIndexChanged.connect(self.replot)
+
         # Start with histogram plot
         self.plotting_type.setCurrentIndex(1)
         # Start with log scale
@@ -47,20 +74,289 @@ class PhasorPlotterWidget(PlotterWidget):
         force_redraw=True,
         ensure_full_semi_circle_displayed=False,
     ):
-        super().run(
-            features=features,
-            plot_x_axis_name=plot_x_axis_name,
-            plot_y_axis_name=plot_y_axis_name,
-            plot_cluster_name=plot_cluster_name,
-            redraw_cluster_image=redraw_cluster_image,
-            force_redraw=force_redraw,
-        )
+        # Phasor histograms of the layer are drawn here, from the bin index
+        # of each pixel, instead of binning all data points on every redraw
+        phasor_histogram = None
+        if (
+            self.plotting_type.currentText() == "HISTOGRAM"
+            and plot_x_axis_name != plot_y_axis_name
+        ):
+            phasor_histogram = self.get_phasor_histogram(
+                plot_x_axis_name=plot_x_axis_name,
+                plot_y_axis_name=plot_y_axis_name,
+                n_points=len(features),
+            )
+        self.histogram_slice_container.setVisible(phasor_histogram is not None)
+        if phasor_histogram is None:
+            super().run(
+                features=features,
+                plot_x_axis_name=plot_x_axis_name,
+                plot_y_axis_name=plot_y_axis_name,
+                plot_cluster_name=plot_cluster_name,
+                redraw_cluster_image=redraw_cluster_image,
+                force_redraw=force_redraw,
+            )
+        elif self.isVisible() or force_redraw:
+            self.run_phasor_histogram(
+                features,
+                plot_x_axis_name,
+                plot_y_axis_name,
+                plot_cluster_name,
+                redraw_cluster_image,
+            )
         if self.tau_lines_button.isChecked():
             self.add_tau_lines_from_widget()
         self.redefine_axes_limits(
             ensure_full_semi_circle_displayed=ensure_full_semi_circle_displayed
         )
 
+    def run_phasor_histogram(
+        self,
+        features,
+        plot_x_axis_name,
+        plot_y_axis_name,
+        plot_cluster_name=None,
+        redraw_cluster_image=True,
+    ):
+        """
+        Draw the phasor histogram of the layer and its clusters
+
+        Counts of the selected slice and of each cluster come from the bin
+        index of each pixel, so data points are not binned again on every
+        redraw or for every cluster.
+        """
+        from matplotlib.colors import to_rgba_array
+        from napari_clusters_plotter._utilities import get_nice_colormap
+
+        canvas = self.graphics_widget
+        self.data_x = features[plot_x_axis_name]
+        self.data_y = features[plot_y_axis_name]
+        self.plot_x_axis_name = plot_x_axis_name
+        self.plot_y_axis_name = plot_y_axis_name
+        self.plot_cluster_name = plot_cluster_name
+        self.analysed_layer = self.layer_select.value
+        canvas.reset()
+        canvas.selected_colormap = self.colormap_dropdown.value
+        colors = get_nice_colormap()
+
+        if self.bin_auto.isChecked():
+            number_bins = self.get_phasor_histogram(
+                plot_x_axis_name=plot_x_axis_name,
+                plot_y_axis_name=plot_y_axis_name,
+                n_points=len(features),
+            ).estimate_number_bins()
+            self.bin_number_spinner.setMaximum(
+                max(number_bins, self.bin_number_spinner.maximum())
+            )
+            self.bin_number_spinner.setValue(number_bins)
+        else:
+            number_bins = int(self.bin_number_spinner.value())
+        phasor_histogram = self.get_phasor_histogram(
+            number_bins, plot_x_axis_name, plot_y_axis_name, len(features)
+        )
+        self.update_histogram_slices(phasor_histogram)
+        selection = self.get_histogram_selection()
+        self.draw_phasor_histogram(
+            phasor_histogram,
+            colors,
+            phasor_histogram.get_counts(**selection),
+            log_scale=self.log_scale.isChecked(),
+        )
+
+        clustered = (
+            plot_cluster_name is not None
+            and plot_cluster_name != "label"
+            and plot_cluster_name in list(features.keys())
+        )
+        if clustered:
+            if self.plot_hide_non_selected.isChecked():
+                # make unselected points to noise points
+                features.loc[
+                    features[plot_cluster_name] == 0, plot_cluster_name
+                ] = -1
+            if "label" in features.keys():
+                self.label_ids = features["label"]
+            self.cluster_ids = features[plot_cluster_name].fillna(-1)
+
+            clusters, cluster_counts = phasor_histogram.get_cluster_counts(
+                self.cluster_ids, **selection
+            )
+            if self.plot_hide_non_selected.isChecked():
+                clusters, cluster_counts = clusters[1:], cluster_counts[1:]
+            cluster_overlay_rgba = np.zeros((number_bins, number_bins, 4))
+            if len(clusters) > 0:
+                # Bins take the color of the cluster with most pixels in them
+                cluster_colors = to_rgba_array(
+                    [
+                        colors[int(cluster) % len(colors)]
+                        for cluster in clusters
+                    ]
+                )
+                cluster_colors[:, 3] = 0.9
+                counted = cluster_counts.max(axis=0) > 0
+                cluster_overlay_rgba[counted] = cluster_colors[
+                    cluster_counts.argmax(axis=0)[counted]
+                ]
+            xedges, yedges = phasor_histogram.x_edges, phasor_histogram.y_edges
+            canvas.axes.imshow(
+                cluster_overlay_rgba.swapaxes(0, 1),
+                extent=[xedges[0], xedges[-1], yedges[0], yedges[-1]],
+                origin="lower",
+                alpha=1,
+                aspect="auto",
+            )
+            canvas.figure.canvas.draw_idle()
+
+        canvas.axes.set_xlabel(plot_x_axis_name)
+        canvas.axes.set_ylabel(plot_y_axis_name)
+        canvas.match_napari_layout()
+
+        if clustered:
+            cmap = to_rgba_array(colors)
+            # each prediction is mapped to its color, cycling through the
+            # colors, except noise points (id = -1)
+            cmap_dict = {
+                int(prediction + 1): (
+                    cmap[int(prediction) % len(cmap)]
+                    if prediction >= 0
+                    else [0, 0, 0, 0]
+                )
+                for prediction in np.unique(self.cluster_ids)
+            }
+            # take care of background label
+            cmap_dict[None] = [0, 0, 0, 0]
+            keep_selection = list(self.viewer.layers.selection)
+            if redraw_cluster_image:
+                self._update_cluster_image(
+                    is_tracking_data=False,
+                    plot_cluster_name=plot_cluster_name,
+                    cmap_dict=cmap_dict,
+                )
+            self.viewer.layers.selection.clear()
+            for layer in keep_selection:
+                self.viewer.layers.selection.add(layer)
+        else:
+            canvas.draw()
+
+        if canvas.last_xy_labels != (plot_x_axis_name, plot_y_axis_name):
+            # Additional redraw in case axes have changed, otherwise y-axis
+            # may not get updated
+            canvas.draw()
+        canvas.reset_zoom()
+
+    def draw_phasor_histogram(
+        self, phasor_histogram, colors, counts, log_scale=False
+    ):
+        """
+        Draw counts of a phasor histogram and select from its bins
+
+        Lasso selections do not go through all data points, only through the
+        histogram bins.
+        """
+        from matplotlib.colors import LinearSegmentedColormap
+        from napari.utils.colormaps import ALL_COLORMAPS
+
+        canvas = self.graphics_widget
+        canvas.colors = colors
+        xedges, yedges = phasor_histogram.x_edges, phasor_histogram.y_edges
+        unchanged = (
+            canvas.histogram is not None and canvas.histogram[1] is xedges
+        )
+        canvas.axes.imshow(
+            counts.T,
+            extent=[xedges[0], xedges[-1], yedges[0], yedges[-1]],
+            origin="lower",
+            cmap=LinearSegmentedColormap.from_list(
+                canvas.selected_colormap,
+                ALL_COLORMAPS[canvas.selected_colormap].colors,
+            ),
+            aspect="auto",
+            norm="log" if log_scale else None,
+        )
+        if not unchanged:
+            canvas.axes.set_xlim(xedges[0], xedges[-1])
+            canvas.axes.set_ylim(yedges[0], yedges[-1])
+            canvas.xylim = (canvas.axes.get_xlim(), canvas.axes.get_ylim())
+        canvas.histogram = (counts, xedges, yedges)
+        canvas.selector.disconnect()
+        canvas.selector = SelectFromPhasorHistogram(
+            canvas, canvas.axes, phasor_histogram
+        )
+        canvas.axes.figure.canvas.draw_idle()
+
+    def update_histogram_slices(self, phasor_histogram):
+        """
+        List the slices of the phasor histogram that can be shown
+
+        The current choice is kept if the histogram still has it.
+        """
+        items = ["All pixels"]
+        if (
+            "frame" in phasor_histogram.slice_names
+            and len(phasor_histogram.get_slice_values("frame")) > 1
+        ):
+            items.append("Current frame")
+        if "channel" in phasor_histogram.slice_names:
+            items += [
+                f"Channel {channel}"
+                for channel in phasor_histogram.get_slice_values("channel")
+            ]
+        current_text = self.histogram_slice_combobox.currentText()
+        self.histogram_slice_combobox.blockSignals(True)
+        self.histogram_slice_combobox.clear()
+        self.histogram_slice_combobox.addItems(items)
+        if current_text in items:
+            self.histogram_slice_combobox.setCurrentText(current_text)
+        self.histogram_slice_combobox.blockSignals(False)
+
+    def get_histogram_selection(self):
+        """
+        Get the slice of the pixels to show, like `{"frame": 2}`
+
+        The frame is the position of the viewer along the time axis of the
+        labels layer, which is its 4th axis from the end.
+        """
+        text = self.histogram_slice_combobox.currentText()
+        if text == "Current frame":
+            return {"frame": self.get_current_frame()}
+        if text.startswith("Channel "):
+            return {"channel": int(text[len("Channel ") :])}
+        return {}
+
+    def get_current_frame(self):
+        """Get the position of the viewer along the time axis of the layer"""
+        current_step = self.viewer.dims.current_step
+        return current_step[len(current_step) - 4]
+
+    def replot(self):
+        """Redraw the plot with the current settings"""
+        if self.analysed_layer is None:
+            return
+        clustering_ID = None
+        if self.cluster_ids is not None:
+            clustering_ID = self.plot_cluster_id.currentText()
+        self.run(
+            self.analysed_layer.features,
+            self.plot_x_axis_name,
+            self.plot_y_axis_name,
+            plot_cluster_name=clustering_ID,
+            redraw_cluster_image=False,
+        )
+
+    def frame_changed(self, event):
+        # Phasor histograms are only redrawn if they show the current frame
+        if self.histogram_slice_container.isHidden():
+            super().frame_changed(event)
+            return
+        frame = self.get_current_frame()
+        if (
+            self.histogram_slice_combobox.currentText() == "Current frame"
+            and frame != self.frame
+        ):
+            self.frame = frame
+            self.replot()
+        self.frame = frame
+
     def _draw_cluster_image(
         self,
         is_tracking_data: bool,
@@ -68,11 +364,37 @@ class PhasorPlotterWidget(PlotterWidget):
         cluster_ids,
         cmap_dict=None,
     ) -> Layer:
-        visualized_layer = super()._draw_cluster_image(
-            is_tracking_data, plot_cluster_name, cluster_ids, cmap_dict
-        )
-        image_layer_name = self.layer_select.value.name.replace(
-            "Labelled_pixels_from_", ""
+        if "phasor_histogram" in self.analysed_layer.metadata:
+            # Pixels are labelled with their row in the features table, so
+            # cluster ids are mapped to the labels (of any dimensions) with a
+            # lookup table
+            from napari.layers import Labels
+            from napari.utils import DirectLabelColormap
+
+            label_ids = np.asarray(self.label_ids)
+            lookup_table = np.zeros(label_ids.max() + 1, dtype=np.uint32)
+            lookup_table[label_ids] = np.asarray(cluster_ids) + 1
+            labels = self.analysed_layer.data
+            if isinstance(labels, np.ndarray):
+                cluster_data = lookup_table[labels]
+            else:
+                cluster_data = labels.map_blocks(
+                    lookup_table.__getitem__, dtype=lookup_table.dtype
+                )
+            visualized_layer = Labels(
+                cluster_data,
+                colormap=DirectLabelColormap(color_dict=cmap_dict),
+                name="cluster_ids_in_space",
+                scale=self.layer_select.value.scale,
+            )
+        else:
+            visualized_layer = super()._draw_cluster_image(
+                is_tracking_data, plot_cluster_name, cluster_ids, cmap_dict
+            )
+        image_layer_name = re.sub(
+            r"^Labelled_(pixels|objects)_from_",
+            "",
+            self.layer_select.value.name,
         )
         visualized_layer.name = "Phasor_clusters_from_" + image_layer_name
         visualized_layer.opacity = 0.5
@@ -114,6 +436,41 @@ class PhasorPlotterWidget(PlotterWidget):
         ax.plot(x, y, "white", alpha=0.3)
         return ax
 
+    def get_phasor_histogram(
+        self,
+        bin_number=None,
+        plot_x_axis_name=None,
+        plot_y_axis_name=None,
+        n_points=None,
+    ):
+        """
+        Get the phasor histogram of the plotted features, if available
+
+        Layers created by the phasor widgets keep a `PhasorHistogram` of
+        their 'G' and 'S' features in their metadata. It is rebinned (once)
+        if the number of bins changed. Axes names default to the plotted
+        ones and the number of points to the number of rows of the layer
+        features.
+        """
+        layer = self.layer_select.value
+        if layer is None:
+            return None
+        if plot_x_axis_name is None:
+            plot_x_axis_name = self.plot_x_axis_name
+        if plot_y_axis_name is None:
+            plot_y_axis_name = self.plot_y_axis_name
+        if n_points is None:
+            n_points = len(layer.features)
+        phasor_histogram = layer.metadata.get("phasor_histogram")
+        if phasor_histogram is None or not phasor_histogram.matches(
+            plot_x_axis_name, plot_y_axis_name, n_points
+        ):
+            return None
+        if bin_number is not None and phasor_histogram.bins != bin_number:
+            phasor_histogram = phasor_histogram.rebin(bin_number)
+            layer.metadata["phasor_histogram"] = phasor_histogram
+        return phasor_histogram
+
     def add_tau_lines(self, ax, tau_list, frequency, harmonic=1):
         if not isinstance(tau_list, list):
             tau_list = [tau_list]
@@ -136,6 +493,18 @@ class PhasorPlotterWidget(PlotterWidget):
                 annotation_clip=True,
             )
 
+    def get_plotted_harmonic(self):
+        """
+        Get harmonic of the plotted phasor coordinates
+
+        Features named like 'G_harmonic_2' hold other harmonics than the one
+        from the 'G' and 'S' columns.
+        """
+        match = re.search(r"_harmonic_(\d+)$", self.plot_x_axis.currentText())
+        if match is not None:
+            return int(match.group(1))
+        return self.harmonic
+
     def add_tau_lines_from_widget(self):
         tau_lines_text = self.tau_lines_line_edit_widget.text()
         tau_list = [
@@ -147,7 +516,7 @@ class PhasorPlotterWidget(PlotterWidget):
                     self.graphics_widget.axes,
                     tau_list,
                     frequency=self.frequency,
-                    harmonic=self.harmonic,
+                    harmonic=self.get_plotted_harmonic(),
                 )
                 self.graphics_widget.draw_idle()
             else:
@@ -170,3 +539,18 @@ class PhasorPlotterWidget(PlotterWidget):
                 plot_cluster_name=self.plot_cluster_id.currentText(),
                 redraw_cluster_image=False,
             )
+
+
+class SelectFromPhasorHistogram(SelectFrom2DHistogram):
+    """Lasso selection of the bins of a `PhasorHistogram`"""
+
+    def __init__(self, parent, ax, phasor_histogram):
+        super().__init__(parent, ax, full_data=None)
+        self.phasor_histogram = phasor_histogram
+
+    def onselect(self, verts):
+        self.ind_mask = self.phasor_histogram.select(verts)
+        self.ind = np.nonzero(self.ind_mask)[0]
+
+        if self.parent.manual_clustering_method is not None:
+            self.parent.manual_clustering_method(self.ind_mask)
@@ -343,6 +343,36 @@ def get_most_frequent_file_extension(path):
     return most_frequent_file_type
 
 
+def get_laser_frequency_from_metadata(metadata, laser_frequency):
+    """Get laser frequency from '.ptu' or '.sdt' metadata, if available
+
+    Parameters
+    ----------
+    metadata : dict
+        metadata of a single channel, as returned by the read functions.
+    laser_frequency : float
+        laser frequency in MHz, returned if metadata has no laser frequency.
+
+    Returns
+    -------
+    float
+        laser frequency in MHz
+    """
+    if "file_type" in metadata:
+        if (metadata["file_type"] == "ptu") and (
+            "TTResult_SyncRate" in metadata
+        ):
+            # in MHz
+            laser_frequency = metadata["TTResult_SyncRate"] * 1e-6
+        elif metadata["file_type"] == "sdt":
+            # in MHz
+            laser_frequency = (
+                metadata["measure_info"]["StopInfo"]["max_sync_rate"][0]
+                * 10**-6
+            )
+    return laser_frequency
+
+
 def recarray_to_dict(recarray):
     # convert recarray to dict
     dictionary = {}
@@ -433,7 +463,9 @@ def flim_file_reader(path):
             data, metadata_list = imread(
                 file_path, channel_axis=channel_axis, viewer_exists=True
             )
-            if data.ndim == 4:  # expand dims if not a stack already
+            # data is None if the file is not FLIM data
+            if data is not None and data.ndim == 4:
+                # expand dims if not a stack already
                 data = np.expand_dims(
                     data, axis=(2, 3)
                 )  # (ch, ut, t, z, y, x)
@@ -459,10 +491,19 @@ def flim_file_reader(path):
         ]
 
         summed_intensity_image = np.sum(data, axis=1, keepdims=False)
+        # The phasor widgets take these projections from the layer metadata
+        # instead of summing the decays again
+        flim_metadata_list = [
+            dict(
+                metadata_list[channel] if len(metadata_list) > 0 else {},
+                intensity_image=summed_intensity_image[channel],
+            )
+            for channel in range(data.shape[0])
+        ]
         # arguments for TCSPC stack
         add_kwargs = {
             "channel_axis": 0,
-            "metadata": metadata_list,
+            "metadata": flim_metadata_list,
             "name": "FLIM_" + Path(path).stem,
         }
         layer_type = "image"
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import tifffile
+from napari_flim_phasor_plotter.batch import analyze_folder
+from napari_flim_phasor_plotter._synthetic import (
+    make_synthetic_flim_data,
+    create_time_array,
+)
+
+
+def test_analyze_folder(tmp_path):
+    time_array = create_time_array(40, 64)
+    flim_data = make_synthetic_flim_data(time_array, 100, [0.5, 1, 2, 3, 4, 5])
+    # (ch, ut, y, x)
+    flim_data = np.stack([flim_data, flim_data]).reshape(2, 64, 2, 3)
+    for name in ["image_1", "image_2"]:
+        tifffile.imwrite(
+            tmp_path / f"{name}.tif", flim_data, photometric="minisblack"
+        )
+    # objects of the second file
+    tifffile.imwrite(
+        tmp_path / "image_2_labels.tif",
+        np.array([[1, 1, 0], [2, 2, 2]], dtype=np.uint16),
+    )
+
+    output_path = tmp_path / "summary.csv"
+    summary = analyze_folder(tmp_path, output_path, n_workers=2)
+    assert sorted(summary["file"].unique()) == ["image_1.tif", "image_2.tif"]
+    assert list(summary.groupby("file").size()) == [2, 6]
+    assert summary["channel"].max() == 1
+    assert (summary["n_pixels"] > 0).all()
+    # photon-weighted average matches the phasor of the summed decay
+    image_row = summary[summary["label"] == 0].iloc[0]
+    assert 0 < image_row["G"] < 1 and 0 < image_row["S"] < 0.5
+    objects = summary[
+        (summary["file"] == "image_2.tif") & (summary["label"] > 0)
+    ]
+    assert list(objects["n_pixels"]) == [2, 3, 2, 3]
+
+    # files already in the summary table are skipped
+    tifffile.imwrite(
+        tmp_path / "image_3.tif", flim_data, photometric="minisblack"
+    )
+    summary = analyze_folder(tmp_path, output_path, n_workers=1)
+    assert len(summary) == 10
+    assert pd.read_csv(output_path)["file"].value_counts()["image_1.tif"] == 2
+
+
+def test_analyze_file_not_flim(tmp_path):
+    import pytest
+    from napari_flim_phasor_plotter.batch import analyze_file
+
+    path = tmp_path / "intensity.tif"
+    tifffile.imwrite(path, np.ones((3, 3), dtype=np.uint16))
+    with pytest.raises(ValueError, match="intensity.tif' is not a FLIM file"):
+        analyze_file(path)
@@ -0,0 +1,46 @@
+import gc
+import numpy as np
+import dask.array as da
+from napari_flim_phasor_plotter._cache import PhasorCache
+
+
+def test_phasor_cache():
+    cache = PhasorCache(max_bytes=3 * 8 * 100)
+    data = np.zeros((8, 10))
+    key = cache.data_key(data)
+    assert key == cache.data_key(data)
+    assert key != cache.data_key(np.zeros((8, 10)))
+    assert cache.data_key(da.zeros(3)) == cache.data_key(da.zeros(3))
+
+    for i in range(3):
+        cache.set(key + (i,), np.full(100, i, dtype=np.float64))
+    assert len(cache) == 3
+    # using the first entry makes the second the least recently used
+    assert cache.get(key + (0,))[0] == 0
+    cache.set(key + (3,), (np.zeros(50), np.zeros(50)))
+    assert key + (1,) not in cache
+    assert len(cache) == 3
+    assert cache.nbytes <= cache.max_bytes
+    # too large to be cached
+    cache.set(key + (4,), np.zeros(1000))
+    assert cache.get(key + (4,)) is None
+
+    # entries are dropped once the data is garbage collected
+    del data
+    gc.collect()
+    assert len(cache) == 0
+    assert cache.nbytes == 0
+
+
+def test_phasor_cache_data_edited_in_place():
+    cache = PhasorCache()
+    data = np.zeros((8, 10))
+    key = cache.data_key(data)
+    cache.set(key + ("intensity",), data.sum(axis=0))
+    assert cache.data_key(data) == key
+    assert key + ("intensity",) in cache
+
+    # edits are detected from a checksum of (a sample of) the values
+    data[2, 3] = 1
+    assert cache.data_key(data) == key
+    assert key + ("intensity",) not in cache
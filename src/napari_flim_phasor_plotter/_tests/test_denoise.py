@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("shape", [(2, 3, 9, 11), (2, 1, 9, 11), (9, 11)])
+def test_median_filter_phasor(shape):
+    import dask.array as da
+    from napari_flim_phasor_plotter.denoise import median_filter_phasor
+    from napari_flim_phasor_plotter.filters import apply_median_filter
+
+    rng = np.random.default_rng(0)
+    g = rng.random(shape).astype(np.float32)
+    s = rng.random(shape).astype(np.float32)
+
+    # Same output as the skimage median filter, with the same shape
+    g_filtered, s_filtered = median_filter_phasor(g, s, n=2)
+    assert g_filtered.shape == shape
+    assert g_filtered.dtype == np.float32
+    assert np.array_equal(g_filtered, apply_median_filter(g, 2))
+    assert np.array_equal(s_filtered, apply_median_filter(s, 2))
+
+    # Dask blocks give the same output
+    g_dask, s_dask = median_filter_phasor(
+        da.from_array(g, chunks=4), da.from_array(s, chunks=4), n=2
+    )
+    assert np.array_equal(g_dask.compute(), g_filtered)
+    assert np.array_equal(s_dask.compute(), s_filtered)
+
+    # Weighted median with equal weights is the median
+    g_weighted, _ = median_filter_phasor(g, s, n=2, intensity=np.ones(shape))
+    assert np.array_equal(g_weighted, g_filtered)
+
+
+def test_weighted_median_filter_phasor():
+    from napari_flim_phasor_plotter.denoise import median_filter_phasor
+
+    g = np.zeros((5, 5), dtype=np.float32)
+    s = np.zeros((5, 5), dtype=np.float32)
+    g[2, 2] = s[2, 2] = 1
+    intensity = np.ones((5, 5))
+
+    # A single bright pixel keeps its phasor, a dim one is filtered away
+    intensity[2, 2] = 100
+    g_filtered, s_filtered = median_filter_phasor(g, s, intensity=intensity)
+    assert g_filtered[2, 2] == 1 and s_filtered[2, 2] == 1
+    g_filtered, _ = median_filter_phasor(g, s)
+    assert g_filtered[2, 2] == 0
@@ -130,3 +130,218 @@ def test_median_filter():
 
     assert np.allclose(g_median_filt, g_median_filt_expected, atol=1e-5)
     assert np.allclose(s_median_filt, s_median_filt_expected, atol=1e-5)
+
+
+def test_time_window():
+    import numpy as np
+    import pytest
+    import dask.array as da
+    from napari_flim_phasor_plotter.phasor import get_phasor_components
+    from napari_flim_phasor_plotter._synthetic import (
+        make_synthetic_flim_data,
+        create_time_array,
+    )
+    from napari_flim_phasor_plotter.filters import (
+        make_time_window,
+        make_time_mask,
+    )
+
+    frequency = 40
+    n_points = 64
+    time_array = create_time_array(frequency, n_points)
+    flim_data = make_synthetic_flim_data(time_array, 100, [1, 2, 3, 4])
+    # shift decays so that their maximum is not at the first time point
+    flim_data = np.roll(flim_data, 5, axis=0).reshape(n_points, 2, 2)
+
+    time_window = make_time_window(flim_data, frequency)
+    time_mask = make_time_mask(flim_data, frequency)
+    assert time_window == slice(5, n_points)
+    assert np.array_equal(np.flatnonzero(time_mask), np.arange(5, n_points))
+    # slicing the microtime axis gives a view
+    assert np.shares_memory(flim_data[time_window], flim_data)
+
+    g, s, dc = get_phasor_components(flim_data[time_mask])
+    g_window, s_window, dc_window = get_phasor_components(
+        flim_data, time_window=time_window
+    )
+    assert np.allclose(g_window, g)
+    assert np.allclose(s_window, s)
+    assert np.allclose(dc_window, dc)
+
+    # other detection methods find the same start, also on dask arrays
+    flim_data_dask = da.from_array(flim_data, chunks=(n_points, 1, 2))
+    for method in ["summed_decay", "subsample"]:
+        for data in [flim_data, flim_data_dask]:
+            assert make_time_window(
+                data, frequency, method=method, n_samples=3
+            ) == slice(5, n_points)
+    with pytest.raises(ValueError):
+        make_time_window(flim_data, frequency, method="maximum")
+
+
+def test_intensity_image():
+    import numpy as np
+    import dask.array as da
+    from napari.layers.utils.stack_utils import slice_from_axis
+    from napari_flim_phasor_plotter.filters import (
+        get_intensity_image,
+        set_intensity_image,
+        make_space_mask_from_manual_threshold,
+    )
+
+    flim_data = np.random.default_rng(0).poisson(2, (8, 1, 2, 3, 4))
+    intensity_image = get_intensity_image(flim_data)
+    assert np.array_equal(intensity_image, flim_data.sum(axis=0))
+    # computed once and reused
+    assert get_intensity_image(flim_data) is intensity_image
+    assert np.array_equal(
+        make_space_mask_from_manual_threshold(flim_data, 16),
+        intensity_image >= 16,
+    )
+
+    # dask projections are lazy until a computed one is stored
+    flim_data_dask = da.from_array(flim_data, chunks=(8, 1, 1, 3, 4))
+    intensity_image_dask = get_intensity_image(flim_data_dask)
+    assert isinstance(intensity_image_dask, da.Array)
+    set_intensity_image(flim_data_dask, intensity_image_dask.compute())
+    assert np.array_equal(get_intensity_image(flim_data_dask), intensity_image)
+
+    # channels split by napari share projections set on channel slices
+    channels = da.stack([flim_data_dask, flim_data_dask])
+    set_intensity_image(channels[1], intensity_image)
+    channel = slice_from_axis(channels, axis=0, element=1)
+    assert get_intensity_image(channel) is intensity_image
+
+
+def test_binning_matches_convolution():
+    import numpy as np
+    from scipy.ndimage import convolve
+    from napari_flim_phasor_plotter.filters import apply_binning
+
+    rng = np.random.default_rng(0)
+    flim_data = rng.poisson(5, (3, 2, 4, 6, 7)).astype(np.uint16)
+    for bin_size in [1, 2, 3, 4, 6]:
+        binned_3D = apply_binning(flim_data, bin_size, binning_3D=True)
+        binned_2D = apply_binning(flim_data, bin_size, binning_3D=False)
+        for utime, time in np.ndindex(flim_data.shape[:2]):
+            assert np.array_equal(
+                binned_3D[utime, time],
+                convolve(
+                    flim_data[utime, time], np.ones((bin_size,) * 3, int)
+                ),
+            )
+            for z in range(flim_data.shape[2]):
+                assert np.array_equal(
+                    binned_2D[utime, time, z],
+                    convolve(
+                        flim_data[utime, time, z],
+                        np.ones((bin_size,) * 2, int),
+                    ),
+                )
+
+    # float sums do not drift along the running sums, and all-zero regions
+    # stay exactly zero
+    flim_data = rng.exponential(1000, (3, 2, 4, 6, 40)).astype(np.float32)
+    flim_data[..., :20] *= 1e-4
+    flim_data[..., 30:] = 0
+    for bin_size in [2, 3]:
+        binned_3D = apply_binning(flim_data, bin_size, binning_3D=True)
+        binned_2D = apply_binning(flim_data, bin_size, binning_3D=False)
+        assert binned_3D.dtype == np.float32
+        assert binned_2D.dtype == np.float32
+        assert np.all(binned_3D[..., 32:] == 0)
+        assert np.all(binned_2D[..., 32:] == 0)
+        for utime, time in np.ndindex(flim_data.shape[:2]):
+            np.testing.assert_allclose(
+                binned_3D[utime, time],
+                convolve(
+                    flim_data[utime, time].astype(np.float64),
+                    np.ones((bin_size,) * 3),
+                ),
+                rtol=1e-6,
+            )
+            for z in range(flim_data.shape[2]):
+                np.testing.assert_allclose(
+                    binned_2D[utime, time, z],
+                    convolve(
+                        flim_data[utime, time, z].astype(np.float64),
+                        np.ones((bin_size,) * 2),
+                    ),
+                    rtol=1e-6,
+                )
+
+
+def test_binning_dask():
+    import numpy as np
+    import dask.array as da
+    from napari_flim_phasor_plotter.filters import apply_binning
+
+    rng = np.random.default_rng(0)
+    flim_data = rng.poisson(5, (3, 2, 5, 9, 11)).astype(np.uint16)
+    # blocks smaller than the overlap along z
+    flim_data_dask = da.from_array(flim_data, chunks=(2, 1, 2, 4, 5))
+    for bin_size in [2, 3, 4]:
+        for binning_3D in [True, False]:
+            binned = apply_binning(flim_data_dask, bin_size, binning_3D)
+            assert isinstance(binned, da.Array)
+            assert binned.shape == flim_data.shape
+            assert np.array_equal(
+                binned.compute(),
+                apply_binning(flim_data, bin_size, binning_3D),
+            )
+    # (ut, y, x) data
+    binned = apply_binning(flim_data_dask[:, 0, 0], 3)
+    assert np.array_equal(
+        binned.compute(), apply_binning(flim_data[:, 0, 0], 3)
+    )
+
+
+def test_binning_dtype():
+    import numpy as np
+    from napari_flim_phasor_plotter.filters import apply_binning
+
+    # sums of 27 full uint8 pixels need uint16
+    flim_data = np.full((2, 1, 3, 4, 4), 255, dtype=np.uint8)
+    binned = apply_binning(flim_data, 3, binning_3D=True)
+    assert binned.dtype == np.uint16
+    assert np.all(binned == 255 * 27)
+
+    # small counts keep the input type
+    binned = apply_binning(flim_data // 100, 3, binning_3D=False)
+    assert binned.dtype == np.uint8
+    assert np.all(binned == 2 * 9)
+
+    flim_data = np.full((2, 3, 3), -100, dtype=np.int8)
+    binned = apply_binning(flim_data, 2)
+    assert binned.dtype == np.int16
+    assert np.all(binned == -100 * 8)
+
+
+def test_binning_downsample():
+    import numpy as np
+    import dask.array as da
+    from napari_flim_phasor_plotter.filters import apply_binning
+
+    flim_data = np.random.default_rng(0).poisson(5, (3, 2, 5, 7, 9))
+    binned = apply_binning(flim_data, 2, binning_3D=True, downsample=True)
+    # pixels beyond the last full block are discarded
+    assert binned.shape == (3, 2, 2, 3, 4)
+    assert binned[1, 0, 1, 2, 3] == flim_data[1, 0, 2:4, 4:6, 6:8].sum()
+
+    binned_2D = apply_binning(flim_data, 2, binning_3D=False, downsample=True)
+    assert binned_2D.shape == (3, 2, 5, 3, 4)
+    assert binned_2D[2, 1, 4, 0, 0] == flim_data[2, 1, 4, :2, :2].sum()
+
+    # dask arrays are binned lazily, with the same result
+    binned_dask = apply_binning(
+        da.from_array(flim_data, chunks=(1, 1, 2, 3, 4)),
+        2,
+        binning_3D=True,
+        downsample=True,
+    )
+    assert isinstance(binned_dask, da.Array)
+    assert np.array_equal(binned_dask.compute(), binned)
+
+    # without time and z, and with fewer z slices than the bin size
+    binned = apply_binning(flim_data[:, 0, 0], 3, downsample=True)
+    assert binned.shape == (3, 2, 3)
@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+from matplotlib.path import Path
+from napari_clusters_plotter._plotter_utilities import estimate_number_bins
+from napari_flim_phasor_plotter._histogram import PhasorHistogram
+
+
+def test_phasor_histogram():
+    rng = np.random.default_rng(0)
+    g = rng.uniform(0, 1, 1000).astype(np.float32)
+    s = rng.uniform(0, 0.5, 1000).astype(np.float32)
+    g[0] = np.nan
+
+    phasor_histogram = PhasorHistogram(g, s, bins=20)
+    expected, x_edges, y_edges = np.histogram2d(
+        g[1:], s[1:], bins=20, range=phasor_histogram.range
+    )
+    assert np.array_equal(phasor_histogram.counts, expected)
+    assert np.allclose(phasor_histogram.x_edges, x_edges)
+    assert phasor_histogram.bin_index[0] == -1
+
+    # selection is the same as testing every pixel
+    vertices = [(0.1, 0.05), (0.73, 0.12), (0.52, 0.47), (0.2, 0.3)]
+    mask = phasor_histogram.select(vertices)
+    expected = Path(vertices).contains_points(np.stack([g, s], axis=-1))
+    assert not mask[0]
+    assert np.array_equal(mask, expected)
+
+    rebinned = phasor_histogram.rebin(10)
+    assert rebinned.counts.shape == (10, 10)
+    assert rebinned.counts.sum() == phasor_histogram.counts.sum() == 999
+    assert np.array_equal(rebinned.select(vertices), expected)
+    assert rebinned.estimate_number_bins() == int(
+        max(estimate_number_bins(g), estimate_number_bins(s))
+    )
+
+
+def test_phasor_histogram_append():
+    rng = np.random.default_rng(0)
+    g = rng.uniform(0, 1, 1000)
+    s = rng.uniform(0, 0.5, 1000)
+
+    phasor_histogram = PhasorHistogram(g[:600], s[:600], bins=20)
+    # pixels inside the range are added to the same histogram
+    inside = (g[600:] > g[:600].min()) & (g[600:] < g[:600].max())
+    inside &= (s[600:] > s[:600].min()) & (s[600:] < s[:600].max())
+    g_new, s_new = g[600:][inside], s[600:][inside]
+    appended = phasor_histogram.append(g_new, s_new)
+    assert appended is phasor_histogram
+    expected = np.histogram2d(
+        np.concatenate([g[:600], g_new]),
+        np.concatenate([s[:600], s_new]),
+        bins=20,
+        range=phasor_histogram.range,
+    )[0]
+    assert np.array_equal(appended.counts, expected)
+    assert np.array_equal(appended.g, np.concatenate([g[:600], g_new]))
+
+    # pixels outside the range rebuild the histogram
+    rebuilt = appended.append([1.5], [0.25])
+    assert rebuilt is not appended
+    assert rebuilt.range[0][1] == 1.5
+    assert rebuilt.counts.sum() == len(appended.g) + 1
+
+
+def test_phasor_histogram_slices():
+    rng = np.random.default_rng(0)
+    g = rng.uniform(0, 1, 1000)
+    s = rng.uniform(0, 0.5, 1000)
+    frames = np.repeat(np.arange(4), 250)
+    clusters = rng.integers(-1, 3, 1000)
+
+    phasor_histogram = PhasorHistogram(
+        g[:500], s[:500], bins=20, slices={"frame": frames[:500]}
+    )
+    with pytest.raises(ValueError):
+        phasor_histogram.append(g[500:], s[500:])
+    phasor_histogram = phasor_histogram.append(
+        g[500:], s[500:], slices={"frame": frames[500:]}
+    )
+    assert list(phasor_histogram.get_slice_values("frame")) == [0, 1, 2, 3]
+    assert phasor_histogram.get_counts() is phasor_histogram.counts
+
+    # slices and clusters are counted from the bin index of each pixel
+    for frame in range(4):
+        expected = np.histogram2d(
+            g[frames == frame],
+            s[frames == frame],
+            bins=20,
+            range=phasor_histogram.range,
+        )[0]
+        assert np.array_equal(
+            phasor_histogram.get_counts(frame=frame), expected
+        )
+    cluster_values, cluster_counts = phasor_histogram.get_cluster_counts(
+        clusters, frame=2
+    )
+    assert list(cluster_values) == [-1, 0, 1, 2]
+    for cluster, counts in zip(cluster_values, cluster_counts):
+        inside = (clusters == cluster) & (frames == 2)
+        expected = np.histogram2d(
+            g[inside], s[inside], bins=20, range=phasor_histogram.range
+        )[0]
+        assert np.array_equal(counts, expected)
+
+    # slices are kept when rebinning
+    rebinned = phasor_histogram.rebin(10)
+    assert np.array_equal(
+        rebinned.get_counts(frame=3),
+        np.histogram2d(
+            g[750:], s[750:], bins=10, range=phasor_histogram.range
+        )[0],
+    )
@@ -0,0 +1,494 @@
+import numpy as np
+import dask.array as da
+from napari_flim_phasor_plotter.phasor import get_phasor_components
+from napari_flim_phasor_plotter._synthetic import (
+    make_synthetic_flim_data,
+    create_time_array,
+)
+
+# Global inputs
+laser_frequency = 40  # MHz
+number_of_time_points = 64
+tau_list = [0.5, 1, 2, 3, 4, 5]  # ns
+
+
+def make_flim_data():
+    """Make synthetic FLIM data with dimensions (ut, time, z, y, x)"""
+    time_array = create_time_array(laser_frequency, number_of_time_points)
+    flim_data = make_synthetic_flim_data(time_array, 100, tau_list)
+    return flim_data.reshape(number_of_time_points, 1, 1, 2, 3)
+
+
+def test_projection_matches_fft():
+    flim_data = make_flim_data()
+
+    for harmonic in [1, 2]:
+        g_fft, s_fft, dc_fft = get_phasor_components(
+            flim_data, harmonic=harmonic, method="fft"
+        )
+        g, s, dc = get_phasor_components(
+            flim_data, harmonic=harmonic, method="projection"
+        )
+        assert g.shape == g_fft.shape
+        assert np.allclose(g, g_fft, rtol=0, atol=1e-6)
+        assert np.allclose(s, s_fft, rtol=0, atol=1e-6)
+        assert np.allclose(dc, dc_fft, rtol=1e-6)
+
+        # dask input
+        g_dask, s_dask, dc_dask = get_phasor_components(
+            da.from_array(flim_data, chunks=(-1, 1, 1, 1, 3)),
+            harmonic=harmonic,
+            method="projection",
+        )
+        assert isinstance(g_dask, da.Array)
+        assert np.allclose(g_dask.compute(), g_fft, rtol=0, atol=1e-6)
+        assert np.allclose(s_dask.compute(), s_fft, rtol=0, atol=1e-6)
+        assert np.allclose(dc_dask.compute(), dc_fft, rtol=1e-6)
+
+
+def test_multiple_harmonics():
+    flim_data = make_flim_data()
+    harmonics = [1, 2, 3]
+
+    for method in ["fft", "projection"]:
+        g, s, dc = get_phasor_components(
+            flim_data, harmonics=harmonics, method=method
+        )
+        assert g.shape == (len(harmonics),) + flim_data.shape[1:]
+        assert s.shape == (len(harmonics),) + flim_data.shape[1:]
+        assert dc.shape == flim_data.shape[1:]
+        for i, harmonic in enumerate(harmonics):
+            g_single, s_single, _ = get_phasor_components(
+                flim_data, harmonic=harmonic, method=method
+            )
+            assert np.allclose(g[i], g_single, rtol=0, atol=1e-6)
+            assert np.allclose(s[i], s_single, rtol=0, atol=1e-6)
+
+
+def test_phasor_weights():
+    from napari_flim_phasor_plotter.phasor import get_phasor_weights
+
+    weights = get_phasor_weights(64, [1, 2], dtype=np.float32)
+    assert weights.dtype == np.float32
+    assert not weights.flags.writeable
+    # tables are shared between calls with the same settings
+    assert get_phasor_weights(64, (1, 2), dtype=np.float32) is weights
+    assert np.allclose(
+        weights[2], np.cos(4 * np.pi * np.arange(64) / 64), atol=1e-6
+    )
+
+    # the time window holds the weights of a shorter decay
+    windowed = get_phasor_weights(64, [1, 2], time_window=(8, 40))
+    assert np.array_equal(windowed[:, :8], np.zeros((5, 8)))
+    assert np.array_equal(windowed[:, 40:], np.zeros((5, 24)))
+    assert np.array_equal(windowed[:, 8:40], get_phasor_weights(32, [1, 2]))
+
+
+def test_numba_kernel():
+    flim_data = make_flim_data().astype(np.uint16)
+    # add a pixel without photons
+    flim_data[..., 0, 0] = 0
+
+    g_fft, s_fft, dc_fft = get_phasor_components(
+        flim_data, harmonics=[1, 2], method="fft"
+    )
+    g, s, dc = get_phasor_components(
+        flim_data, harmonics=[1, 2], method="numba", n_threads=2
+    )
+    assert g.dtype == s.dtype == dc.dtype == np.float32
+    assert np.allclose(g, g_fft, rtol=0, atol=1e-6)
+    assert np.allclose(s, s_fft, rtol=0, atol=1e-6)
+    assert np.allclose(dc, dc_fft, rtol=1e-6)
+
+
+def test_ptu_phasor_components(tmp_path):
+    import ptufile
+    from napari_flim_phasor_plotter.phasor import get_ptu_phasor_components
+
+    rng = np.random.default_rng(0)
+    n_bins = 32
+    data = rng.poisson(2, (3, 6, 7, 2, n_bins)).astype(np.uint16)  # TYXCH
+    file_path = tmp_path / "timelapse.ptu"
+    ptufile.imwrite(
+        file_path,
+        data,
+        global_resolution=1 / (laser_frequency * 1e6),
+        tcspc_resolution=1 / (laser_frequency * 1e6) / n_bins,
+        # long pixel time to get time tag overflows between lines
+        pixel_time=30000 / (laser_frequency * 1e6),
+        has_frames=True,
+    )
+    # (C, H, T, Z, Y, X)
+    histograms = np.moveaxis(data, [3, 4], [0, 1])[:, :, :, np.newaxis]
+
+    # small chunks split markers and overflows between chunks
+    for chunk_size in [2**22, 1000]:
+        g, s, dc = get_ptu_phasor_components(
+            file_path, harmonics=[1, 2], chunk_size=chunk_size
+        )
+        assert g.shape == (2,) + histograms.shape[:1] + histograms.shape[2:]
+        for channel in range(histograms.shape[0]):
+            g_expected, s_expected, dc_expected = get_phasor_components(
+                histograms[channel], harmonics=[1, 2]
+            )
+            assert np.allclose(g[:, channel], g_expected, atol=1e-6)
+            assert np.allclose(s[:, channel], s_expected, atol=1e-6)
+            assert np.allclose(dc[channel], dc_expected)
+
+    # photons outside of the time window are ignored
+    g, s, dc = get_ptu_phasor_components(file_path, time_window=(4, n_bins))
+    for channel in range(histograms.shape[0]):
+        g_expected, s_expected, dc_expected = get_phasor_components(
+            histograms[channel, 4:]
+        )
+        assert np.allclose(g[channel], g_expected, atol=1e-6)
+        assert np.allclose(s[channel], s_expected, atol=1e-6)
+        assert np.allclose(dc[channel], dc_expected)
+
+
+def test_numba_dask(tmp_path):
+    import zarr
+    from dask.core import flatten
+    from napari_flim_phasor_plotter.phasor import (
+        get_phasor_components_from_zarr,
+        phasor_4d_dask,
+    )
+
+    flim_data = make_flim_data().astype(np.uint16)
+    flim_data[..., 0, 0] = 0
+    g_expected, s_expected, dc_expected = get_phasor_components(
+        flim_data, harmonics=[1, 2]
+    )
+
+    # microtime split in several chunks gets rechunked
+    g, s, dc = get_phasor_components(
+        da.from_array(flim_data, chunks=(16, 1, 1, 1, 2)), harmonics=[1, 2]
+    )
+    assert isinstance(g, da.Array)
+    assert g.dtype == s.dtype == dc.dtype == np.float32
+    assert np.allclose(g.compute(), g_expected, rtol=0, atol=1e-6)
+    assert np.allclose(s.compute(), s_expected, rtol=0, atol=1e-6)
+    assert np.allclose(dc.compute(), dc_expected, rtol=1e-6)
+
+    # (ch, ut, t, z, y, x) zarr, like the ones from convert_folder_to_zarr
+    zarr_path = tmp_path / "stack.zarr"
+    zarr.save(str(zarr_path), np.stack([flim_data, flim_data]))
+    g, s, dc = get_phasor_components_from_zarr(zarr_path, harmonics=[1, 2])
+    assert (tmp_path / "stack_phasor.zarr").exists()
+    assert g.shape == (2, 2) + flim_data.shape[1:]
+    assert np.allclose(g[1].compute(), g_expected, rtol=0, atol=1e-6)
+    assert np.allclose(s[1].compute(), s_expected, rtol=0, atol=1e-6)
+    assert np.allclose(dc[1].compute(), dc_expected, rtol=1e-6)
+
+    # chunked zarr: each chunk of the outputs depends on a single chunk of
+    # the input, and zero DC pixels get the DC average of their channel
+    flim_data_dask = da.from_array(flim_data, chunks=(-1, 1, 1, 1, 1))
+    _, _, dc_blocks = phasor_4d_dask(flim_data_dask, [1], fill_zero_dc=False)
+    dc_block = dc_blocks.blocks[0, 0, 0, 0]
+    graph = dc_block.__dask_graph__().cull(
+        set(flatten(dc_block.__dask_keys__()))
+    )
+    assert sum(key[0] == flim_data_dask.name for key in graph) == 1
+    zarr_path = tmp_path / "chunked.zarr"
+    stack = np.stack([flim_data, 2 * flim_data])
+    zarr.open(
+        str(zarr_path),
+        mode="w",
+        shape=stack.shape,
+        chunks=(1, flim_data.shape[0], 1, 1, 1, 1),
+        dtype=stack.dtype,
+    )[:] = stack
+    g, s, dc = get_phasor_components_from_zarr(zarr_path, harmonic=2)
+    assert g.shape == (2,) + flim_data.shape[1:]
+    for channel in range(2):
+        g_expected, s_expected, dc_expected = get_phasor_components(
+            stack[channel], harmonic=2
+        )
+        assert np.allclose(g[channel], g_expected, rtol=0, atol=1e-6)
+        assert np.allclose(s[channel], s_expected, rtol=0, atol=1e-6)
+        assert np.allclose(dc[channel], dc_expected, rtol=1e-6)
+
+
+def test_tiled_phasor_components(tmp_path):
+    import zarr
+    from napari_flim_phasor_plotter.phasor import get_tiled_phasor_components
+
+    flim_data = np.tile(make_flim_data().astype(np.uint16), (1, 1, 1, 5, 4))
+    flim_data[..., 0, 0] = 0
+    g_expected, s_expected, dc_expected = get_phasor_components(
+        flim_data, harmonics=[1, 2], time_window=(4, 60)
+    )
+
+    # budget of a few pixels per tile
+    budget = 2 * 3 * flim_data.shape[0] * flim_data.itemsize + 200
+    g, s, dc = get_tiled_phasor_components(
+        flim_data,
+        harmonics=[1, 2],
+        memory_budget=budget,
+        n_workers=2,
+        time_window=(4, 60),
+    )
+    assert g.shape == g_expected.shape
+    assert np.allclose(g, g_expected, rtol=0, atol=1e-6)
+    assert np.allclose(s, s_expected, rtol=0, atol=1e-6)
+    assert np.allclose(dc, dc_expected, rtol=1e-6)
+
+    # dask input written into preallocated zarr outputs
+    out = tuple(
+        zarr.zeros(shape, chunks=(2, 2), dtype=np.float32)
+        for shape in [flim_data.shape[1:]] * 3
+    )
+    g, s, dc = get_tiled_phasor_components(
+        da.from_array(flim_data, chunks=(16, 1, 1, 3, 3)),
+        memory_budget="1kB",
+        time_window=(4, 60),
+        out=out,
+    )
+    assert g is out[0]
+    assert np.allclose(g[:], g_expected[0], rtol=0, atol=1e-6)
+    assert np.allclose(dc[:], dc_expected, rtol=1e-6)
+
+
+def test_tiled_phasor_components_zarr_chunks():
+    import zarr
+    from napari_flim_phasor_plotter.phasor import get_tiled_phasor_components
+
+    flim_data = np.tile(make_flim_data().astype(np.uint16), (1, 1, 1, 32, 32))
+    flim_data[..., :5, :7] = 0
+    g_expected, s_expected, dc_expected = get_phasor_components(
+        flim_data, harmonics=[1, 2]
+    )
+    n_points, shape = flim_data.shape[0], flim_data.shape[1:]
+    # zarr chunks that do not line up with one-row tiles
+    out = (
+        zarr.zeros((2,) + shape, chunks=(1, 1, 1, 16, 64), dtype=np.float32),
+        zarr.zeros((2,) + shape, chunks=(2, 1, 1, 24, 32), dtype=np.float32),
+        zarr.zeros(shape, chunks=(1, 1, 64, 64), dtype=np.float32),
+    )
+    n_workers = 8
+    bytes_per_pixel = n_points * flim_data.itemsize + 5 * 4
+    budget = n_workers * shape[-1] * bytes_per_pixel
+    g, s, dc = get_tiled_phasor_components(
+        flim_data,
+        harmonics=[1, 2],
+        memory_budget=budget,
+        n_workers=n_workers,
+        out=out,
+    )
+    assert np.allclose(g[:], g_expected, rtol=0, atol=1e-6)
+    assert np.allclose(s[:], s_expected, rtol=0, atol=1e-6)
+    assert np.allclose(dc[:], dc_expected, rtol=1e-6)
+
+
+def test_multichannel_phasor_components():
+    from napari_flim_phasor_plotter.phasor import (
+        get_multichannel_phasor_components,
+    )
+
+    flim_data = make_flim_data().astype(np.uint16)
+    # second channel with a shifted decay and zero DC pixel
+    flim_data = np.stack([flim_data, np.roll(flim_data, 5, axis=0)])
+    flim_data[1, :, 0, 0, 0, 0] = 0
+    time_windows = [slice(2, 64), slice(8, 60)]
+
+    for data in [
+        flim_data,
+        da.from_array(flim_data, chunks=(1, 64, 1, 1, 2, 3)),
+    ]:
+        g, s, dc = get_multichannel_phasor_components(
+            data, harmonics=[1, 2], time_windows=time_windows
+        )
+        assert g.shape == (2, 2) + flim_data.shape[2:]
+        for channel, time_window in enumerate(time_windows):
+            g_expected, s_expected, dc_expected = get_phasor_components(
+                flim_data[channel], harmonics=[1, 2], time_window=time_window
+            )
+            assert np.allclose(g[channel], g_expected, rtol=0, atol=1e-6)
+            assert np.allclose(s[channel], s_expected, rtol=0, atol=1e-6)
+            assert np.allclose(dc[channel], dc_expected, rtol=1e-6)
+
+
+def test_warm_up():
+    from napari_flim_phasor_plotter.phasor import warm_up_in_background
+
+    thread = warm_up_in_background(dtypes=(np.uint16,), ndims=(3,))
+    assert warm_up_in_background() is thread
+    thread.join()
+
+
+def test_lifetimes():
+    from napari_flim_phasor_plotter.phasor import get_lifetimes
+
+    # mono-exponential decays have equal phase and modulation lifetimes
+    omega = 2 * np.pi * laser_frequency * 1e-3  # rad/ns
+    tau = np.array(tau_list, dtype=np.float32)
+    g = 1 / (1 + (omega * tau) ** 2)
+    s = omega * tau / (1 + (omega * tau) ** 2)
+
+    tau_phase, tau_modulation = get_lifetimes(g, s, laser_frequency)
+    assert tau_phase.dtype == np.float32
+    assert np.allclose(tau_phase, tau, rtol=1e-5)
+    assert np.allclose(tau_modulation, tau, rtol=1e-3)
+
+    tau_phase, tau_modulation = get_lifetimes(
+        da.from_array(g, chunks=2), s, laser_frequency
+    )
+    assert isinstance(tau_phase, da.Array)
+    assert np.allclose(tau_phase.compute(), tau, rtol=1e-5)
+    assert np.allclose(tau_modulation.compute(), tau, rtol=1e-3)
+
+    # undefined lifetimes
+    tau_phase, tau_modulation = get_lifetimes(
+        np.zeros(1, dtype=np.float32),
+        np.zeros(1, dtype=np.float32),
+        laser_frequency,
+    )
+    assert np.isnan(tau_phase[0]) and np.isnan(tau_modulation[0])
+
+
+def test_phasor_statistics():
+    from napari_flim_phasor_plotter.phasor import (
+        get_lifetimes,
+        get_phasor_statistics,
+    )
+
+    rng = np.random.default_rng(0)
+    shape = (2, 3, 4, 5)  # (time, z, y, x)
+    g = rng.uniform(0.1, 0.9, shape).astype(np.float32)
+    s = rng.uniform(0.1, 0.5, shape).astype(np.float32)
+    dc = rng.uniform(0, 100, shape)
+    space_mask = dc > 20
+
+    table = get_phasor_statistics(
+        g, s, dc, laser_frequency, space_mask=space_mask, by="slice"
+    )
+    assert len(table) == 6
+    assert list(table["frame"]) == [0, 0, 0, 1, 1, 1]
+    assert list(table["z"]) == [0, 1, 2, 0, 1, 2]
+
+    # second frame, third slice
+    mask = space_mask[1, 2]
+    g_slice, s_slice, dc_slice = g[1, 2][mask], s[1, 2][mask], dc[1, 2][mask]
+    tau_phase, _ = get_lifetimes(g_slice, s_slice, laser_frequency)
+    row = table.iloc[5]
+    assert row["n_pixels"] == mask.sum()
+    assert np.isclose(row["photon_count"], dc_slice.sum())
+    assert np.isclose(row["G"], np.average(g_slice, weights=dc_slice))
+    assert np.isclose(row["S_mean"], s_slice.mean())
+    assert np.isclose(row["G_std"], g_slice.std())
+    assert np.isclose(
+        row["tau_phase"], np.average(tau_phase, weights=dc_slice)
+    )
+
+    # dask arrays give the same table, per frame too
+    chunks = (1, 2, 2, 5)
+    table_dask = get_phasor_statistics(
+        da.from_array(g, chunks=chunks),
+        da.from_array(s, chunks=chunks),
+        da.from_array(dc, chunks=chunks),
+        laser_frequency,
+        space_mask=da.from_array(space_mask, chunks=chunks),
+    )
+    table_frame = get_phasor_statistics(
+        g, s, dc, laser_frequency, space_mask=space_mask
+    )
+    assert len(table_frame) == 2 and "z" not in table_frame
+    assert np.allclose(table_dask.values, table_frame.values)
+
+
+def test_calibration():
+    from napari_flim_phasor_plotter.phasor import (
+        get_calibration_parameters,
+        get_lifetimes,
+    )
+
+    # reference and sample measured with an instrument delay
+    delay = 7
+    time_array = create_time_array(laser_frequency, number_of_time_points)
+    reference = make_synthetic_flim_data(time_array, 100, [2])
+    reference = np.roll(reference, delay, axis=0).reshape(-1, 1, 1, 1, 1)
+    flim_data = np.roll(make_flim_data(), delay, axis=0)
+
+    calibration = get_calibration_parameters(
+        reference, 2, laser_frequency, harmonics=[1, 2]
+    )
+    assert set(calibration) == {1, 2}
+    # parameters are cached
+    assert (
+        get_calibration_parameters(
+            reference, 2, laser_frequency, harmonics=[1, 2]
+        )
+        is calibration
+    )
+
+    # delay is corrected
+    for method in ["numba", "fft", "projection"]:
+        g, s, _ = get_phasor_components(
+            flim_data, harmonics=[1, 2], method=method, calibration=calibration
+        )
+        tau_phase, tau_modulation = get_lifetimes(g[0], s[0], laser_frequency)
+        assert np.allclose(tau_modulation.ravel(), tau_list, rtol=1e-2)
+    g, s, _ = get_phasor_components(
+        da.from_array(flim_data), harmonics=[1, 2], calibration=calibration
+    )
+    tau_phase, tau_modulation = get_lifetimes(g[0], s[0], laser_frequency)
+    assert np.allclose(tau_modulation.compute().ravel(), tau_list, rtol=1e-2)
+
+
+def test_object_phasor_components():
+    from napari_flim_phasor_plotter.phasor import get_object_phasor_components
+
+    flim_data = make_flim_data()
+    # (y, x) labels broadcast to (time, z, y, x), label 2 is missing
+    label_image = np.array([[1, 1, 3], [0, 3, 4]])
+
+    for data in [flim_data, da.from_array(flim_data, chunks=(16, 1, 1, 1, 2))]:
+        labels, g, s, dc = get_object_phasor_components(
+            data, label_image, harmonics=[1, 2]
+        )
+        assert np.array_equal(labels, [1, 3, 4])
+        assert g.shape == s.shape == (2, 3)
+        for i, label in enumerate(labels):
+            # phasor of the summed decay of the object
+            decay = flim_data[:, 0, 0][:, label_image == label].sum(axis=1)
+            g_expected, s_expected, dc_expected = get_phasor_components(
+                decay.reshape(-1, 1), harmonics=[1, 2], method="fft"
+            )
+            assert np.allclose(g[:, i], g_expected[:, 0])
+            assert np.allclose(s[:, i], s_expected[:, 0])
+            assert np.isclose(dc[i], dc_expected[0])
+
+
+def test_component_fractions():
+    from napari_flim_phasor_plotter.phasor import get_component_fractions
+
+    lifetimes = [0.5, 2, 6]
+    omega_tau = 2 * np.pi * laser_frequency * 1e-3 * np.array(lifetimes)
+    component_g = 1 / (1 + omega_tau**2)
+    component_s = omega_tau / (1 + omega_tau**2)
+    rng = np.random.default_rng(0)
+    fractions = rng.dirichlet(np.ones(3), size=(2, 4)).astype(np.float32)
+
+    for n_components in [2, 3]:
+        f = fractions[..., :n_components]
+        f = f / f.sum(axis=-1, keepdims=True)
+        g = f @ component_g[:n_components].astype(np.float32)
+        s = f @ component_s[:n_components].astype(np.float32)
+
+        results = get_component_fractions(
+            g, s, lifetimes[:n_components], laser_frequency
+        )
+        assert len(results) == n_components
+        for i, result in enumerate(results):
+            assert result.dtype == np.float32
+            assert np.allclose(result, f[..., i], atol=1e-4)
+
+        results = get_component_fractions(
+            da.from_array(g, chunks=2),
+            s,
+            lifetimes[:n_components],
+            laser_frequency,
+        )
+        for i, result in enumerate(results):
+            assert isinstance(result, da.Array)
+            assert np.allclose(result.compute(), f[..., i], atol=1e-4)
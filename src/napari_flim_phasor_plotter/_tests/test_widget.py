@@ -81,6 +81,16 @@ manual_clusters_column = pd.Series(
 table_with_clusters = pd.concat([table, manual_clusters_column], axis=1)
 
 
+def make_flim_image(tau_list, amplitude=1, number_of_time_points=1000):
+    """Synthetic FLIM image with dimensions (ut, time, z, y, x) and 3x3
+    pixels, one per lifetime of `tau_list`"""
+    time_array = create_time_array(laser_frequency, number_of_time_points)
+    flim_data = make_synthetic_flim_data(time_array, amplitude, tau_list)
+    flim_data = flim_data.reshape(number_of_time_points, 3, 3)
+    # add unitary time and z dimensions
+    return np.expand_dims(flim_data, axis=[1, 2])
+
+
 def test_make_flim_phasor_plot_and_plotter(make_napari_viewer, capsys):
     # Inputs for manual selection
     input_selection_vertices = np.array(
@@ -252,3 +262,390 @@ def test_Split_N_Largest_Cluster_Labels(make_napari_viewer):
     assert np.array_equal(
         viewer.layers[-1].data, second_largest_cluster_labels
     )
+
+
+def test_make_flim_phasor_plot_harmonics(make_napari_viewer):
+    from napari_flim_phasor_plotter.phasor import get_phasor_components
+    from napari_flim_phasor_plotter.filters import make_time_window
+
+    viewer = make_napari_viewer()
+    flim_data = make_flim_image(tau_list)
+    viewer.add_image(flim_data, rgb=False)
+
+    my_widget = make_flim_phasor_plot()
+    _, labels_layer = my_widget(number_of_harmonics=3)
+    features = labels_layer.features
+
+    # displayed harmonic stays in 'G' and 'S' columns
+    assert np.allclose(
+        features[["G", "S"]].values,
+        table[["G", "S"]].values,
+        rtol=0,
+        atol=1e-5,
+    )
+    assert "G_harmonic_1" not in features.columns
+    time_window = make_time_window(flim_data, laser_frequency)
+    mask = labelled_pixels_masked > 0
+    for harmonic in [2, 3]:
+        g, s, _ = get_phasor_components(
+            flim_data, harmonic=harmonic, time_window=time_window
+        )
+        assert np.allclose(
+            features[f"G_harmonic_{harmonic}"], g[mask], rtol=0, atol=1e-5
+        )
+        assert np.allclose(
+            features[f"S_harmonic_{harmonic}"], s[mask], rtol=0, atol=1e-5
+        )
+
+
+def test_make_flim_phasor_plot_lifetime_layers(make_napari_viewer):
+    from napari_flim_phasor_plotter.phasor import get_lifetimes
+
+    viewer = make_napari_viewer()
+    viewer.add_image(make_flim_image(tau_list), rgb=False, name="flim_data")
+
+    my_widget = make_flim_phasor_plot()
+    _, labels_layer = my_widget(add_lifetime_layers=True)
+
+    assert len(viewer.layers) == 4
+    tau_phase_layer = viewer.layers["Tau_phase_from_flim_data"]
+    tau_modulation_layer = viewer.layers["Tau_modulation_from_flim_data"]
+    features = labels_layer.features
+    tau_phase, tau_modulation = get_lifetimes(
+        features["G"].values, features["S"].values, laser_frequency
+    )
+    mask = labelled_pixels_masked > 0
+    for layer, expected in [
+        (tau_phase_layer, tau_phase),
+        (tau_modulation_layer, tau_modulation),
+    ]:
+        assert layer.data.shape == labelled_pixels_masked.shape
+        # pixels below threshold are discarded
+        assert np.all(np.isnan(layer.data[~mask]))
+        assert np.allclose(layer.data[mask], expected, rtol=1e-5)
+    # lifetimes of labelled pixels (0.5 ns and longer) are recovered
+    assert np.allclose(
+        tau_modulation_layer.data[mask], tau_list[2:], rtol=0.01
+    )
+
+
+def test_make_flim_phasor_plot_calibration(make_napari_viewer):
+    viewer = make_napari_viewer()
+    image_layer = viewer.add_image(
+        make_flim_image(tau_list), rgb=False, name="flim_data"
+    )
+    # reference with a known lifetime of 2 ns in every pixel
+    reference_lifetime = 2  # ns
+    calibration_layer = viewer.add_image(
+        make_flim_image([reference_lifetime] * 9, amplitude=10),
+        rgb=False,
+        name="reference",
+    )
+
+    my_widget = make_flim_phasor_plot()
+    _, reference_labels_layer = my_widget(
+        image_layer=calibration_layer,
+        calibration_layer=calibration_layer,
+        calibration_lifetime=reference_lifetime,
+    )
+    _, labels_layer = my_widget(
+        image_layer=image_layer,
+        calibration_layer=calibration_layer,
+        calibration_lifetime=reference_lifetime,
+    )
+
+    # calibrated reference lands on its theoretical position
+    w = 2 * np.pi * laser_frequency * 1e6 * reference_lifetime * 1e-9
+    reference_features = reference_labels_layer.features
+    assert len(reference_features) == 9
+    assert np.allclose(reference_features["G"], 1 / (1 + w**2), atol=1e-5)
+    assert np.allclose(reference_features["S"], w / (1 + w**2), atol=1e-5)
+    # other lifetimes get closer to the universal semi-circle
+    w = 2 * np.pi * laser_frequency * 1e6 * np.array(tau_list[2:]) * 1e-9
+    features = labels_layer.features
+    assert np.allclose(features["G"], 1 / (1 + w**2), rtol=0, atol=1e-3)
+    assert np.allclose(features["S"], w / (1 + w**2), rtol=0, atol=1e-3)
+
+
+def test_make_object_phasor_plot(make_napari_viewer):
+    from napari_flim_phasor_plotter._widget import make_object_phasor_plot
+    from napari_flim_phasor_plotter.phasor import get_phasor_components
+    from napari_flim_phasor_plotter.filters import make_time_window
+
+    viewer = make_napari_viewer()
+    flim_data = make_flim_image(tau_list)
+    image_layer = viewer.add_image(flim_data, rgb=False, name="flim_data")
+    objects = np.array(
+        [
+            [1, 1, 1],
+            [0, 2, 2],
+            [0, 2, 2],
+        ]
+    )
+    objects_layer = viewer.add_labels(objects, name="objects")
+
+    my_widget = make_object_phasor_plot()
+    plotter_widget, labels_layer = my_widget(
+        image_layer=image_layer, labels_layer=objects_layer
+    )
+
+    assert plotter_widget is not None
+    assert labels_layer.name == "Labelled_objects_from_flim_data"
+    features = labels_layer.features
+    assert list(features["label"]) == [1, 2]
+    # object phasors are the photon-weighted mean of their pixel phasors
+    time_window = make_time_window(flim_data, laser_frequency)
+    g, s, dc = get_phasor_components(flim_data, time_window=time_window)
+    for row, label in enumerate([1, 2]):
+        mask = objects == label
+        weights = dc[0, 0][mask]
+        assert np.isclose(
+            features["photon_count"][row], weights.sum(), rtol=1e-5
+        )
+        assert np.isclose(
+            features["G"][row],
+            np.average(g[0, 0][mask], weights=weights),
+            atol=1e-5,
+        )
+        assert np.isclose(
+            features["S"][row],
+            np.average(s[0, 0][mask], weights=weights),
+            atol=1e-5,
+        )
+
+
+def test_make_flim_phasor_plot_incremental(make_napari_viewer):
+    viewer = make_napari_viewer()
+    flim_data = make_flim_image(tau_list)
+    # acquisition with 3 timepoints, arriving one by one
+    timepoints = np.concatenate([flim_data] * 3, axis=1)
+    image_layer = viewer.add_image(
+        timepoints[:, :1], rgb=False, name="flim_data"
+    )
+    my_widget = make_flim_phasor_plot()
+    _, labels_layer = my_widget(incremental=True)
+    assert len(labels_layer.features) == 7
+
+    image_layer.data = timepoints[:, :2]
+    _, labels_layer = my_widget(incremental=True)
+    features = labels_layer.features
+    # new rows are appended to the first frame ones
+    assert len(viewer.layers) == 2
+    assert list(features["label"]) == list(range(1, 15))
+    assert list(features["frame"]) == [0] * 7 + [1] * 7
+    assert np.array_equal(labels_layer.data[:1], labelled_pixels_masked)
+    assert np.array_equal(
+        labels_layer.data[1:],
+        labelled_pixels_masked + 7 * (labelled_pixels_masked > 0),
+    )
+    assert np.allclose(
+        features[["G", "S"]].values,
+        np.concatenate([table[["G", "S"]].values] * 2),
+        rtol=0,
+        atol=1e-5,
+    )
+    # labels are written into a buffer with room for more frames
+    assert labels_layer.data.base is labels_layer.metadata["frame_buffer"]
+    phasor_histogram = labels_layer.metadata["phasor_histogram"]
+    assert phasor_histogram.counts.sum() == 14
+
+    # changing a setting recalculates all timepoints
+    image_layer.data = timepoints
+    _, labels_layer = my_widget(incremental=True, threshold=5)
+    features = labels_layer.features
+    # 0.2 ns pixels are above the new threshold
+    assert list(features["label"]) == list(range(1, 25))
+    assert list(features["frame"]) == [0] * 8 + [1] * 8 + [2] * 8
+    assert labels_layer.metadata["phasor_histogram"].counts.sum() == 24
+
+
+def test_make_multichannel_flim_phasor_plot(make_napari_viewer):
+    from napari_flim_phasor_plotter._widget import (
+        make_multichannel_flim_phasor_plot,
+    )
+
+    viewer = make_napari_viewer()
+    # channel layers are named like the reader names them
+    viewer.add_image(make_flim_image(tau_list), rgb=False, name="flim_data")
+    # brighter second channel, with all pixels above threshold
+    viewer.add_image(
+        make_flim_image(tau_list, amplitude=10),
+        rgb=False,
+        name="flim_data [1]",
+    )
+
+    my_widget = make_multichannel_flim_phasor_plot()
+    plotter_widget, labels_layer = my_widget(
+        image_layer=viewer.layers["flim_data [1]"]
+    )
+
+    assert plotter_widget is not None
+    assert plotter_widget.plot_x_axis.currentText() == "G"
+    assert plotter_widget.plot_y_axis.currentText() == "S"
+    assert labels_layer.name == "Labelled_pixels_from_flim_data_all_channels"
+    assert labels_layer.data.shape == (2,) + labelled_pixels_masked.shape
+    features = labels_layer.features
+    assert list(features["channel"].value_counts().sort_index()) == [7, 9]
+    # labels are unique across channels
+    assert list(features["label"]) == list(range(1, 17))
+    assert np.array_equal(labels_layer.data[0], labelled_pixels_masked)
+    channel_0 = features[features["channel"] == 0]
+    assert np.allclose(
+        channel_0[["G", "S"]].values,
+        table[["G", "S"]].values,
+        rtol=0,
+        atol=1e-5,
+    )
+
+
+def test_make_multichannel_flim_phasor_plot_clusters(make_napari_viewer):
+    from napari_flim_phasor_plotter._widget import (
+        make_multichannel_flim_phasor_plot,
+    )
+
+    viewer = make_napari_viewer()
+    viewer.add_image(make_flim_image(tau_list), rgb=False, name="flim_data")
+    viewer.add_image(
+        make_flim_image(tau_list, amplitude=10),
+        rgb=False,
+        name="flim_data [1]",
+    )
+    plotter_widget, labels_layer = make_multichannel_flim_phasor_plot()(
+        image_layer=viewer.layers["flim_data"]
+    )
+    features = labels_layer.features
+    phasor_histogram = labels_layer.metadata["phasor_histogram"]
+    x_edges, y_edges = phasor_histogram.x_edges, phasor_histogram.y_edges
+
+    # histogram of the pixels of a channel
+    plotter_widget.histogram_slice_combobox.setCurrentText("Channel 1")
+    channel_1 = features[features["channel"] == 1]
+    expected = np.histogram2d(
+        channel_1["G"], channel_1["S"], bins=[x_edges, y_edges]
+    )[0]
+    assert np.array_equal(
+        plotter_widget.graphics_widget.histogram[0], expected
+    )
+
+    # clusters are mapped to the labels of all channels
+    plotter_widget.graphics_widget.selector.onselect(
+        np.array([[0.93, 0.22], [0.93, 0.25], [0.95, 0.25], [0.95, 0.22]])
+    )
+    selected = features.loc[features["MANUAL_CLUSTER_ID"] == 1, "label"]
+    assert len(selected) == 2
+    phasor_clusters_layer = viewer.layers[-1]
+    assert phasor_clusters_layer.name == (
+        "Phasor_clusters_from_flim_data_all_channels"
+    )
+    assert np.array_equal(
+        phasor_clusters_layer.data,
+        np.where(np.isin(labels_layer.data, selected), 2, 0),
+    )
+
+
+def test_phasor_plotter_current_frame(make_napari_viewer):
+    viewer = make_napari_viewer()
+    flim_data = np.concatenate(
+        [make_flim_image(tau_list), make_flim_image(tau_list, amplitude=10)],
+        axis=1,
+    )
+    viewer.add_image(flim_data, rgb=False)
+    plotter_widget, labels_layer = make_flim_phasor_plot()()
+    features = labels_layer.features
+    phasor_histogram = labels_layer.metadata["phasor_histogram"]
+
+    def get_frame_counts(frame):
+        frame_features = features[features["frame"] == frame]
+        return np.histogram2d(
+            frame_features["G"],
+            frame_features["S"],
+            bins=[phasor_histogram.x_edges, phasor_histogram.y_edges],
+        )[0]
+
+    # histogram follows the time axis of the viewer (after microtime)
+    plotter_widget.histogram_slice_combobox.setCurrentText("Current frame")
+    for frame in [0, 1, 0]:
+        viewer.dims.set_current_step(1, frame)
+        assert np.array_equal(
+            plotter_widget.graphics_widget.histogram[0],
+            get_frame_counts(frame),
+        )
+
+
+def test_make_flim_phasor_plot_reader_intensity(make_napari_viewer, tmp_path):
+    import tifffile
+    from napari_flim_phasor_plotter._reader import flim_file_reader
+    from napari_flim_phasor_plotter._cache import phasor_cache
+
+    viewer = make_napari_viewer()
+    # (ch, ut, y, x) tif, read as NumPy data
+    file_path = tmp_path / "flim_data.tif"
+    tifffile.imwrite(
+        file_path,
+        make_flim_image(tau_list)[:, 0, 0][None],
+        photometric="minisblack",
+    )
+    flim_layer_data, intensity_layer_data = flim_file_reader(str(file_path))
+    (image_layer,) = viewer.add_image(
+        flim_layer_data[0], rgb=False, **flim_layer_data[1]
+    )
+    reader_intensity_image = image_layer.metadata["intensity_image"]
+    assert isinstance(image_layer.data, np.ndarray)
+    assert np.array_equal(reader_intensity_image, intensity_layer_data[0][0])
+
+    my_widget = make_flim_phasor_plot()
+    _, labels_layer = my_widget(image_layer=image_layer)
+    # the projection of the reader is used instead of summing the decays
+    key = phasor_cache.data_key(image_layer.data) + ("intensity",)
+    assert phasor_cache.get(key) is reader_intensity_image
+    assert "intensity_image" not in image_layer.metadata
+    assert np.array_equal(labels_layer.data, labelled_pixels_masked)
+
+
+def test_make_flim_phasor_plot_data_edited_in_place(make_napari_viewer):
+    viewer = make_napari_viewer()
+    image_layer = viewer.add_image(
+        make_flim_image(tau_list), rgb=False, name="flim_data"
+    )
+    my_widget = make_flim_phasor_plot()
+    _, labels_layer = my_widget()
+    assert np.allclose(
+        labels_layer.features[["G", "S"]].values,
+        table[["G", "S"]].values,
+        rtol=0,
+        atol=1e-5,
+    )
+
+    # same array, with the decays of 2 ns in all pixels
+    image_layer.data[:] = make_flim_image([2] * 9, amplitude=10)
+    _, labels_layer = my_widget()
+    assert len(labels_layer.features) == 9
+    assert np.allclose(
+        labels_layer.features[["G", "S"]].values,
+        table.loc[[2] * 9, ["G", "S"]].values,
+        rtol=0,
+        atol=1e-5,
+    )
+
+
+def test_apply_binning_widget_dask(make_napari_viewer):
+    import dask.array as da
+    from napari_flim_phasor_plotter._widget import apply_binning_widget
+    from napari_flim_phasor_plotter.filters import apply_binning
+
+    viewer = make_napari_viewer()
+    flim_data = np.random.default_rng(0).poisson(5, (8, 1, 2, 6, 6))
+    image_layer = viewer.add_image(
+        da.from_array(flim_data, chunks=(8, 1, 1, 3, 3)), rgb=False
+    )
+    my_widget = apply_binning_widget()
+    # both modes keep dask data lazy
+    for downsample in [False, True]:
+        binned_layer = my_widget(
+            image_layer=image_layer, bin_size=2, downsample=downsample
+        )
+        assert isinstance(binned_layer.data, da.Array)
+        assert np.array_equal(
+            binned_layer.data.compute(),
+            apply_binning(flim_data, 2, downsample=downsample),
+        )
@@ -1,7 +1,7 @@
 from typing import TYPE_CHECKING
 from magicgui import magic_factory
 from magicgui.widgets import Container, PushButton, ComboBox, SpinBox
-from typing import List
+from typing import List, Optional
 from importlib.metadata import version
 
 if TYPE_CHECKING:
@@ -14,7 +14,13 @@ napari_version = tuple(map(int, list(version("napari").split(".")[:2])))
 def connect_events(widget):
     """
     Connect widget events to make some visible/invisible depending on others
+
+    If the `NAPARI_FLIM_PHASOR_PLOTTER_WARM_UP` environment variable is set
+    to 1, also starts compiling the numba phasor kernels in the background,
+    so the first run does not freeze the viewer.
     """
+    import os
+    from napari_flim_phasor_plotter.phasor import warm_up_in_background
 
     def toggle_median_n_widget(event):
         widget.median_n.visible = event
@@ -24,6 +30,9 @@ def connect_events(widget):
     # Intial visibility states
     widget.median_n.visible = False
     widget.laser_frequency.label = "Laser Frequency (MHz)"
+    # Optionally compile phasor kernels on a worker thread
+    if os.environ.get("NAPARI_FLIM_PHASOR_PLOTTER_WARM_UP", "0") == "1":
+        warm_up_in_background()
 
 
 @magic_factory(
@@ -40,9 +49,14 @@ def make_flim_phasor_plot(
     image_layer: "napari.layers.Image",
     laser_frequency: float = 40,
     harmonic: int = 1,
+    number_of_harmonics: int = 1,
     threshold: int = 10,
     apply_median: bool = False,
     median_n: int = 1,
+    add_lifetime_layers: bool = False,
+    calibration_layer: Optional["napari.layers.Image"] = None,
+    calibration_lifetime: float = 0,
+    incremental: bool = False,
     napari_viewer: "napari.Viewer" = None,
 ) -> None:
     """Calculate phasor components from FLIM image and plot them.
@@ -55,12 +69,33 @@ def make_flim_phasor_plot(
         laser frequency in MHz. If using '.ptu' or '.sdt' files, this field is filled afterwards from the file metadata. By default 40.
     harmonic : int, optional
         the harmonic to display in the phasor plot, by default 1
+    number_of_harmonics : int, optional
+        harmonics from 1 up to this number are calculated in a single pass
+        and kept in the features table as 'G_harmonic_n' and 'S_harmonic_n'
+        columns, so that other harmonics can be plotted without
+        recalculation, by default 1
     threshold : int, optional
         pixels with summed intensity below this threshold will be discarded, by default 10
     apply_median : bool, optional
         apply median filter to image before phasor calculation, by default False (median_n is ignored)
     median_n : int, optional
         number of iterations of median filter, by default 1
+    add_lifetime_layers : bool, optional
+        add apparent phase and modulation lifetime images (in ns) of the
+        displayed harmonic as image layers, by default False
+    calibration_layer : napari.layers.Image, optional
+        napari image layer with FLIM data of a reference with known lifetime
+        (or of the instrument response function), measured with the same
+        settings. If provided, phasors are calibrated against it, by default
+        None
+    calibration_lifetime : float, optional
+        lifetime of the calibration reference in ns (0 for the instrument
+        response function), by default 0
+    incremental : bool, optional
+        for live acquisitions. If the image got new timepoints since the last
+        run with the same settings, only the new timepoints are processed and
+        their rows are appended to the labels layer and features table. The
+        time window of the first run is kept, by default False
     napari_viewer : napari.Viewer, optional
         napari viewer instance, by default None
     """
@@ -68,97 +103,657 @@ def make_flim_phasor_plot(
     import numpy as np
     import dask.array as da
     import pandas as pd
-    from skimage.segmentation import relabel_sequential
     from napari.layers import Labels
 
-    from napari_flim_phasor_plotter.phasor import get_phasor_components
+    from napari_flim_phasor_plotter.phasor import (
+        get_phasor_components,
+        get_lifetimes,
+        get_calibration_parameters,
+    )
     from napari_flim_phasor_plotter.filters import (
-        make_time_mask,
-        make_space_mask_from_manual_threshold,
+        make_time_window,
+        get_intensity_image,
+        set_intensity_image,
     )
-    from napari_flim_phasor_plotter.filters import apply_median_filter
-    from napari_flim_phasor_plotter._plotting import PhasorPlotterWidget
+    from napari_flim_phasor_plotter.denoise import median_filter_phasor
+    from napari_flim_phasor_plotter._cache import phasor_cache
+    from napari_flim_phasor_plotter._histogram import PhasorHistogram
 
     image = image_layer.data
-    if "file_type" in image_layer.metadata:
-        if (image_layer.metadata["file_type"] == "ptu") and (
-            "TTResult_SyncRate" in image_layer.metadata
+    laser_frequency = get_laser_frequency(image_layer, laser_frequency)
+    harmonics = sorted(set(range(1, number_of_harmonics + 1)) | {harmonic})
+    labels_layer_name = "Labelled_pixels_from_" + image_layer.name
+    labels_layer = None
+    for layer in napari_viewer.layers:
+        if isinstance(layer, Labels) and layer.name == labels_layer_name:
+            labels_layer = layer
+            break
+
+    # Settings that must not change between incremental runs
+    settings = {
+        "laser_frequency": laser_frequency,
+        "harmonics": harmonics,
+        "threshold": threshold,
+        "apply_median": apply_median,
+        "median_n": median_n,
+        "add_lifetime_layers": add_lifetime_layers,
+        "calibration_layer": getattr(calibration_layer, "name", None),
+        "calibration_lifetime": calibration_lifetime,
+        "shape": image.shape[:1] + image.shape[2:],
+    }
+    first_frame = 0
+    if incremental and labels_layer is not None:
+        state = labels_layer.metadata.get("phasor_state", {})
+        if (
+            state.get("settings") == settings
+            and image.shape[1] > state["n_frames"]
         ):
-            # in MHz
-            laser_frequency = image_layer.metadata["TTResult_SyncRate"] * 1e-6
-        elif image_layer.metadata["file_type"] == "sdt":
-            # in MHz
-            laser_frequency = (
-                image_layer.metadata["measure_info"]["StopInfo"][
-                    "max_sync_rate"
-                ][0]
-                * 10**-6
+            # Process only new timepoints, with the time window of first run
+            first_frame = state["n_frames"]
+            time_window = state["time_window"]
+            n_labels = state["n_labels"]
+
+    # Time window and phasor components are cached, so that re-running with
+    # another threshold or median filter does not recalculate them
+    cache_key = phasor_cache.data_key(image) + (laser_frequency,)
+    if first_frame == 0:
+        time_window = phasor_cache.get(cache_key + ("time_window",))
+        if time_window is None:
+            time_window = make_time_window(image, laser_frequency)
+            phasor_cache.set(cache_key + ("time_window",), time_window)
+        n_labels = 0
+    else:
+        image = image[:, first_frame:]
+
+    # Intensity projection is cached too, starting from the one of the
+    # reader if the layer has it
+    intensity_image = get_intensity_image(
+        image, image_layer.metadata if first_frame == 0 else None
+    )
+
+    # Calculate all harmonics in a single pass over the data
+    window = (time_window.start, time_window.stop)
+    calibration = None
+    if calibration_layer is not None:
+        # Calibration parameters are cached too
+        calibration = get_calibration_parameters(
+            calibration_layer.data,
+            calibration_lifetime,
+            laser_frequency,
+            harmonics=harmonics,
+            time_window=time_window,
+        )
+    phasor_key = cache_key + (
+        "phasor",
+        tuple(harmonics),
+        window,
+        calibration and tuple(sorted(calibration.items())),
+    )
+    phasor_components = None
+    if first_frame == 0:
+        phasor_components = phasor_cache.get(phasor_key)
+    if phasor_components is None:
+        # time window slices microtime axis without copying data
+        phasor_components = get_phasor_components(
+            image,
+            harmonics=harmonics,
+            time_window=time_window,
+            calibration=calibration,
+        )
+        if isinstance(phasor_components[2], da.Array):
+            # Evaluate phasor graph and intensity together, in a single pass
+            # over the data, instead of computing chunk sizes of each masked
+            # array
+            phasor_components, intensity_image = da.compute(
+                phasor_components, intensity_image
             )
+        if first_frame == 0:
+            phasor_cache.set(phasor_key, phasor_components)
+    g_harmonics, s_harmonics, dc = phasor_components
+    if isinstance(intensity_image, da.Array):
+        intensity_image = intensity_image.compute()
+        set_intensity_image(image, intensity_image)
+    space_mask = intensity_image >= threshold
 
-    time_mask = make_time_mask(image, laser_frequency)
+    if apply_median:
+        # G and S of each harmonic are filtered together
+        filtered = [
+            median_filter_phasor(g, s, median_n)
+            for g, s in zip(g_harmonics, s_harmonics)
+        ]
+        g_harmonics = [g for g, _ in filtered]
+        s_harmonics = [s for _, s in filtered]
+    g = g_harmonics[harmonics.index(harmonic)]
+    s = s_harmonics[harmonics.index(harmonic)]
+
+    # Label pixels above threshold sequentially, following previous labels
+    label_image, table = make_pixel_phasor_table(
+        g_harmonics,
+        s_harmonics,
+        space_mask,
+        harmonics,
+        harmonic,
+        first_label=n_labels + 1,
+        first_frame=first_frame,
+    )
+    n_new_labels = len(table)
 
-    space_mask = make_space_mask_from_manual_threshold(image, threshold)
+    # The layer has to be created here so the plotter can be filled properly
+    # below. Overwrite layer if it already exists.
+    if first_frame > 0:
+        # Append new timepoints and their rows to previous ones
+        phasor_histogram = labels_layer.metadata.get("phasor_histogram")
+        if phasor_histogram is not None and phasor_histogram.matches(
+            "G", "S", n_labels
+        ):
+            phasor_histogram = phasor_histogram.append(
+                table["G"], table["S"], slices={"frame": table["frame"]}
+            )
+        else:
+            phasor_histogram = None
+        append_frames(labels_layer, label_image, first_frame)
+        table = pd.concat([labels_layer.features, table], ignore_index=True)
+        labels_layer.features = table
+    elif labels_layer is not None:
+        labels_layer.metadata.pop("frame_buffer", None)
+        labels_layer.data = label_image
+        labels_layer.features = table
+    else:
+        labels_layer = napari_viewer.add_labels(
+            label_image,
+            name=labels_layer_name,
+            features=table,
+            scale=image_layer.scale[1:],
+            visible=True,
+            opacity=0.2,
+        )
+    labels_layer.metadata["phasor_state"] = {
+        "settings": settings,
+        "time_window": time_window,
+        "n_frames": first_frame + dc.shape[0],
+        "n_labels": n_labels + n_new_labels,
+    }
+    if first_frame == 0 or phasor_histogram is None:
+        # Bin phasors once, for plotting and selection in the phasor plotter
+        phasor_histogram = PhasorHistogram(
+            table["G"], table["S"], slices={"frame": table["frame"]}
+        )
+    labels_layer.metadata["phasor_histogram"] = phasor_histogram
 
-    image = image[time_mask]
+    if add_lifetime_layers:
+        tau_phase, tau_modulation = get_lifetimes(
+            g, s, laser_frequency, harmonic
+        )
+        for name, tau in [
+            ("Tau_phase", tau_phase),
+            ("Tau_modulation", tau_modulation),
+        ]:
+            # Discard pixels below threshold
+            tau = np.where(space_mask, tau, np.nan)
+            layer_name = name + "_from_" + image_layer.name
+            if layer_name in napari_viewer.layers:
+                lifetime_layer = napari_viewer.layers[layer_name]
+                if first_frame > 0:
+                    append_frames(lifetime_layer, tau, first_frame)
+                else:
+                    lifetime_layer.metadata.pop("frame_buffer", None)
+                    lifetime_layer.data = tau
+            else:
+                napari_viewer.add_image(
+                    tau,
+                    name=layer_name,
+                    scale=image_layer.scale[1:],
+                    colormap="turbo",
+                )
 
-    g, s, dc = get_phasor_components(image, harmonic=harmonic)
+    plotter_widget = show_phasor_plot(
+        napari_viewer, labels_layer, laser_frequency, harmonic
+    )
 
-    if apply_median:
-        g = apply_median_filter(g, median_n)
-        s = apply_median_filter(s, median_n)
+    # TODO: avoid using private method access to napari_viewer.window._dock_widgets (will be deprecated)
+    with warnings.catch_warnings():
+        warnings.simplefilter(action="ignore", category=FutureWarning)
+        dock_widgets_names = [
+            key for key, value in napari_viewer.window._dock_widgets.items()
+        ]
+        # Update laser frequency spinbox
+        # TO DO: access and update widget in a better way
+        if (
+            "Calculate Phasors (napari-flim-phasor-plotter)"
+            in dock_widgets_names
+        ):
+            widgets = napari_viewer.window._dock_widgets[
+                "Calculate Phasors (napari-flim-phasor-plotter)"
+            ]
+            laser_frequency_spinbox = (
+                widgets.children()[4].children()[2].children()[-1]
+            )
+            # Set precision of spinbox based on number of decimals in laser_frequency
+            laser_frequency_spinbox.setDecimals(
+                str(laser_frequency)[::-1].find(".")
+            )
+            laser_frequency_spinbox.setValue(laser_frequency)
+
+    return plotter_widget, labels_layer
+
+
+def append_frames(layer, frames, first_frame):
+    """Replace the frames of a layer from `first_frame` on by new frames
+
+    Layer data becomes a view of a buffer with room for more frames, kept in
+    the layer metadata. Only the new frames are copied, except when the
+    buffer has to grow, which doubles its capacity.
+
+    Parameters
+    ----------
+    layer : napari.layers.Layer
+        napari layer with frames along the first dimension of its data.
+    frames : np.ndarray
+        new frames, with the dimensions of the layer data.
+    first_frame : int
+        number of frames of the layer data to keep.
+    """
+    import numpy as np
+
+    data = layer.data
+    buffer = layer.metadata.get("frame_buffer")
+    if (
+        buffer is None
+        or getattr(data, "base", None) is not buffer
+        or buffer.dtype != frames.dtype
+        or buffer.shape[1:] != frames.shape[1:]
+    ):
+        # start from a copy of the layer data
+        buffer = np.asarray(data)[:first_frame]
+    n_frames = first_frame + len(frames)
+    if n_frames > len(buffer) or not buffer.flags.owndata:
+        grown = np.empty(
+            (max(n_frames, 2 * len(buffer)),) + frames.shape[1:],
+            dtype=frames.dtype,
+        )
+        grown[:first_frame] = buffer[:first_frame]
+        buffer = grown
+    buffer[first_frame:n_frames] = frames
+    layer.metadata["frame_buffer"] = buffer
+    layer.data = buffer[:n_frames]
+
+
+@magic_factory(
+    laser_frequency={
+        "label": "Laser Frequency (MHz)",
+        "step": 0.001,
+        "tooltip": (
+            "If loaded image has metadata, laser frequency will get automatically updated after run. "
+            "Otherwise, manually insert laser frequency here."
+        ),
+    },
+)
+def make_multichannel_flim_phasor_plot(
+    image_layer: "napari.layers.Image",
+    laser_frequency: float = 40,
+    harmonic: int = 1,
+    number_of_harmonics: int = 1,
+    threshold: int = 10,
+    apply_median: bool = False,
+    median_n: int = 1,
+    napari_viewer: "napari.Viewer" = None,
+) -> None:
+    """Calculate phasors of all channels of a FLIM image and plot them.
+
+    The reader splits channels into layers named '<name>', '<name> [1]',
+    '<name> [2]', ... All channel layers of the selected layer are processed
+    in a single call, each with its own time window, and their pixels share
+    one (ch, time, z, y, x) labels layer and one features table with a
+    'channel' column.
+
+    Parameters
+    ----------
+    image_layer : napari.layers.Image
+        napari image layer of any channel of the FLIM data with dimensions (ut, time, z, y, x). microtime must be the first dimention. time and z are optional.
+    laser_frequency : float, optional
+        laser frequency in MHz. If using '.ptu' or '.sdt' files, this field is filled afterwards from the file metadata. By default 40.
+    harmonic : int, optional
+        the harmonic to display in the phasor plot, by default 1
+    number_of_harmonics : int, optional
+        harmonics from 1 up to this number are calculated in a single pass
+        and kept in the features table as 'G_harmonic_n' and 'S_harmonic_n'
+        columns, by default 1
+    threshold : int, optional
+        pixels with summed intensity below this threshold will be discarded, by default 10
+    apply_median : bool, optional
+        apply median filter to image before phasor calculation, by default False (median_n is ignored)
+    median_n : int, optional
+        number of iterations of median filter, by default 1
+    napari_viewer : napari.Viewer, optional
+        napari viewer instance, by default None
+    """
+    import re
+    import numpy as np
+    import dask.array as da
+    import pandas as pd
+    from napari.layers import Image, Labels
+
+    from napari_flim_phasor_plotter.phasor import (
+        get_multichannel_phasor_components,
+    )
+    from napari_flim_phasor_plotter.filters import (
+        make_time_window,
+        get_intensity_image,
+        set_intensity_image,
+    )
+    from napari_flim_phasor_plotter.denoise import median_filter_phasor
+    from napari_flim_phasor_plotter._histogram import PhasorHistogram
+
+    # Channel layers share the name of the first channel
+    name = re.sub(r" \[\d+\]$", "", image_layer.name)
+    channel_layers = [
+        layer
+        for layer in napari_viewer.layers
+        if isinstance(layer, Image)
+        and re.sub(r" \[\d+\]$", "", layer.name) == name
+        and layer.data.shape == image_layer.data.shape
+    ]
+    channels = [layer.data for layer in channel_layers]
+    laser_frequency = get_laser_frequency(image_layer, laser_frequency)
+    harmonics = sorted(set(range(1, number_of_harmonics + 1)) | {harmonic})
+
+    time_windows = [
+        make_time_window(channel_data, laser_frequency)
+        for channel_data in channels
+    ]
+    phasor_components = get_multichannel_phasor_components(
+        channels, harmonics=harmonics, time_windows=time_windows
+    )
+    intensity_images = [
+        get_intensity_image(layer.data, layer.metadata)
+        for layer in channel_layers
+    ]
+    if isinstance(phasor_components[2], da.Array):
+        # Evaluate phasor graph and intensities together, in a single pass
+        phasor_components, intensity_images = da.compute(
+            phasor_components, intensity_images
+        )
+    g_channels, s_channels, _ = phasor_components
+    space_masks = []
+    for channel_data, intensity_image in zip(channels, intensity_images):
+        intensity_image = np.asarray(intensity_image)
+        if isinstance(channel_data, da.Array):
+            set_intensity_image(channel_data, intensity_image)
+        space_masks.append(intensity_image >= threshold)
+
+    label_images, tables = [], []
+    n_labels = 0
+    for channel, (g_harmonics, s_harmonics, space_mask) in enumerate(
+        zip(g_channels, s_channels, space_masks)
+    ):
+        if apply_median:
+            filtered = [
+                median_filter_phasor(g, s, median_n)
+                for g, s in zip(g_harmonics, s_harmonics)
+            ]
+            g_harmonics = [g for g, _ in filtered]
+            s_harmonics = [s for _, s in filtered]
+        # Labels continue across channels, so they are unique in the table
+        label_image, table = make_pixel_phasor_table(
+            g_harmonics,
+            s_harmonics,
+            space_mask,
+            harmonics,
+            harmonic,
+            first_label=n_labels + 1,
+        )
+        table.insert(1, "channel", channel)
+        n_labels += len(table)
+        label_images.append(label_image)
+        tables.append(table)
+    label_image = np.stack(label_images)
+    table = pd.concat(tables, ignore_index=True)
+
+    # Overwrite layer if it already exists
+    labels_layer_name = "Labelled_pixels_from_" + name + "_all_channels"
+    for layer in napari_viewer.layers:
+        if isinstance(layer, Labels) and layer.name == labels_layer_name:
+            labels_layer = layer
+            labels_layer.data = label_image
+            labels_layer.features = table
+            break
+    else:
+        labels_layer = napari_viewer.add_labels(
+            label_image,
+            name=labels_layer_name,
+            features=table,
+            scale=(1,) + tuple(image_layer.scale[1:]),
+            visible=True,
+            opacity=0.2,
+        )
+
+    # Bin phasors once, for plotting and selection in the phasor plotter
+    phasor_histogram = PhasorHistogram(
+        table["G"],
+        table["S"],
+        slices={"frame": table["frame"], "channel": table["channel"]},
+    )
+    labels_layer.metadata["phasor_histogram"] = phasor_histogram
+
+    plotter_widget = show_phasor_plot(
+        napari_viewer, labels_layer, laser_frequency, harmonic
+    )
+    return plotter_widget, labels_layer
+
+
+def make_pixel_phasor_table(
+    g_harmonics,
+    s_harmonics,
+    space_mask,
+    harmonics,
+    harmonic,
+    first_label=1,
+    first_frame=0,
+):
+    """Label pixels of a space mask and build their phasor features table
 
-    label_image = np.arange(np.prod(dc.shape)).reshape(dc.shape) + 1
-    label_image[~space_mask] = 0
-    label_image = relabel_sequential(label_image)[0]
+    Parameters
+    ----------
+    g_harmonics : np.ndarray
+        G components with dimensions (harmonic, time, z, y, x).
+    s_harmonics : np.ndarray
+        S components with dimensions (harmonic, time, z, y, x).
+    space_mask : np.ndarray
+        boolean mask of the pixels to keep, with dimensions (time, z, y, x).
+    harmonics : List[int]
+        harmonics of `g_harmonics` and `s_harmonics`.
+    harmonic : int
+        harmonic stored in the 'G' and 'S' columns. Other harmonics are
+        stored as 'G_harmonic_n' and 'S_harmonic_n' columns.
+    first_label : int, optional
+        label of the first pixel, following pixels are labelled
+        sequentially, by default 1
+    first_frame : int, optional
+        frame number of the first timepoint, by default 0
+
+    Returns
+    -------
+    Tuple[np.ndarray, pd.DataFrame]
+        label image and features table with one row per labelled pixel
+    """
+    import numpy as np
+    import pandas as pd
+
+    g = g_harmonics[harmonics.index(harmonic)]
+    s = s_harmonics[harmonics.index(harmonic)]
+
+    label_image = np.zeros(space_mask.shape, dtype=int)
+    n_labels = np.count_nonzero(space_mask)
+    label_image[space_mask] = np.arange(n_labels) + first_label
 
-    g_flat_masked = np.ravel(g[space_mask])
-    s_flat_masked = np.ravel(s[space_mask])
     t_coords, z_coords, y_coords, x_coords = np.where(space_mask)
-    if isinstance(g, da.Array):
-        g_flat_masked.compute_chunk_sizes()
-        s_flat_masked.compute_chunk_sizes()
-    if isinstance(space_mask, da.Array):
-        t_coords.compute_chunk_sizes()
-        z_coords.compute_chunk_sizes()
-        y_coords.compute_chunk_sizes()
-        x_coords.compute_chunk_sizes()
-
-    phasor_components = pd.DataFrame(
+    table = pd.DataFrame(
         {
-            "label": np.ravel(label_image[space_mask]),
-            "G": g_flat_masked,
-            "S": s_flat_masked,
+            "label": label_image[space_mask],
+            "G": g[space_mask],
+            "S": s[space_mask],
             "pixel_x_coordinates": x_coords,
             "pixel_y_coordinates": y_coords,
             "pixel_z_coordinates": z_coords,
         }
     )
-    table = phasor_components
     # Build frame column
-    frame = np.arange(dc.shape[0])
-    frame = np.repeat(frame, np.prod(dc.shape[1:]))
-    table["frame"] = frame[space_mask.ravel()]
+    table["frame"] = t_coords + first_frame
+    # Keep other harmonics in the table
+    for n, g_n, s_n in zip(harmonics, g_harmonics, s_harmonics):
+        if n == harmonic:
+            continue
+        table[f"G_harmonic_{n}"] = g_n[space_mask]
+        table[f"S_harmonic_{n}"] = s_n[space_mask]
+    return label_image, table
 
-    # The layer has to be created here so the plotter can be filled properly
-    # below. Overwrite layer if it already exists.
+
+@magic_factory(
+    laser_frequency={
+        "label": "Laser Frequency (MHz)",
+        "step": 0.001,
+        "tooltip": (
+            "If loaded image has metadata, laser frequency will get automatically updated after run. "
+            "Otherwise, manually insert laser frequency here."
+        ),
+    },
+)
+def make_object_phasor_plot(
+    image_layer: "napari.layers.Image",
+    labels_layer: "napari.layers.Labels",
+    laser_frequency: float = 40,
+    harmonic: int = 1,
+    number_of_harmonics: int = 1,
+    napari_viewer: "napari.Viewer" = None,
+) -> None:
+    """Calculate one phasor per object of a labels layer and plot them.
+
+    Decays of all pixels of each object are summed, so each object gets a
+    photon-weighted phasor and the features table gets one row per object.
+
+    Parameters
+    ----------
+    image_layer : napari.layers.Image
+        napari image layer with FLIM data with dimensions (ut, time, z, y, x). microtime must be the first dimention. time and z are optional.
+    labels_layer : napari.layers.Labels
+        napari labels layer with segmented objects, with the same dimensions
+        as the image layer without microtime (or fewer, like (y, x)).
+    laser_frequency : float, optional
+        laser frequency in MHz. If using '.ptu' or '.sdt' files, this field is filled afterwards from the file metadata. By default 40.
+    harmonic : int, optional
+        the harmonic to display in the phasor plot, by default 1
+    number_of_harmonics : int, optional
+        harmonics from 1 up to this number are calculated and kept in the
+        features table as 'G_harmonic_n' and 'S_harmonic_n' columns, by
+        default 1
+    napari_viewer : napari.Viewer, optional
+        napari viewer instance, by default None
+    """
+    import numpy as np
+    import pandas as pd
+    from napari.layers import Labels
+
+    from napari_flim_phasor_plotter.phasor import get_object_phasor_components
+    from napari_flim_phasor_plotter.filters import make_time_window
+
+    image = image_layer.data
+    laser_frequency = get_laser_frequency(image_layer, laser_frequency)
+    time_window = make_time_window(image, laser_frequency)
+
+    harmonics = sorted(set(range(1, number_of_harmonics + 1)) | {harmonic})
+    labels, g_harmonics, s_harmonics, dc = get_object_phasor_components(
+        image,
+        np.asarray(labels_layer.data),
+        harmonics=harmonics,
+        time_window=time_window,
+    )
+    table = pd.DataFrame(
+        {
+            "label": labels,
+            "G": g_harmonics[harmonics.index(harmonic)],
+            "S": s_harmonics[harmonics.index(harmonic)],
+            "photon_count": dc,
+        }
+    )
+    # Keep other harmonics in the table
+    for n, g_n, s_n in zip(harmonics, g_harmonics, s_harmonics):
+        if n == harmonic:
+            continue
+        table[f"G_harmonic_{n}"] = g_n
+        table[f"S_harmonic_{n}"] = s_n
+
+    # Overwrite layer if it already exists
+    layer_name = "Labelled_objects_from_" + image_layer.name
     for layer in napari_viewer.layers:
-        if (isinstance(layer, Labels)) & (
-            layer.name == "Labelled_pixels_from_" + image_layer.name
-        ):
-            labels_layer = layer
-            labels_layer.data = label_image
-            labels_layer.features = table
+        if isinstance(layer, Labels) and layer.name == layer_name:
+            objects_layer = layer
+            objects_layer.data = labels_layer.data
+            objects_layer.features = table
             break
     else:
-        labels_layer = napari_viewer.add_labels(
-            label_image,
-            name="Labelled_pixels_from_" + image_layer.name,
+        objects_layer = napari_viewer.add_labels(
+            labels_layer.data,
+            name=layer_name,
             features=table,
-            scale=image_layer.scale[1:],
+            scale=labels_layer.scale,
             visible=True,
             opacity=0.2,
         )
 
+    plotter_widget = show_phasor_plot(
+        napari_viewer, objects_layer, laser_frequency, harmonic
+    )
+    return plotter_widget, objects_layer
+
+
+def get_laser_frequency(image_layer, laser_frequency):
+    """Get laser frequency from image layer metadata, if available
+
+    Parameters
+    ----------
+    image_layer : napari.layers.Image
+        napari image layer with FLIM data.
+    laser_frequency : float
+        laser frequency in MHz, returned if metadata has no laser frequency.
+
+    Returns
+    -------
+    float
+        laser frequency in MHz
+    """
+    from napari_flim_phasor_plotter._reader import (
+        get_laser_frequency_from_metadata,
+    )
+
+    return get_laser_frequency_from_metadata(
+        image_layer.metadata, laser_frequency
+    )
+
+
+def show_phasor_plot(napari_viewer, labels_layer, laser_frequency, harmonic):
+    """Plot 'G' and 'S' features of a labels layer in the phasor plotter
+
+    The phasor plotter is docked to the viewer if it is not there yet.
+
+    Parameters
+    ----------
+    napari_viewer : napari.Viewer
+        napari viewer instance
+    labels_layer : napari.layers.Labels
+        labels layer with 'G' and 'S' columns in its features table
+    laser_frequency : float
+        laser frequency in MHz
+    harmonic : int
+        harmonic of the 'G' and 'S' features
+
+    Returns
+    -------
+    PhasorPlotterWidget
+        the phasor plotter widget
+    """
+    import warnings
+    from napari_flim_phasor_plotter._plotting import PhasorPlotterWidget
+
     # Check if plotter was alrerady added to dock_widgets
     # TODO: avoid using private method access to napari_viewer.window._dock_widgets (will be deprecated)
     with warnings.catch_warnings():
@@ -181,14 +776,17 @@ def make_flim_phasor_plot(
             ]
             plotter_widget = widgets.findChild(PhasorPlotterWidget)
 
-        # Get labels layer with labelled pixels (labels)
+        # Get labels layer with phasor features
+        plotter_widget.layer_select.reset_choices()
         for choice in plotter_widget.layer_select.choices:
-            if choice.name == "Labelled_pixels_from_" + image_layer.name:
+            if choice.name == labels_layer.name:
                 plotter_widget.layer_select.value = choice
                 break
+        # Refresh features in Comboboxes (table may have new harmonic columns)
+        plotter_widget.update_axes_and_clustering_id_lists()
         # Set G and S as features to plot (update_axes_list method clears Comboboxes)
-        plotter_widget.plot_x_axis.setCurrentIndex(1)
-        plotter_widget.plot_y_axis.setCurrentIndex(2)
+        plotter_widget.plot_x_axis.setCurrentText("G")
+        plotter_widget.plot_y_axis.setCurrentText("S")
         plotter_widget.plotting_type.setCurrentIndex(1)
         plotter_widget.log_scale.setChecked(True)
         plotter_widget.frequency = laser_frequency
@@ -208,25 +806,7 @@ def make_flim_phasor_plot(
             ensure_full_semi_circle_displayed=True,
         )
 
-        # Update laser frequency spinbox
-        # TO DO: access and update widget in a better way
-        if (
-            "Calculate Phasors (napari-flim-phasor-plotter)"
-            in dock_widgets_names
-        ):
-            widgets = napari_viewer.window._dock_widgets[
-                "Calculate Phasors (napari-flim-phasor-plotter)"
-            ]
-            laser_frequency_spinbox = (
-                widgets.children()[4].children()[2].children()[-1]
-            )
-            # Set precision of spinbox based on number of decimals in laser_frequency
-            laser_frequency_spinbox.setDecimals(
-                str(laser_frequency)[::-1].find(".")
-            )
-            laser_frequency_spinbox.setValue(laser_frequency)
-
-    return plotter_widget, labels_layer
+    return plotter_widget
 
 
 @magic_factory
@@ -234,9 +814,12 @@ def apply_binning_widget(
     image_layer: "napari.layers.Image",
     bin_size: int = 2,
     binning_3D: bool = True,
+    downsample: bool = False,
 ) -> "napari.layers.Image":
     """Apply binning to image layer.
 
+    Layers with dask data are binned lazily.
+
     Parameters
     ----------
     image_layer : napari.layers.Image
@@ -246,6 +829,10 @@ def apply_binning_widget(
         bin kernel size, by default 2
     binning_3D : bool, optional
         if True, bin in 3D, otherwise bin each slice in 2D, by default True
+    downsample : bool, optional
+        if True, sum non-overlapping blocks of pixels, so that the binned
+        layer is smaller (its scale is multiplied by `bin_size` along the
+        binned axes), by default False
 
     Returns
     -------
@@ -256,16 +843,30 @@ def apply_binning_widget(
     from napari.layers import Image
     from napari_flim_phasor_plotter.filters import apply_binning
 
-    # Warning! This loads the image as a numpy array
-    # TODO: add support for dask arrays
-    image = np.asarray(image_layer.data)
-    image_binned = apply_binning(image, bin_size, binning_3D)
+    scale = np.array(image_layer.scale, dtype=float)
+    translate = np.array(image_layer.translate, dtype=float)
+    image = image_layer.data
+    image_binned = apply_binning(image, bin_size, binning_3D, downsample)
+    if downsample:
+        # Binned pixels cover bin_size pixels, centered between them
+        binned_axes = [
+            axis
+            for axis, (size, binned_size) in enumerate(
+                zip(image.shape, image_binned.shape)
+            )
+            if size != binned_size
+        ]
+        translate[binned_axes] += scale[binned_axes] * (bin_size - 1) / 2
+        scale[binned_axes] *= bin_size
     # Add dimensions if needed, to make it 5D (ut, time, z, y, x)
     while len(image_binned.shape) < 5:
-        image_binned = np.expand_dims(image_binned, axis=0)
+        image_binned = image_binned[np.newaxis]
+        scale = np.insert(scale, 0, 1)
+        translate = np.insert(translate, 0, 0)
     return Image(
         image_binned,
-        scale=image_layer.scale,
+        scale=scale,
+        translate=translate,
         name=image_layer.name + f" binned {bin_size}",
     )
 
@@ -0,0 +1,364 @@
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+SUMMARY_COLUMNS = [
+    "file",
+    "channel",
+    "label",
+    "n_pixels",
+    "photon_count",
+    "G",
+    "S",
+    "G_mean",
+    "S_mean",
+    "laser_frequency",
+    "harmonic",
+]
+
+
+def analyze_file(
+    path,
+    laser_frequency=40,
+    harmonic=1,
+    threshold=10,
+    labels_suffix="_labels",
+):
+    """Calculate phasor statistics of a single FLIM file.
+
+    Each channel gets one row with label 0, summarizing all pixels above
+    the threshold. If a '<name><labels_suffix>.tif' label image exists next
+    to the file, each object of it gets one more row.
+
+    Parameters
+    ----------
+    path : str or Path
+        Path to a FLIM file readable by the plugin reader.
+    laser_frequency : float, optional
+        laser frequency in MHz, used if the file metadata has no laser
+        frequency, by default 40
+    harmonic : int, optional
+        harmonic to calculate, by default 1
+    threshold : int, optional
+        pixels with summed intensity below this threshold are discarded, by
+        default 10
+    labels_suffix : str, optional
+        suffix of the label image files, by default "_labels"
+
+    Returns
+    -------
+    pd.DataFrame
+        table with the `SUMMARY_COLUMNS`. 'G' and 'S' are photon-weighted
+        averages (the phasor of the summed decay), while 'G_mean' and
+        'S_mean' are averages over pixels.
+    """
+    import pandas as pd
+    import tifffile
+    from napari_flim_phasor_plotter._reader import (
+        flim_file_reader,
+        get_laser_frequency_from_metadata,
+    )
+    from napari_flim_phasor_plotter.phasor import get_phasor_components
+    from napari_flim_phasor_plotter.filters import (
+        make_time_window,
+        make_space_mask_from_manual_threshold,
+    )
+
+    path = Path(path)
+    # first layer holds the (ch, ut, t, z, y, x) data
+    data, add_kwargs, _ = flim_file_reader(str(path))[0]
+    if data.shape[1] == 1:
+        # the reader returns a placeholder layer for files it cannot read
+        raise ValueError(
+            f"'{path}' is not a FLIM file, or it is too big to be read "
+            "(convert it to zarr first)"
+        )
+    metadata_list = add_kwargs["metadata"]
+
+    label_image = None
+    labels_path = path.with_name(path.stem + labels_suffix + ".tif")
+    if labels_path.exists():
+        label_image = tifffile.imread(labels_path)
+
+    tables = []
+    for channel, channel_data in enumerate(data):
+        if len(metadata_list) > channel:
+            channel_frequency = get_laser_frequency_from_metadata(
+                metadata_list[channel], laser_frequency
+            )
+        else:
+            channel_frequency = laser_frequency
+        channel_data = np.asarray(channel_data)
+        time_window = make_time_window(channel_data, channel_frequency)
+        # processes already run in parallel, one numba thread each
+        g, s, _ = get_phasor_components(
+            channel_data,
+            harmonic=harmonic,
+            n_threads=1,
+            time_window=time_window,
+        )
+        space_mask = np.asarray(
+            make_space_mask_from_manual_threshold(channel_data, threshold)
+        )
+        # label 0 gathers all pixels above threshold, pixels of objects are
+        # counted again under their own label
+        summary = _summarize_phasors(
+            channel_data, space_mask.astype(int), g, s, harmonic, time_window
+        )
+        summary["label"] = 0
+        if label_image is not None:
+            objects = np.where(
+                space_mask, np.broadcast_to(label_image, space_mask.shape), 0
+            )
+            summary = pd.concat(
+                [
+                    summary,
+                    _summarize_phasors(
+                        channel_data, objects, g, s, harmonic, time_window
+                    ),
+                ],
+                ignore_index=True,
+            )
+        tables.append(
+            summary.assign(channel=channel, laser_frequency=channel_frequency)
+        )
+    table = pd.concat(tables, ignore_index=True)
+    table["file"] = str(path)
+    table["harmonic"] = harmonic
+    return table[SUMMARY_COLUMNS]
+
+
+def _summarize_phasors(flim_data, label_image, g, s, harmonic, time_window):
+    """Pixel counts, photon counts and average phasors per object
+
+    'G' and 'S' are the phasors of the summed decay of each object, from
+    `get_object_phasor_components`, while 'G_mean' and 'S_mean' average
+    the phasors of its pixels.
+    """
+    import pandas as pd
+    from napari_flim_phasor_plotter.phasor import get_object_phasor_components
+
+    labels, g_objects, s_objects, photon_count = get_object_phasor_components(
+        flim_data, label_image, harmonic=harmonic, time_window=time_window
+    )
+    objects = pd.DataFrame(
+        {
+            "label": labels,
+            "photon_count": photon_count,
+            "G": g_objects,
+            "S": s_objects,
+        }
+    )
+
+    label_image = label_image.ravel()
+    n_pixels = np.bincount(label_image)
+    present = np.flatnonzero(n_pixels)
+    present = present[present > 0]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        pixels = pd.DataFrame(
+            {
+                "label": present,
+                "n_pixels": n_pixels[present],
+                "G_mean": np.bincount(label_image, weights=g.ravel())[present]
+                / n_pixels[present],
+                "S_mean": np.bincount(label_image, weights=s.ravel())[present]
+                / n_pixels[present],
+            }
+        )
+    return pixels.merge(objects, on="label", how="left")
+
+
+def analyze_folder(
+    folder_path,
+    output_path=None,
+    laser_frequency=40,
+    harmonic=1,
+    threshold=10,
+    labels_suffix="_labels",
+    n_workers=None,
+):
+    """Calculate phasor statistics of all FLIM files of a folder.
+
+    Files are analyzed by `analyze_file` in a process pool and the rows of
+    each file are written to the summary table as soon as the file is done.
+    Files already in the summary table are skipped, so an interrupted run
+    can be resumed by running it again.
+
+    Parameters
+    ----------
+    folder_path : str or Path
+        Folder with '.ptu', '.sdt' or '.tif' FLIM files (subfolders
+        included). Label images (ending with `labels_suffix`) are not
+        analyzed.
+    output_path : str or Path, optional
+        Path to the summary table, a '.csv' or a '.parquet' file (requires
+        pyarrow), by default None (saves 'phasor_summary.csv' in the folder)
+    laser_frequency : float, optional
+        laser frequency in MHz, used if the file metadata has no laser
+        frequency, by default 40
+    harmonic : int, optional
+        harmonic to calculate, by default 1
+    threshold : int, optional
+        pixels with summed intensity below this threshold are discarded, by
+        default 10
+    labels_suffix : str, optional
+        suffix of the label image files, by default "_labels"
+    n_workers : int, optional
+        number of processes, by default None (number of CPUs)
+
+    Returns
+    -------
+    pd.DataFrame
+        summary table with the `SUMMARY_COLUMNS`. 'file' holds paths
+        relative to `folder_path`.
+    """
+    import multiprocessing
+    import warnings
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    import pandas as pd
+    from natsort import natsorted
+
+    folder_path = Path(folder_path)
+    if output_path is None:
+        output_path = folder_path / "phasor_summary.csv"
+    output_path = Path(output_path)
+    if output_path.suffix not in (".csv", ".parquet"):
+        raise ValueError(
+            "output_path must be a '.csv' or a '.parquet' file, "
+            f"got '{output_path.name}'"
+        )
+
+    tables = []
+    if output_path.exists():
+        tables.append(_read_summary(output_path))
+    done = set(tables[0]["file"]) if tables else set()
+    file_paths = natsorted(
+        path
+        for path in folder_path.rglob("*")
+        if path.suffix.lower() in (".ptu", ".sdt", ".tif", ".tiff")
+        and not path.stem.endswith(labels_suffix)
+        and path.relative_to(folder_path).as_posix() not in done
+    )
+
+    # numba thread pools (TBB, OpenMP) do not survive a fork, so workers
+    # are spawned
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        futures = {
+            executor.submit(
+                analyze_file,
+                path,
+                laser_frequency,
+                harmonic,
+                threshold,
+                labels_suffix,
+            ): path
+            for path in file_paths
+        }
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                table = future.result()
+            except Exception as error:
+                # not written, so the file is retried in the next run
+                warnings.warn(f"Could not analyze {path}: {error}")
+                continue
+            table["file"] = path.relative_to(folder_path).as_posix()
+            _append_to_summary(output_path, table)
+            tables.append(table)
+    if not tables:
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+    return pd.concat(tables, ignore_index=True)
+
+
+def _read_summary(output_path):
+    """Read a '.csv' or '.parquet' summary table"""
+    import pandas as pd
+
+    if output_path.suffix == ".parquet":
+        return pd.read_parquet(output_path)
+    return pd.read_csv(output_path)
+
+
+def _append_to_summary(output_path, table):
+    """Append rows to a '.csv' or '.parquet' summary table"""
+    import pandas as pd
+
+    if output_path.suffix == ".parquet":
+        # Parquet files cannot be appended to, so the table is rewritten
+        if output_path.exists():
+            table = pd.concat(
+                [_read_summary(output_path), table], ignore_index=True
+            )
+        table.to_parquet(output_path, index=False)
+    else:
+        table.to_csv(
+            output_path,
+            mode="a",
+            header=not output_path.exists(),
+            index=False,
+        )
+
+
+def main(argv=None):
+    """Command line entry point of `analyze_folder`"""
+    parser = argparse.ArgumentParser(
+        description=(
+            "Calculate phasor statistics of all FLIM files of a folder and "
+            "save them to a summary table."
+        )
+    )
+    parser.add_argument("folder", help="folder with FLIM files")
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=None,
+        help="summary table (.csv or .parquet), by default "
+        "'phasor_summary.csv' in the folder",
+    )
+    parser.add_argument(
+        "-f",
+        "--laser-frequency",
+        type=float,
+        default=40,
+        help="laser frequency in MHz, if not in the file metadata",
+    )
+    parser.add_argument(
+        "--harmonic", type=int, default=1, help="harmonic to calculate"
+    )
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        default=10,
+        help="minimum summed intensity of pixels",
+    )
+    parser.add_argument(
+        "--labels-suffix",
+        default="_labels",
+        help="suffix of label images with objects to analyze",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=None,
+        help="number of processes, by default the number of CPUs",
+    )
+    args = parser.parse_args(argv)
+    analyze_folder(
+        args.folder,
+        output_path=args.output,
+        laser_frequency=args.laser_frequency,
+        harmonic=args.harmonic,
+        threshold=args.threshold,
+        labels_suffix=args.labels_suffix,
+        n_workers=args.workers,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+import numba as nb
+import numpy as np
+
+
+def median_filter_phasor(g, s, n=1, intensity=None, n_threads=None):
+    """Median filter G and S with a 3x3x3 footprint over each timepoint.
+
+    G and S are filtered together, by a single parallel kernel. Borders are
+    handled like in `skimage.filters.median` (nearest mode), so the
+    unweighted filter gives the same output as `apply_median_filter`.
+    Iterations alternate between two output buffers instead of allocating
+    new arrays. Dask arrays are filtered lazily, block by block, with an
+    overlap of `n` pixels along z, y and x.
+
+    Parameters
+    ----------
+    g : np.ndarray or da.Array
+        G component with dimensions (time, z, y, x). time and z are
+        optional.
+    s : np.ndarray or da.Array
+        S component, with the same shape as `g`.
+    n : int, optional
+        Number of iterations of the filter, by default 1
+    intensity : np.ndarray or da.Array, optional
+        Intensity (DC) of each pixel, with the same shape as `g`. If given,
+        the intensity-weighted median is used, so that dim pixels weigh
+        less than bright ones, by default None
+    n_threads : int, optional
+        Number of numba threads used for NumPy arrays, by default None (all
+        threads)
+
+    Returns
+    -------
+    g_filtered, s_filtered : np.ndarray or da.Array
+        Filtered G and S, with the shape and dtype of `g` and `s`.
+    """
+    import dask.array as da
+
+    if g.shape != s.shape:
+        raise ValueError(
+            f"g and s must have the same shape, got {g.shape} and {s.shape}"
+        )
+    if intensity is not None and intensity.shape != g.shape:
+        raise ValueError(
+            "intensity must have the same shape as g and s, got "
+            f"{intensity.shape} and {g.shape}"
+        )
+    if n < 1:
+        return g, s
+    arrays = [g, s] if intensity is None else [g, s, intensity]
+    if any(isinstance(array, da.Array) for array in arrays):
+        return _median_filter_phasor_dask(g, s, n, intensity)
+
+    shape = g.shape
+    g, s = _to_4d(np.asarray(g)), _to_4d(np.asarray(s))
+    if intensity is not None:
+        intensity = _to_4d(np.asarray(intensity, dtype=np.float64))
+    previous_n_threads = nb.get_num_threads()
+    if n_threads is not None:
+        nb.set_num_threads(min(n_threads, nb.config.NUMBA_NUM_THREADS))
+    try:
+        g_filtered, s_filtered = _iterate_median(
+            g, s, n, intensity, _median_kernel
+        )
+    finally:
+        nb.set_num_threads(previous_n_threads)
+    return g_filtered.reshape(shape), s_filtered.reshape(shape)
+
+
+def _to_4d(array):
+    """View of an array with dimensions (time, z, y, x)"""
+    return array.reshape((1,) * (4 - array.ndim) + array.shape)
+
+
+def _iterate_median(g, s, n, intensity, kernel):
+    """Run `n` iterations of a median kernel, alternating two buffers"""
+    buffers = [
+        (np.empty_like(g), np.empty_like(s)),
+        (np.empty_like(g), np.empty_like(s)) if n > 1 else None,
+    ]
+    weighted = intensity is not None
+    if not weighted:
+        # unused by the unweighted kernel
+        intensity = np.empty((1, 1, 1, 1))
+    g_in, s_in = g, s
+    for i in range(n):
+        g_out, s_out = buffers[i % 2]
+        kernel(g_in, s_in, intensity, weighted, g_out, s_out)
+        g_in, s_in = g_out, s_out
+    return g_in, s_in
+
+
+@nb.njit(cache=True, inline="always")
+def _median_row(g, s, intensity, weighted, g_out, s_out, row):
+    """Filter one (t, z, y) row of G and S.
+
+    The 3x3x3 footprint is split in three columns of 9 (z, y) neighbors.
+    Each column of the row is sorted once and shared by the three
+    footprints containing it, which then merge their sorted columns up to
+    the median. Neighbors outside the array take the value of the nearest
+    border pixel.
+    """
+    n_z, n_y, n_x = g.shape[1], g.shape[2], g.shape[3]
+    t = row // (n_z * n_y)
+    z = (row // n_y) % n_z
+    y = row % n_y
+    g_columns = np.empty((n_x, 9), dtype=g.dtype)
+    s_columns = np.empty((n_x, 9), dtype=s.dtype)
+    g_weights = np.empty((n_x, 9))
+    s_weights = np.empty((n_x, 9))
+    column_totals = np.zeros(n_x)
+    for x in range(n_x):
+        i = 0
+        for dz in range(-1, 2):
+            zz = min(max(z + dz, 0), n_z - 1)
+            for dy in range(-1, 2):
+                yy = min(max(y + dy, 0), n_y - 1)
+                weight = 1.0
+                if weighted:
+                    weight = intensity[t, zz, yy, x]
+                g_columns[x, i] = g[t, zz, yy, x]
+                s_columns[x, i] = s[t, zz, yy, x]
+                g_weights[x, i] = weight
+                s_weights[x, i] = weight
+                column_totals[x] += weight
+                i += 1
+        _sort_with_weights(g_columns[x], g_weights[x])
+        _sort_with_weights(s_columns[x], s_weights[x])
+    for x in range(n_x):
+        left, right = max(x - 1, 0), min(x + 1, n_x - 1)
+        total = column_totals[left] + column_totals[x] + column_totals[right]
+        g_out[t, z, y, x] = _merged_median(
+            g_columns, g_weights, left, x, right, total
+        )
+        s_out[t, z, y, x] = _merged_median(
+            s_columns, s_weights, left, x, right, total
+        )
+
+
+@nb.njit(cache=True, inline="always")
+def _sort_with_weights(values, weights):
+    """Insertion sort of a short array, moving its weights along"""
+    for i in range(1, len(values)):
+        value, weight = values[i], weights[i]
+        j = i - 1
+        while j >= 0 and values[j] > value:
+            values[j + 1] = values[j]
+            weights[j + 1] = weights[j]
+            j -= 1
+        values[j + 1] = value
+        weights[j + 1] = weight
+
+
+@nb.njit(cache=True, inline="always")
+def _merged_median(columns, weights, left, center, right, total):
+    """Weighted median of three sorted columns.
+
+    The weighted median is the smallest value whose cumulative weight
+    reaches half of the total weight. Without any weight in the footprint,
+    the plain median is used.
+    """
+    use_weights = total > 0
+    if not use_weights:
+        total = 27.0
+    indices = np.zeros(3, dtype=np.int64)
+    selected = (left, center, right)
+    cumulative = 0.0
+    value = columns[center, 0]
+    for _ in range(27):
+        best = -1
+        for k in range(3):
+            if indices[k] < 9 and (
+                best < 0
+                or columns[selected[k], indices[k]]
+                < columns[selected[best], indices[best]]
+            ):
+                best = k
+        column, i = selected[best], indices[best]
+        value = columns[column, i]
+        cumulative += weights[column, i] if use_weights else 1.0
+        if cumulative >= total / 2:
+            break
+        indices[best] += 1
+    return value
+
+
+@nb.njit(parallel=True, cache=True)
+def _median_kernel(g, s, intensity, weighted, g_out, s_out):
+    """3x3x3 median of G and S, one (t, z, y) row per iteration"""
+    n_rows = g.shape[0] * g.shape[1] * g.shape[2]
+    for row in nb.prange(n_rows):
+        _median_row(g, s, intensity, weighted, g_out, s_out, row)
+
+
+@nb.njit(cache=True, nogil=True)
+def _median_kernel_serial(g, s, intensity, weighted, g_out, s_out):
+    """Serial version of `_median_kernel` for dask blocks, which are
+    already processed in parallel"""
+    n_rows = g.shape[0] * g.shape[1] * g.shape[2]
+    for row in range(n_rows):
+        _median_row(g, s, intensity, weighted, g_out, s_out, row)
+
+
+def _median_block(block, n):
+    """Filter G and S of a block of stacked G, S (and intensity)"""
+    intensity = block[2].astype(np.float64) if len(block) > 2 else None
+    g_filtered, s_filtered = _iterate_median(
+        np.ascontiguousarray(block[0]),
+        np.ascontiguousarray(block[1]),
+        n,
+        intensity,
+        _median_kernel_serial,
+    )
+    return np.concatenate([np.stack([g_filtered, s_filtered]), block[2:]])
+
+
+def _median_filter_phasor_dask(g, s, n, intensity=None):
+    """Lazy `median_filter_phasor` of dask arrays with `map_overlap`.
+
+    Blocks overlap by `n` pixels along z, y and x. Blocks are not padded at
+    the array borders, where the kernel uses the nearest mode, and pixels
+    near block edges affected by the missing neighbors of the overlap are
+    trimmed away.
+    """
+    import dask.array as da
+
+    shape = g.shape
+    arrays = [g, s] if intensity is None else [g, s, intensity]
+    dtype = np.result_type(g.dtype, s.dtype)
+    stack = da.stack(
+        [_to_4d(da.asarray(array)).astype(dtype) for array in arrays]
+    ).rechunk({0: -1})
+    # axes in a single chunk (like short z axes) need no overlap
+    short_axes = {axis: -1 for axis in (2, 3, 4) if stack.shape[axis] <= 2 * n}
+    stack = stack.rechunk(short_axes)
+    depth = {axis: 0 if stack.numblocks[axis] == 1 else n for axis in range(5)}
+    depth[0] = depth[1] = 0
+    filtered = stack.map_overlap(
+        _median_block,
+        depth=depth,
+        boundary="none",
+        dtype=dtype,
+        n=n,
+    )
+    return filtered[0].reshape(shape), filtered[1].reshape(shape)
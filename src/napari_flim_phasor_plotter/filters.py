@@ -1,13 +1,18 @@
 from magicgui import magic_factory
 from typing import TYPE_CHECKING
 
+import numba as nb
+import numpy as np
+
 if TYPE_CHECKING:
     import napari.types
 
 
-def make_time_mask(image, laser_frequency):
+def make_time_window(
+    image, laser_frequency, method="argmax", n_samples=10000, seed=0
+):
     """
-    Create a time mask from the image histogram maximum onwards
+    Create a time window from the image histogram maximum onwards
 
     Parameters
     ----------
@@ -15,32 +20,173 @@ def make_time_mask(image, laser_frequency):
         The flim timelapse image
     laser_frequency: float
         Frequency of the pulsed laser (in MHz)
+    method: str, optional
+        How the window start (the decay maximum) is found:
+        'argmax' histograms the microtime of the maximum of every pixel,
+        'subsample' does the same for a random sample of `n_samples` pixels
+        and 'summed_decay' takes the maximum of the decay summed over all
+        pixels, which is reduced chunk by chunk for dask arrays without
+        keeping per-pixel results. By default "argmax"
+    n_samples: int, optional
+        Number of pixels of the 'subsample' method, by default 10000
+    seed: int, optional
+        Seed of the random pixels of the 'subsample' method, by default 0
     Returns
     -------
-    time_mask : boolean array
-        Time mask
+    time_window : slice
+        Contiguous window of microtime indices. Indexing the microtime axis
+        with it returns a view instead of a copy.
     """
     import numpy as np
+    import dask.array as da
+
+    n_points = image.shape[0]
+    if method == "summed_decay":
+        decay = image.sum(axis=tuple(range(1, image.ndim)), dtype=np.float64)
+        if isinstance(decay, da.Array):
+            decay = decay.compute()
+        start_index = int(np.argmax(decay[1:]) + 1)
+        return slice(start_index, n_points)
+    if method == "subsample":
+        spatial_shape = image.shape[1:]
+        n_pixels = int(np.prod(spatial_shape))
+        if n_samples < n_pixels:
+            rng = np.random.default_rng(seed)
+            # sorted, so that samples are read in storage order
+            pixels = np.sort(rng.choice(n_pixels, n_samples, replace=False))
+            pixels = np.unravel_index(pixels, spatial_shape)
+            if isinstance(image, da.Array):
+                # vindex puts the sampled pixels first
+                image = image.vindex[(slice(None),) + pixels].T
+            else:
+                image = image[(slice(None),) + pixels]
+    elif method != "argmax":
+        raise ValueError(
+            "method must be 'argmax', 'subsample' or 'summed_decay', "
+            f"got '{method}'"
+        )
+    peak_indices = np.argmax(image, axis=0)
+    if isinstance(peak_indices, da.Array):
+        peak_indices = peak_indices.compute()
+    start_index = _get_peak_histogram_start(
+        peak_indices, laser_frequency, n_points
+    )
+    return slice(start_index, n_points)
+
+
+def _get_peak_histogram_start(peak_indices, laser_frequency, n_points):
+    """Most frequent microtime index of the decay maxima, ignoring the
+    first one"""
+    import numpy as np
     from napari_flim_phasor_plotter._synthetic import create_time_array
 
     # create time array based on laser frequency
     time_array = create_time_array(
-        laser_frequency, n_points=image.shape[0]
+        laser_frequency, n_points=n_points
     )  # ut axis
     time_step = time_array[1]
     # choose starting index based on maximum value of image histogram
     heights, bin_edges = np.histogram(
         # index where ut max
-        np.ravel(np.argmax(image, axis=0) * time_step),
+        np.ravel(peak_indices * time_step),
         bins=time_array,
     )
+    return int(np.argmax(heights[1:]) + 1)
+
+
+def make_time_mask(
+    image, laser_frequency, method="argmax", n_samples=10000, seed=0
+):
+    """
+    Create a time mask from the image histogram maximum onwards
+
+    Parameters
+    ----------
+    image: array
+        The flim timelapse image
+    laser_frequency: float
+        Frequency of the pulsed laser (in MHz)
+    method: str, optional
+        How the decay maximum is found, 'argmax', 'subsample' or
+        'summed_decay' (see `make_time_window`), by default "argmax"
+    n_samples: int, optional
+        Number of pixels of the 'subsample' method, by default 10000
+    seed: int, optional
+        Seed of the random pixels of the 'subsample' method, by default 0
+    Returns
+    -------
+    time_mask : boolean array
+        Time mask
+    """
+    import numpy as np
 
-    start_index = np.argmax(heights[1:]) + 1
-    time_mask = time_array >= time_array[start_index]
+    time_mask = np.zeros(image.shape[0], dtype=bool)
+    time_mask[
+        make_time_window(image, laser_frequency, method, n_samples, seed)
+    ] = True
 
     return time_mask
 
 
+def get_intensity_image(image, metadata=None):
+    """
+    Get the summed intensity image over microtime, computed once per image
+
+    The projection is kept in the phasor cache, keyed by the identity of
+    the image, so that masks with other thresholds and re-runs of the
+    widgets share it. For dask arrays it is a lazy projection until a
+    computed one is stored with `set_intensity_image`.
+
+    Parameters
+    ----------
+    image: array
+        The flim timelapse image, with microtime as first axis
+    metadata : dict, optional
+        Metadata of the layer of `image`. A projection stored there by the
+        reader, as 'intensity_image', is moved to the cache instead of
+        summing the image again, by default None
+    Returns
+    -------
+    intensity_image : array
+        The summed intensity image
+    """
+    import numpy as np
+    from napari_flim_phasor_plotter._cache import phasor_cache
+
+    key = phasor_cache.data_key(image) + ("intensity",)
+    intensity_image = phasor_cache.get(key)
+    if intensity_image is None and metadata is not None:
+        # Once in the cache, changes of the image invalidate it
+        intensity_image = metadata.pop("intensity_image", None)
+        if (
+            intensity_image is not None
+            and intensity_image.shape != image.shape[1:]
+        ):
+            intensity_image = None
+    if intensity_image is None:
+        intensity_image = np.sum(image, axis=0)
+    phasor_cache.set(key, intensity_image)
+    return intensity_image
+
+
+def set_intensity_image(image, intensity_image):
+    """
+    Store the summed intensity image of an image for `get_intensity_image`
+
+    Parameters
+    ----------
+    image: array
+        The flim timelapse image, with microtime as first axis
+    intensity_image : array
+        Its summed intensity image, for example a computed projection of a
+        dask array
+    """
+    from napari_flim_phasor_plotter._cache import phasor_cache
+
+    key = phasor_cache.data_key(image) + ("intensity",)
+    phasor_cache.set(key, intensity_image)
+
+
 def make_space_mask_from_manual_threshold(image, threshold):
     """
     Create a space mask from the summed intensity image over time, keeping
@@ -57,9 +203,7 @@ def make_space_mask_from_manual_threshold(image, threshold):
     space_mask : boolean array
         A boolean mask representing pixels to keep.
     """
-    import numpy as np
-
-    intensity_image = np.sum(image, axis=0)
+    intensity_image = get_intensity_image(image)
     space_mask = intensity_image >= threshold
 
     return space_mask
@@ -90,10 +234,27 @@ def apply_binning(
     flim_image: "napari.types.ImageData",
     bin_size: int = 2,
     binning_3D: bool = True,
+    downsample: bool = False,
 ) -> "napari.types.ImageData":
     """
     Apply binning to TCSPC FLIM image.
 
+    Each pixel gets the sum of a box of `bin_size` pixels around it, like a
+    convolution with a kernel of ones (with 'reflect' borders, as in
+    `scipy.ndimage.convolve`). Box sums are running sums along x, y (and z),
+    calculated by a parallel kernel for all microtime bins and timepoints
+    at once. Integer data are summed in the smallest integer type (at least
+    as large as the input type) that cannot overflow, given the range of
+    the data and the number of pixels of the box. Float data are summed in
+    float64 and keep their type.
+
+    With `downsample`, pixels are instead summed in non-overlapping blocks
+    of `bin_size` pixels along y and x (and z), which divides the size of
+    these axes by `bin_size`. Pixels beyond the last full block are
+    discarded.
+
+    Dask arrays are binned lazily, block by block, in both modes.
+
     Parameters
     ----------
     flim_image: array
@@ -105,37 +266,261 @@ def apply_binning(
         if True, applies a 3D binning kernel,
         if False, applies a 2D binning kernel to each slice,
         by default True
+    downsample : bool, optional
+        if True, sums non-overlapping blocks instead of a box around each
+        pixel, so the output is smaller. z is only binned if `binning_3D`
+        and if it has at least `bin_size` slices, by default False
     Returns
     -------
     image_binned : array
-        The binned FLIM data
+        The binned FLIM data, with the data type of the sums
     """
     import numpy as np
-    from scipy.ndimage import convolve
+    import dask.array as da
 
+    if downsample:
+        return _downsample(flim_image, bin_size, binning_3D)
+    if isinstance(flim_image, da.Array):
+        return _apply_binning_dask(flim_image, bin_size, binning_3D)
     shape = flim_image.shape
+    flim_image = np.ascontiguousarray(flim_image)
     # Add dimensions if needed, to make it 5D (ut, time, z, y, x)
-    while len(flim_image.shape) < 5:
-        flim_image = np.expand_dims(flim_image, axis=0)
-    image_binned = np.zeros_like(flim_image)
+    flim_image = flim_image.reshape((1,) * (5 - flim_image.ndim) + shape)
+    box_size = bin_size ** (3 if binning_3D else 2)
+    image_binned = np.empty(
+        flim_image.shape, dtype=_get_binning_dtype(flim_image, box_size)
+    )
+    _box_sum_kernel(
+        flim_image,
+        image_binned,
+        bin_size,
+        binning_3D,
+        _get_accumulator(image_binned.dtype),
+    )
+    # return with original shape
+    return image_binned.reshape(shape)
 
-    if binning_3D:
-        kernel = np.full((bin_size, bin_size, bin_size), 1)
 
-        for utime, time in np.ndindex(
-            flim_image.shape[0], flim_image.shape[1]
-        ):
-            image_binned[utime, time, :, :, :] = convolve(
-                flim_image[utime, time, :, :, :], kernel
-            )
-    else:
-        kernel = np.full((bin_size, bin_size), 1)
+def _apply_binning_dask(flim_image, bin_size, binning_3D):
+    """Lazy `apply_binning` of a dask array with `map_overlap`.
 
-        for utime, time, z in np.ndindex(
-            flim_image.shape[0], flim_image.shape[1], flim_image.shape[2]
-        ):
-            image_binned[utime, time, z, :, :] = convolve(
-                flim_image[utime, time, z, :, :], kernel
-            )
+    Blocks overlap by `bin_size - 1` pixels along y and x (and z). Blocks
+    are not padded at the array borders, where the kernel mirrors them, and
+    pixels near block edges affected by the missing neighbors of the overlap
+    are trimmed away.
+    """
+    shape = flim_image.shape
+    # Add dimensions if needed, to make it 5D (ut, time, z, y, x)
+    flim_image = flim_image.reshape((1,) * (5 - flim_image.ndim) + shape)
+    box_size = bin_size ** (3 if binning_3D else 2)
+    dtype = _get_binning_dtype(flim_image, box_size)
+    axes = (2, 3, 4) if binning_3D else (3, 4)
+    depth = bin_size - 1
+    # short axes are kept in a single chunk, which needs no overlap
+    flim_image = flim_image.rechunk(
+        {axis: -1 for axis in axes if flim_image.shape[axis] <= 2 * depth}
+    )
+    depth = {
+        axis: (depth if axis in axes and flim_image.numblocks[axis] > 1 else 0)
+        for axis in range(5)
+    }
+    image_binned = flim_image.map_overlap(
+        _box_sum_block,
+        depth=depth,
+        boundary="none",
+        dtype=dtype,
+        bin_size=bin_size,
+        binning_3D=binning_3D,
+        output_dtype=dtype,
+    )
     # return with original shape
     return image_binned.reshape(shape)
+
+
+def _downsample(flim_image, bin_size, binning_3D):
+    """Sum non-overlapping blocks along y and x (and z) of FLIM data"""
+    import dask.array as da
+
+    shape = flim_image.shape
+    n_missing = 5 - len(shape)
+    # Add dimensions after microtime if needed, to make it 5D
+    # (ut, time, z, y, x)
+    flim_image = flim_image.reshape(shape[:1] + (1,) * n_missing + shape[1:])
+    axes = [3, 4]
+    if binning_3D and flim_image.shape[2] >= bin_size:
+        axes.insert(0, 2)
+    dtype = _get_binning_dtype(flim_image, bin_size ** len(axes))
+    if isinstance(flim_image, da.Array):
+        image_binned = da.coarsen(
+            np.sum,
+            flim_image,
+            {axis: bin_size for axis in axes},
+            trim_excess=True,
+            dtype=dtype,
+        )
+    else:
+        # split binned axes in (blocks, bin_size) and sum over bin_size
+        trimmed = tuple(
+            slice(0, size - size % bin_size if axis in axes else size)
+            for axis, size in enumerate(flim_image.shape)
+        )
+        flim_image = flim_image[trimmed]
+        blocks_shape = []
+        for axis, size in enumerate(flim_image.shape):
+            if axis in axes:
+                blocks_shape += [size // bin_size, bin_size]
+            else:
+                blocks_shape.append(size)
+        sum_axes = tuple(axis + i + 1 for i, axis in enumerate(axes))
+        image_binned = np.asarray(flim_image).reshape(blocks_shape)
+        image_binned = image_binned.sum(axis=sum_axes, dtype=dtype)
+    # return with original number of dimensions
+    return image_binned.reshape(
+        image_binned.shape[:1] + image_binned.shape[1 + n_missing :]
+    )
+
+
+def _get_binning_dtype(flim_image, box_size):
+    """Smallest integer type, not smaller than the type of `flim_image`,
+    that holds sums of `box_size` of its values. Floats keep their type.
+    Dask arrays are not read, so the whole range of their type is assumed.
+    """
+    import dask.array as da
+
+    dtype = flim_image.dtype
+    if dtype == bool:
+        dtype = np.dtype(np.uint8)
+    if dtype.kind not in "ui" or flim_image.size == 0:
+        return dtype
+    if isinstance(flim_image, da.Array):
+        low = int(np.iinfo(dtype).min) * box_size
+        high = int(np.iinfo(dtype).max) * box_size
+    else:
+        low = int(flim_image.min()) * box_size
+        high = int(flim_image.max()) * box_size
+    candidates = (
+        (np.uint8, np.uint16, np.uint32, np.uint64)
+        if dtype.kind == "u"
+        else (np.int8, np.int16, np.int32, np.int64)
+    )
+    for candidate in candidates:
+        info = np.iinfo(candidate)
+        if (
+            np.dtype(candidate).itemsize >= dtype.itemsize
+            and info.min <= low
+            and high <= info.max
+        ):
+            return np.dtype(candidate)
+    return np.dtype(np.float64)
+
+
+@nb.njit(cache=True, inline="always")
+def _reflect(index, length):
+    """Index mirrored into [0, length), like the 'reflect' mode of
+    `scipy.ndimage`"""
+    if 0 <= index < length:
+        return index
+    period = 2 * length
+    index %= period
+    if index >= length:
+        index = period - 1 - index
+    return index
+
+
+@nb.njit(cache=True, inline="always")
+def _box_sum_rows(source, output, first, n_rows, row_size, bin_size, total):
+    """Box sums along the rows of a block, written to `output`.
+
+    `source` and `output` are flat arrays and the block holds `n_rows` rows
+    of `row_size` contiguous values from `first`. The box of each row spans
+    `bin_size` rows from `(bin_size - 1) // 2` rows before it, and rows
+    beyond the ends of the block are mirrored. Running sums of the rows are
+    kept in `total`.
+    """
+    offset = (bin_size - 1) // 2
+    total[:row_size] = 0
+    for i in range(bin_size - 1):
+        row = first + _reflect(i - offset, n_rows) * row_size
+        for k in range(row_size):
+            total[k] += source[row + k]
+    for i in range(n_rows):
+        row_in = first + _reflect(i + bin_size - 1 - offset, n_rows) * row_size
+        row_out = first + _reflect(i - offset, n_rows) * row_size
+        row = first + i * row_size
+        for k in range(row_size):
+            total[k] += source[row_in + k]
+            output[row + k] = total[k]
+            total[k] -= source[row_out + k]
+
+
+@nb.njit(cache=True, inline="always")
+def _box_sum_volume(image, output, volume, bin_size, binning_3D, accumulator):
+    """Box sums over (z,) y and x of one (ut, time) volume.
+
+    There is one pass per axis. Sums are accumulated in a buffer with the
+    type of `accumulator` (float64 for floats, so that running sums do not
+    drift) and cast to the type of `output` when the volume is stored. The
+    first pass (along x) reads `image` and the others update the buffer
+    from a copy of the plane (or volume) they sum.
+    """
+    n_z, n_y, n_x = image.shape[2], image.shape[3], image.shape[4]
+    image_flat = image.reshape(-1)
+    output_flat = output.reshape(-1)
+    plane_size = n_y * n_x
+    volume_size = n_z * plane_size
+    first = volume * volume_size
+    total = np.empty(plane_size, dtype=accumulator.dtype)
+    sums = np.empty(volume_size, dtype=accumulator.dtype)
+    for row in range(n_z * n_y):
+        start = row * n_x
+        _box_sum_rows(image_flat[first:], sums, start, n_x, 1, bin_size, total)
+    copy = np.empty(
+        volume_size if binning_3D else plane_size, accumulator.dtype
+    )
+    for z in range(n_z):
+        start = z * plane_size
+        copy[:plane_size] = sums[start : start + plane_size]
+        _box_sum_rows(copy, sums[start:], 0, n_y, n_x, bin_size, total)
+    if binning_3D:
+        copy[:] = sums
+        _box_sum_rows(copy, sums, 0, n_z, plane_size, bin_size, total)
+    output_flat[first : first + volume_size] = sums
+
+
+@nb.njit(parallel=True, cache=True)
+def _box_sum_kernel(image, output, bin_size, binning_3D, accumulator):
+    """Box sums over (z,) y and x of a (ut, time, z, y, x) array, one
+    (ut, time) volume per iteration"""
+    for volume in nb.prange(image.shape[0] * image.shape[1]):
+        _box_sum_volume(
+            image, output, volume, bin_size, binning_3D, accumulator
+        )
+
+
+@nb.njit(cache=True, nogil=True)
+def _box_sum_kernel_serial(image, output, bin_size, binning_3D, accumulator):
+    """Serial version of `_box_sum_kernel` for dask blocks, which are
+    already processed in parallel"""
+    for volume in range(image.shape[0] * image.shape[1]):
+        _box_sum_volume(
+            image, output, volume, bin_size, binning_3D, accumulator
+        )
+
+
+def _box_sum_block(block, bin_size, binning_3D, output_dtype):
+    """Box sums of a (ut, time, z, y, x) block"""
+    output = np.empty(block.shape, dtype=output_dtype)
+    _box_sum_kernel_serial(
+        np.ascontiguousarray(block),
+        output,
+        bin_size,
+        binning_3D,
+        _get_accumulator(output_dtype),
+    )
+    return output
+
+
+def _get_accumulator(dtype):
+    """Empty array with the type that box sums of `dtype` are summed in:
+    float64 for floats and the (overflow-safe) type itself for integers"""
+    return np.empty(0, np.float64 if dtype.kind == "f" else dtype)
@@ -1,8 +1,20 @@
+import functools
+import math
+import threading
+
 import numba as nb
 import numpy as np
 
 
-def get_phasor_components(flim_data, harmonic=1):
+def get_phasor_components(
+    flim_data,
+    harmonic=1,
+    method="numba",
+    harmonics=None,
+    n_threads=None,
+    time_window=None,
+    calibration=None,
+):
     """Calculate phasor components G and S from the Fourier transform.
 
     Parameters
@@ -11,11 +23,36 @@ def get_phasor_components(flim_data, harmonic=1):
         FLIM data with dimensions (ut, time, z, y, x). microtime must be the first dimention. time and z are optional.
     harmonic : int, optional
         Harmonic to calculate, by default 1
+    method : str, optional
+        Phasor engine, one of "numba" (parallel numba kernel with float32
+        outputs), "fft" (full Fourier transform along microtime, keeping only
+        the DC and harmonic bins) or "projection" (direct contraction of the
+        microtime axis against precomputed cosine and sine weights), by
+        default "numba". For dask arrays, "numba" runs the kernel on each
+        block with `map_blocks`, after rechunking microtime into a single
+        chunk if needed.
+    harmonics : List[int], optional
+        Several harmonics to calculate in a single pass over the data. If
+        provided, `harmonic` is ignored and G and S get an extra first
+        dimension with one entry per harmonic, by default None
+    n_threads : int, optional
+        Number of threads used by the "numba" engine, by default None (uses
+        all threads available to numba)
+    time_window : slice or Tuple[int, int], optional
+        Microtime window (start, stop) to calculate phasors from, like the
+        one returned by `filters.make_time_window`. It is applied as a slice,
+        so NumPy data is not copied, by default None (whole microtime axis)
+    calibration : Dict[int, Tuple[float, float]], optional
+        Phase shift (in radians) and modulation factor of each harmonic, like
+        the ones returned by `get_calibration_parameters`. The correction is
+        folded into the cosine and sine weights, so calibrated G and S are
+        obtained without an extra pass or copy, by default None
 
     Returns
     -------
     Tuple[np.ndarray, np.ndarray, np.ndarray]
-        G, S, and DC components.
+        G, S, and DC components. If `harmonics` is provided, G and S have
+        dimensions (harmonic, time, z, y, x).
 
     This function was adapted and modified based on PhasorPy v1.0.2
     (https://pypi.org/project/PhasorPy)
@@ -44,40 +81,1463 @@ def get_phasor_components(flim_data, harmonic=1):
     """
     import dask.array as da
 
-    if isinstance(flim_data, da.Array):
-        fft_slice_function = fft_slice_4d_dask
+    if method not in ("numba", "fft", "projection"):
+        raise ValueError(
+            "method must be one of 'numba', 'fft' or 'projection', "
+            f"got '{method}'"
+        )
+
+    if harmonics is None:
+        harmonic_list = [harmonic]
     else:
-        fft_slice_function = fft_slice_4d
+        harmonic_list = list(harmonics)
 
-    dc, _ = fft_slice_function(flim_data, 0)
-    # change the zeros to the img average
-    dc = np.where(dc.real != 0, dc.real, np.mean(dc.real))
+    if time_window is not None:
+        if not isinstance(time_window, slice):
+            time_window = slice(*time_window)
+        flim_data = flim_data[time_window]
 
-    g, s = fft_slice_function(flim_data, harmonic)
-    g /= dc
-    s /= -dc
+    if method == "numba":
+        if isinstance(flim_data, da.Array):
+            g, s, dc = phasor_4d_dask(flim_data, harmonic_list, calibration)
+        else:
+            g, s, dc = phasor_4d_numba(
+                flim_data, harmonic_list, n_threads, calibration
+            )
+    else:
+        if method == "fft":
+            if isinstance(flim_data, da.Array):
+                fft_slice_function = fft_slice_4d_dask
+            else:
+                fft_slice_function = fft_slice_4d
 
+            # DC and all harmonics come from a single Fourier transform
+            real, imag = fft_slice_function(flim_data, [0] + harmonic_list)
+            dc = real[0]
+            g = real[1:]
+            # imaginary part of the Fourier transform has the opposite sign
+            # of S
+            s = -imag[1:]
+        else:
+            if isinstance(flim_data, da.Array):
+                projection_function = projection_4d_dask
+            else:
+                projection_function = projection_4d
+            dc, g, s = projection_function(
+                flim_data, harmonic_list, calibration=calibration
+            )
+        # change the zeros to the img average
+        dc = np.where(dc != 0, dc, np.mean(dc))
+
+        g /= dc
+        s /= dc
+        if method == "fft" and calibration is not None:
+            for i, harmonic in enumerate(harmonic_list):
+                if harmonic in calibration:
+                    g[i], s[i] = calibrate_phasor(
+                        g[i], s[i], *calibration[harmonic]
+                    )
+
+    if harmonics is None:
+        g, s = g[0], s[0]
     return g, s, dc
 
 
-@nb.njit
+def get_multichannel_phasor_components(
+    flim_data,
+    harmonic=1,
+    harmonics=None,
+    time_windows=None,
+    calibration=None,
+):
+    """Calculate phasor components of all channels of a FLIM dataset.
+
+    Each channel gets its own time window and its own DC average for pixels
+    with zero DC. Channels of NumPy data are processed one after the other
+    by the numba kernel without copying them, while channels of dask data
+    are stacked into a single graph, which reads the data only once when
+    computed.
+
+    Parameters
+    ----------
+    flim_data : np.ndarray, da.Array or List[np.ndarray or da.Array]
+        FLIM data with dimensions (ch, ut, time, z, y, x), like the reader
+        output, or a list with one (ut, time, z, y, x) array per channel.
+    harmonic : int, optional
+        Harmonic to calculate, by default 1
+    harmonics : List[int], optional
+        Several harmonics to calculate in a single pass over the data. If
+        provided, `harmonic` is ignored and G and S get an extra dimension
+        after the channel dimension with one entry per harmonic, by default
+        None
+    time_windows : List[slice or Tuple[int, int]], optional
+        Microtime window of each channel, like the ones returned by
+        `filters.make_time_window`, by default None (whole microtime axis)
+    calibration : Dict[int, Tuple[float, float]], optional
+        Phase shift (in radians) and modulation factor of each harmonic,
+        applied to all channels, by default None
+
+    Returns
+    -------
+    Tuple[np.ndarray or da.Array, ...]
+        G, S, and DC components with dimensions (ch, time, z, y, x). If
+        `harmonics` is provided, G and S have dimensions (ch, harmonic,
+        time, z, y, x).
+    """
+    import dask.array as da
+
+    if time_windows is None:
+        time_windows = [None] * len(flim_data)
+    if len(time_windows) != len(flim_data):
+        raise ValueError(
+            f"got {len(time_windows)} time windows for {len(flim_data)} "
+            "channels"
+        )
+    components = [
+        get_phasor_components(
+            channel_data,
+            harmonic=harmonic,
+            harmonics=harmonics,
+            time_window=time_window,
+            calibration=calibration,
+        )
+        for channel_data, time_window in zip(flim_data, time_windows)
+    ]
+    if any(isinstance(dc, da.Array) for _, _, dc in components):
+        stack = da.stack
+    else:
+        stack = np.stack
+    return tuple(stack(arrays) for arrays in zip(*components))
+
+
+def get_object_phasor_components(
+    flim_data,
+    label_image,
+    harmonic=1,
+    harmonics=None,
+    time_window=None,
+    calibration=None,
+):
+    """Calculate one photon-weighted phasor per object of a label image.
+
+    Decays of all pixels of each label are summed with `np.bincount`, one
+    microtime bin at a time, and the phasor of each summed decay is then
+    calculated. Background (label 0) is ignored.
+
+    Parameters
+    ----------
+    flim_data : np.ndarray or da.Array
+        FLIM data with dimensions (ut, time, z, y, x). microtime must be the
+        first dimention. time and z are optional.
+    label_image : np.ndarray or da.Array
+        Label image with the same dimensions as `flim_data` without
+        microtime, or with fewer dimensions that broadcast to them (for
+        example (y, x) labels for a single plane).
+    harmonic : int, optional
+        Harmonic to calculate, by default 1
+    harmonics : List[int], optional
+        Several harmonics to calculate. If provided, `harmonic` is ignored
+        and G and S get an extra first dimension with one entry per
+        harmonic, by default None
+    time_window : slice or Tuple[int, int], optional
+        Microtime window (start, stop) to calculate phasors from, by default
+        None (whole microtime axis)
+    calibration : Dict[int, Tuple[float, float]], optional
+        Phase shift (in radians) and modulation factor of each harmonic, by
+        default None
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+        Labels of the objects and their G, S, and DC (photon counts)
+        components.
+    """
+    import dask
+    import dask.array as da
+
+    if harmonics is None:
+        harmonic_list = [harmonic]
+    else:
+        harmonic_list = list(harmonics)
+    if time_window is not None:
+        if not isinstance(time_window, slice):
+            time_window = slice(*time_window)
+        flim_data = flim_data[time_window]
+
+    label_image = np.asarray(label_image)
+    if label_image.shape != flim_data.shape[1:]:
+        label_image = np.broadcast_to(label_image, flim_data.shape[1:])
+    n_labels = int(label_image.max()) + 1
+
+    if isinstance(flim_data, da.Array):
+        if flim_data.numblocks[0] > 1:
+            flim_data = flim_data.rechunk({0: -1})
+        label_blocks = da.from_array(
+            label_image, chunks=flim_data.chunks[1:]
+        ).to_delayed()
+        decays = [
+            dask.delayed(_sum_decays_per_label)(block, labels, n_labels)
+            for block, labels in zip(
+                flim_data.to_delayed().ravel(), label_blocks.ravel()
+            )
+        ]
+        # tree sum, so that partial sums are released as soon as possible
+        while len(decays) > 1:
+            decays = [
+                (
+                    dask.delayed(np.add)(*decays[i : i + 2])
+                    if i + 1 < len(decays)
+                    else decays[i]
+                )
+                for i in range(0, len(decays), 2)
+            ]
+        decays = decays[0].compute()
+    else:
+        decays = _sum_decays_per_label(flim_data, label_image, n_labels)
+
+    weights = get_phasor_weights(
+        flim_data.shape[0], harmonic_list, calibration
+    )
+    projections = weights @ decays
+    dc = projections[0]
+    labels = np.flatnonzero(dc)
+    labels = labels[labels > 0]
+    dc = dc[labels]
+    n_harmonics = len(harmonic_list)
+    g = projections[1 : n_harmonics + 1, labels] / dc
+    s = projections[n_harmonics + 1 :, labels] / dc
+
+    if harmonics is None:
+        g, s = g[0], s[0]
+    return labels, g, s, dc
+
+
+def _sum_decays_per_label(arr, label_image, n_labels):
+    """Decays summed per label, with dimensions (ut, n_labels)"""
+    arr = np.asarray(arr)
+    labels_flat = np.ravel(label_image)
+    decays = np.empty((arr.shape[0], n_labels))
+    for k in range(arr.shape[0]):
+        decays[k] = np.bincount(
+            labels_flat, weights=np.ravel(arr[k]), minlength=n_labels
+        )
+    return decays
+
+
+def get_lifetimes(g, s, laser_frequency, harmonic=1):
+    """Calculate apparent phase and modulation lifetimes from G and S.
+
+    Each lifetime is calculated by a numba ufunc in a single pass over G and
+    S, which also works lazily on dask arrays.
+
+    Parameters
+    ----------
+    g : np.ndarray or da.Array
+        G component.
+    s : np.ndarray or da.Array
+        S component.
+    laser_frequency : float
+        Laser frequency in MHz.
+    harmonic : int, optional
+        Harmonic of G and S, by default 1
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Phase lifetime (tau_phi) and modulation lifetime (tau_m) in ns.
+        Pixels where a lifetime is undefined (G equal to 0 or modulation
+        equal to 0 or above 1) are NaN.
+    """
+    # angular frequency in rad/ns
+    omega = 2 * np.pi * laser_frequency * 1e-3 * harmonic
+    return (
+        _apply_phasor_ufunc(_phase_lifetime, g, s, omega),
+        _apply_phasor_ufunc(_modulation_lifetime, g, s, omega),
+    )
+
+
+def _apply_phasor_ufunc(ufunc, g, s, *args):
+    """Apply a numba ufunc of G and S, block-wise if any of them is dask"""
+    import dask.array as da
+
+    if isinstance(g, da.Array) or isinstance(s, da.Array):
+        g = da.asarray(g)
+        s = da.asarray(s).rechunk(g.chunks)
+        dtype = np.result_type(g.dtype, s.dtype, np.float32)
+        return da.map_blocks(ufunc, g, s, *args, dtype=dtype)
+    return ufunc(g, s, *args)
+
+
+@nb.vectorize(
+    [
+        "float32(float32, float32, float64)",
+        "float64(float64, float64, float64)",
+    ],
+    cache=True,
+)
+def _phase_lifetime(g, s, omega):
+    """Phase lifetime tau_phi = S / (G * omega)"""
+    if g == 0:
+        return np.nan
+    return s / (g * omega)
+
+
+@nb.vectorize(
+    [
+        "float32(float32, float32, float64)",
+        "float64(float64, float64, float64)",
+    ],
+    cache=True,
+)
+def _modulation_lifetime(g, s, omega):
+    """Modulation lifetime tau_m = sqrt(1 / M**2 - 1) / omega"""
+    modulation_squared = g * g + s * s
+    if modulation_squared == 0 or modulation_squared > 1:
+        return np.nan
+    return math.sqrt(1 / modulation_squared - 1) / omega
+
+
+def get_phasor_statistics(
+    g,
+    s,
+    dc,
+    laser_frequency=None,
+    harmonic=1,
+    space_mask=None,
+    by="frame",
+):
+    """Summarize G, S and DC per frame or per z-slice.
+
+    Statistics are reduced from sums over the pixels of each frame (or
+    slice), so no per-pixel table is built. NumPy arrays are reduced one
+    frame at a time and dask arrays chunk by chunk, with all sums computed
+    in a single pass.
+
+    Parameters
+    ----------
+    g : np.ndarray or da.Array
+        G component with dimensions (time, z, y, x). time and z are
+        optional.
+    s : np.ndarray or da.Array
+        S component, with the same shape as `g`.
+    dc : np.ndarray or da.Array
+        DC component (photon counts), with the same shape as `g`.
+    laser_frequency : float, optional
+        Laser frequency in MHz. If provided, photon-weighted mean apparent
+        lifetimes are added, by default None
+    harmonic : int, optional
+        Harmonic of G and S, by default 1
+    space_mask : np.ndarray or da.Array, optional
+        Boolean mask of the pixels to summarize, with the same shape as
+        `g`, by default None (all pixels)
+    by : str, optional
+        'frame' for one row per timepoint or 'slice' for one row per
+        timepoint and z-slice, by default "frame"
+
+    Returns
+    -------
+    pd.DataFrame
+        Table with 'frame' (and 'z') columns, followed by 'n_pixels',
+        'photon_count', photon-weighted 'G' and 'S', pixel averages
+        'G_mean' and 'S_mean' and standard deviations 'G_std' and 'S_std'.
+        With a laser frequency, 'tau_phase' and 'tau_modulation' are the
+        photon-weighted means of the apparent lifetimes (in ns) of the
+        pixels where they are defined.
+    """
+    import dask
+    import dask.array as da
+    import pandas as pd
+
+    if by not in ("frame", "slice"):
+        raise ValueError(f"by must be 'frame' or 'slice', got '{by}'")
+    arrays = [g, s, dc] + ([] if space_mask is None else [space_mask])
+    if any(array.shape != g.shape for array in arrays):
+        raise ValueError("g, s, dc and space_mask must have the same shape")
+    # reshape to (time, z, y, x)
+    arrays = [
+        array.reshape((1,) * (4 - array.ndim) + array.shape)
+        for array in arrays
+    ]
+    if space_mask is None:
+        arrays.append(None)
+    axis = (1, 2, 3) if by == "frame" else (2, 3)
+
+    if any(isinstance(array, da.Array) for array in arrays):
+        (sums,) = dask.compute(
+            _get_phasor_sums(*arrays, laser_frequency, harmonic, axis)
+        )
+    else:
+        frame_sums = [
+            _get_phasor_sums(
+                *[
+                    None if array is None else array[t : t + 1]
+                    for array in arrays
+                ],
+                laser_frequency,
+                harmonic,
+                axis,
+            )
+            for t in range(arrays[0].shape[0])
+        ]
+        sums = {
+            name: np.concatenate([frame[name] for frame in frame_sums])
+            for name in frame_sums[0]
+        }
+
+    n_pixels = sums["n_pixels"]
+    group_shape = n_pixels.shape
+    with np.errstate(invalid="ignore", divide="ignore"):
+        statistics = {
+            "n_pixels": n_pixels.astype(np.int64),
+            "photon_count": sums["photon_count"],
+            "G": sums["weighted_g"] / sums["photon_count"],
+            "S": sums["weighted_s"] / sums["photon_count"],
+            "G_mean": sums["g"] / n_pixels,
+            "S_mean": sums["s"] / n_pixels,
+        }
+        for name in ("G", "S"):
+            mean_of_squares = sums[name.lower() + "_squared"] / n_pixels
+            variance = mean_of_squares - statistics[name + "_mean"] ** 2
+            statistics[name + "_std"] = np.sqrt(np.maximum(variance, 0))
+        if laser_frequency is not None:
+            for name in ("tau_phase", "tau_modulation"):
+                statistics[name] = (
+                    sums["weighted_" + name] / sums[name + "_photon_count"]
+                )
+
+    indices = np.indices(group_shape).reshape(len(group_shape), -1)
+    table = pd.DataFrame({"frame": indices[0]})
+    if by == "slice":
+        table["z"] = indices[1]
+    for name, values in statistics.items():
+        table[name] = np.ravel(values)
+    return table
+
+
+def _get_phasor_sums(g, s, dc, space_mask, laser_frequency, harmonic, axis):
+    """Sums over `axis` needed by `get_phasor_statistics`"""
+    if space_mask is None:
+        pixel_weights = np.ones_like(dc, dtype=np.float64)
+    else:
+        pixel_weights = space_mask.astype(np.float64)
+    g = g.astype(np.float64) * pixel_weights
+    s = s.astype(np.float64) * pixel_weights
+    photon_weights = dc.astype(np.float64) * pixel_weights
+    sums = {
+        "n_pixels": pixel_weights.sum(axis=axis),
+        "photon_count": photon_weights.sum(axis=axis),
+        "g": g.sum(axis=axis),
+        "s": s.sum(axis=axis),
+        "g_squared": (g * g).sum(axis=axis),
+        "s_squared": (s * s).sum(axis=axis),
+        "weighted_g": (g * dc).sum(axis=axis),
+        "weighted_s": (s * dc).sum(axis=axis),
+    }
+    if laser_frequency is not None:
+        lifetimes = get_lifetimes(g, s, laser_frequency, harmonic)
+        for name, tau in zip(("tau_phase", "tau_modulation"), lifetimes):
+            defined = np.isfinite(tau)
+            tau_weights = np.where(defined, photon_weights, 0)
+            sums["weighted_" + name] = (
+                np.where(defined, tau, 0) * tau_weights
+            ).sum(axis=axis)
+            sums[name + "_photon_count"] = tau_weights.sum(axis=axis)
+    return sums
+
+
+def get_component_fractions(g, s, lifetimes, laser_frequency, harmonic=1):
+    """Calculate fractions of two or three components with known lifetimes.
+
+    Each component is placed on the universal semicircle from its lifetime.
+    With two components, phasors are projected onto the line joining them.
+    With three components, the linear system of G, S and fractions summing
+    to 1 is solved. In both cases each fraction is a fixed linear function
+    of G and S, calculated by a numba ufunc in a single pass, which also
+    works lazily on dask arrays.
+
+    Parameters
+    ----------
+    g : np.ndarray or da.Array
+        G component.
+    s : np.ndarray or da.Array
+        S component.
+    lifetimes : List[float]
+        Lifetimes of the two or three components in ns.
+    laser_frequency : float
+        Laser frequency in MHz.
+    harmonic : int, optional
+        Harmonic of G and S, by default 1
+
+    Returns
+    -------
+    List[np.ndarray]
+        Fraction image of each component (fractions of the intensity, which
+        add up to 1). Fractions are not clipped, so
+        values outside [0, 1] indicate phasors outside of the line (or
+        triangle) joining the components.
+    """
+    if len(lifetimes) not in (2, 3):
+        raise ValueError(
+            f"2 or 3 component lifetimes are required, got {len(lifetimes)}"
+        )
+    omega_tau = (
+        2 * np.pi * laser_frequency * 1e-3 * harmonic * np.asarray(lifetimes)
+    )
+    component_g = 1 / (1 + omega_tau**2)
+    component_s = omega_tau / (1 + omega_tau**2)
+
+    if len(lifetimes) == 2:
+        # projection onto the line from component 2 to component 1
+        delta_g = component_g[0] - component_g[1]
+        delta_s = component_s[0] - component_s[1]
+        squared_distance = delta_g**2 + delta_s**2
+        a = delta_g / squared_distance
+        b = delta_s / squared_distance
+        c = -(a * component_g[1] + b * component_s[1])
+        coefficients = [(a, b, c), (-a, -b, 1 - c)]
+    else:
+        # fractions = inverse(matrix) @ (g, s, 1)
+        matrix = np.stack([component_g, component_s, np.ones(3)])
+        coefficients = np.linalg.inv(matrix)
+
+    return [
+        _apply_phasor_ufunc(_linear_combination, g, s, a, b, c)
+        for a, b, c in coefficients
+    ]
+
+
+@nb.vectorize(
+    [
+        "float32(float32, float32, float64, float64, float64)",
+        "float64(float64, float64, float64, float64, float64)",
+    ],
+    cache=True,
+)
+def _linear_combination(g, s, a, b, c):
+    """a * G + b * S + c"""
+    return a * g + b * s + c
+
+
+def get_calibration_parameters(
+    reference_flim_data,
+    reference_lifetime,
+    laser_frequency,
+    harmonic=1,
+    harmonics=None,
+    time_window=None,
+):
+    """Calculate phasor calibration parameters from a reference measurement.
+
+    The phasor of the reference (all pixels summed into a single decay) is
+    compared to the theoretical phasor of a mono-exponential decay with
+    `reference_lifetime`. Parameters are cached per reference data,
+    laser frequency, harmonic and time window, so they are calculated only
+    once.
+
+    Parameters
+    ----------
+    reference_flim_data : np.ndarray or da.Array
+        FLIM data of a reference fluorophore with known lifetime (or of the
+        instrument response function, with lifetime 0) with dimensions
+        (ut, time, z, y, x). microtime must be the first dimention.
+    reference_lifetime : float
+        Lifetime of the reference in ns.
+    laser_frequency : float
+        Laser frequency in MHz.
+    harmonic : int, optional
+        Harmonic to calibrate, by default 1
+    harmonics : List[int], optional
+        Several harmonics to calibrate. If provided, `harmonic` is ignored,
+        by default None
+    time_window : slice or Tuple[int, int], optional
+        Microtime window (start, stop), which should be the same one used for
+        the data to calibrate, by default None (whole microtime axis)
+
+    Returns
+    -------
+    Dict[int, Tuple[float, float]]
+        Phase shift (in radians) and modulation factor of each harmonic.
+    """
+    import dask.array as da
+    from napari_flim_phasor_plotter._cache import phasor_cache
+
+    if harmonics is None:
+        harmonic_list = [harmonic]
+    else:
+        harmonic_list = list(harmonics)
+    if time_window is None:
+        time_window = slice(0, reference_flim_data.shape[0])
+    elif not isinstance(time_window, slice):
+        time_window = slice(*time_window)
+
+    cache_key = phasor_cache.data_key(reference_flim_data) + (
+        "calibration",
+        reference_lifetime,
+        laser_frequency,
+        tuple(harmonic_list),
+        (time_window.start, time_window.stop),
+    )
+    calibration = phasor_cache.get(cache_key)
+    if calibration is not None:
+        return calibration
+
+    # sum all pixels into a single decay
+    decay = reference_flim_data[time_window].sum(
+        axis=tuple(range(1, reference_flim_data.ndim))
+    )
+    if isinstance(decay, da.Array):
+        decay = decay.compute()
+    weights = get_phasor_weights(decay.shape[0], harmonic_list)
+    dc, *cos_sin = weights @ decay
+    n_harmonics = len(harmonic_list)
+
+    calibration = {}
+    for i, harmonic in enumerate(harmonic_list):
+        g = cos_sin[i] / dc
+        s = cos_sin[n_harmonics + i] / dc
+        omega_tau = (
+            2 * np.pi * laser_frequency * 1e-3 * harmonic * reference_lifetime
+        )
+        phase_shift = np.arctan(omega_tau) - np.arctan2(s, g)
+        modulation_factor = 1 / np.sqrt(1 + omega_tau**2) / np.hypot(g, s)
+        calibration[harmonic] = (float(phase_shift), float(modulation_factor))
+    phasor_cache.set(cache_key, calibration)
+    return calibration
+
+
+def calibrate_phasor(g, s, phase_shift, modulation_factor):
+    """Rotate G and S by a phase shift and scale them by a modulation factor.
+
+    Parameters
+    ----------
+    g : np.ndarray or da.Array
+        G component.
+    s : np.ndarray or da.Array
+        S component.
+    phase_shift : float
+        Phase shift in radians.
+    modulation_factor : float
+        Modulation factor.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Calibrated G and S components.
+    """
+    # rotation and scale combined in a single 2x2 matrix
+    a = modulation_factor * np.cos(phase_shift)
+    b = modulation_factor * np.sin(phase_shift)
+    return a * g - b * s, b * g + a * s
+
+
+@nb.njit(cache=True)
 def jit_fft(a, axis=-1):
     """Numba fft version with rocket-fft"""
     return np.fft.fft(a, axis=axis)
 
 
 def fft_slice_4d(arr, slice_num):
-    """Slice of FFT over first axis of a numpy array"""
+    """Slice of FFT over first axis of a numpy array
+
+    `slice_num` can also be a list of slices, which are then stacked along
+    the first axis.
+    """
     fft_arr = jit_fft(arr, axis=0)
-    # Return the specified slice of the FFT array
+    # Return the specified slice(s) of the FFT array
     return fft_arr[slice_num, ...].real, fft_arr[slice_num, ...].imag
 
 
 def fft_slice_4d_dask(arr, slice_num):
-    """Slice of FFT over first axis of a dask array"""
+    """Slice of FFT over first axis of a dask array
+
+    `slice_num` can also be a list of slices, which are then stacked along
+    the first axis.
+    """
     import dask.array as da
 
     # Dask fft along first axis
     fft_arr = da.fft.fft(arr, axis=0)
-    # Return the specified slice of the FFT array
+    # Return the specified slice(s) of the FFT array
     return fft_arr[slice_num, ...].real, fft_arr[slice_num, ...].imag
+
+
+def get_phasor_weights(
+    n_points,
+    harmonic=1,
+    calibration=None,
+    time_window=None,
+    dtype=np.float64,
+):
+    """Get DC, cosine and sine weights of phasor harmonics.
+
+    Weight tables are cached per number of microtime bins, harmonics,
+    calibration, time window and dtype, so repeated runs (and dask blocks
+    or batches of files with the same settings) share them. The returned
+    array is read-only.
+
+    Parameters
+    ----------
+    n_points : int
+        Number of microtime bins.
+    harmonic : int or List[int], optional
+        Harmonic(s) to calculate, by default 1
+    calibration : Dict[int, Tuple[float, float]], optional
+        Phase shift and modulation factor of each harmonic. Cosine and sine
+        weights of these harmonics are rotated and scaled accordingly, by
+        default None
+    time_window : slice or Tuple[int, int], optional
+        Microtime window (start, stop). Weights of the window are those of a
+        decay starting at `start` and weights outside of it are zero, by
+        default None (whole microtime axis)
+    dtype : np.dtype, optional
+        Data type of the weights, by default np.float64
+
+    Returns
+    -------
+    np.ndarray
+        Weights with shape (1 + 2 * n_harmonics, n_points). The first row
+        holds the DC weights (ones), followed by the cosine weights of each
+        harmonic and then by the sine weights of each harmonic.
+    """
+    harmonics = tuple(int(harmonic) for harmonic in np.atleast_1d(harmonic))
+    if calibration is not None:
+        calibration = tuple(
+            (harmonic, tuple(float(value) for value in calibration[harmonic]))
+            for harmonic in harmonics
+            if harmonic in calibration
+        )
+    if time_window is None:
+        window = (0, n_points)
+    else:
+        if not isinstance(time_window, slice):
+            time_window = slice(*time_window)
+        window = time_window.indices(n_points)[:2]
+    return _get_phasor_weights(
+        n_points, harmonics, calibration or None, window, np.dtype(dtype).str
+    )
+
+
+@functools.lru_cache(maxsize=64)
+def _get_phasor_weights(n_points, harmonics, calibration, window, dtype):
+    """Cached weight table of `get_phasor_weights` (hashable arguments)"""
+    start, stop = window
+    n_window = max(stop - start, 0)
+    angles = (
+        2 * np.pi * np.array(harmonics)[:, np.newaxis] * np.arange(n_window)
+    ) / n_window
+    weights = np.zeros((1 + 2 * len(harmonics), n_points))
+    weights[:, start:stop] = np.concatenate(
+        [np.ones((1, n_window)), np.cos(angles), np.sin(angles)]
+    )
+    if calibration is not None:
+        n_harmonics = len(harmonics)
+        for harmonic, (phase_shift, modulation_factor) in calibration:
+            i = harmonics.index(harmonic)
+            cos_row, sin_row = calibrate_phasor(
+                weights[1 + i],
+                weights[1 + n_harmonics + i],
+                phase_shift,
+                modulation_factor,
+            )
+            weights[1 + i] = cos_row
+            weights[1 + n_harmonics + i] = sin_row
+    weights = weights.astype(dtype)
+    weights.flags.writeable = False
+    return weights
+
+
+def projection_4d(arr, harmonics, block_size=2**16, calibration=None):
+    """DC, cosine and sine projections over first axis of a numpy array
+
+    Pixels are processed in blocks of `block_size`, so only one block at a
+    time is converted to float.
+    """
+    weights = get_phasor_weights(arr.shape[0], harmonics, calibration)
+    arr_2d = arr.reshape(arr.shape[0], -1)
+    projections = np.empty((weights.shape[0], arr_2d.shape[1]))
+    for start in range(0, arr_2d.shape[1], block_size):
+        stop = start + block_size
+        projections[:, start:stop] = weights @ arr_2d[:, start:stop]
+    projections = projections.reshape((weights.shape[0],) + arr.shape[1:])
+    n_harmonics = len(harmonics)
+    return (
+        projections[0],
+        projections[1 : n_harmonics + 1],
+        projections[n_harmonics + 1 :],
+    )
+
+
+def projection_4d_dask(arr, harmonics, calibration=None):
+    """DC, cosine and sine projections over first axis of a dask array"""
+    import dask.array as da
+
+    weights = get_phasor_weights(arr.shape[0], harmonics, calibration)
+    projections = da.tensordot(weights, arr, axes=(1, 0))
+    n_harmonics = len(harmonics)
+    return (
+        projections[0],
+        projections[1 : n_harmonics + 1],
+        projections[n_harmonics + 1 :],
+    )
+
+
+@nb.njit(cache=True, inline="always")
+def _phasor_block_kernel(arr_2d, weights, g, s, dc, start, stop):
+    """Accumulate DC, cosine and sine sums of a block of pixels.
+
+    Microtime rows of the block are read contiguously into local
+    accumulators. G and S are divided by the DC where it is not zero.
+    """
+    n_points = arr_2d.shape[0]
+    n_harmonics = g.shape[0]
+    accumulator = np.zeros((1 + 2 * n_harmonics, stop - start))
+    for k in range(n_points):
+        for h in range(1 + 2 * n_harmonics):
+            weight = weights[h, k]
+            for pixel in range(start, stop):
+                accumulator[h, pixel - start] += arr_2d[k, pixel] * weight
+    for pixel in range(start, stop):
+        dc_sum = accumulator[0, pixel - start]
+        dc[pixel] = dc_sum
+        if dc_sum == 0:
+            dc_sum = 1.0
+        for h in range(n_harmonics):
+            g[h, pixel] = accumulator[1 + h, pixel - start] / dc_sum
+            s[h, pixel] = (
+                accumulator[1 + n_harmonics + h, pixel - start] / dc_sum
+            )
+
+
+@nb.njit(parallel=True, cache=True)
+def _phasor_kernel(arr_2d, weights, g, s, dc, block_size=256):
+    """Accumulate DC, cosine and sine sums of each pixel in a single pass.
+
+    `arr_2d` has dimensions (ut, pixels). Pixels are split in blocks, each
+    processed by one thread.
+    """
+    n_pixels = arr_2d.shape[1]
+    n_blocks = (n_pixels + block_size - 1) // block_size
+    for block in nb.prange(n_blocks):
+        start = block * block_size
+        stop = min(start + block_size, n_pixels)
+        _phasor_block_kernel(arr_2d, weights, g, s, dc, start, stop)
+
+
+@nb.njit(cache=True, nogil=True)
+def _phasor_kernel_serial(arr_2d, weights, g, s, dc, block_size=256):
+    """Serial version of `_phasor_kernel` for dask blocks and tiles, which
+    are already processed in parallel by a thread pool"""
+    n_pixels = arr_2d.shape[1]
+    for start in range(0, n_pixels, block_size):
+        stop = min(start + block_size, n_pixels)
+        _phasor_block_kernel(arr_2d, weights, g, s, dc, start, stop)
+
+
+def phasor_4d_numba(arr, harmonics, n_threads=None, calibration=None):
+    """G, S and DC over first axis of a numpy array with a parallel kernel
+
+    Outputs are float32 and G and S have an extra first dimension with one
+    entry per harmonic. Pixels with zero DC get the average DC instead.
+    """
+    weights = get_phasor_weights(
+        arr.shape[0], harmonics, calibration, dtype=np.float32
+    )
+    arr_2d = arr.reshape(arr.shape[0], -1)
+    n_pixels = arr_2d.shape[1]
+    g = np.empty((len(harmonics), n_pixels), dtype=np.float32)
+    s = np.empty((len(harmonics), n_pixels), dtype=np.float32)
+    dc = np.empty(n_pixels, dtype=np.float32)
+
+    previous_n_threads = nb.get_num_threads()
+    if n_threads is not None:
+        nb.set_num_threads(min(n_threads, nb.config.NUMBA_NUM_THREADS))
+    try:
+        _phasor_kernel(arr_2d, weights, g, s, dc)
+    finally:
+        nb.set_num_threads(previous_n_threads)
+
+    # change the zeros to the img average
+    zero_dc = dc == 0
+    if np.any(zero_dc):
+        mean_dc = np.mean(dc, dtype=np.float64)
+        g[:, zero_dc] /= mean_dc
+        s[:, zero_dc] /= mean_dc
+        dc[zero_dc] = mean_dc
+
+    shape = arr.shape[1:]
+    return (
+        g.reshape((len(harmonics),) + shape),
+        s.reshape((len(harmonics),) + shape),
+        dc.reshape(shape),
+    )
+
+
+def _phasor_block(block, harmonics, calibration=None):
+    """Stacked DC, G and S of a dask block (microtime must be one chunk)"""
+    weights = get_phasor_weights(
+        block.shape[0], harmonics, calibration, dtype=np.float32
+    )
+    arr_2d = np.ascontiguousarray(block).reshape(block.shape[0], -1)
+    n_pixels = arr_2d.shape[1]
+    n_harmonics = len(harmonics)
+    output = np.empty((1 + 2 * n_harmonics, n_pixels), dtype=np.float32)
+    _phasor_kernel_serial(
+        arr_2d,
+        weights,
+        output[1 : n_harmonics + 1],
+        output[n_harmonics + 1 :],
+        output[0],
+    )
+    return output.reshape((output.shape[0],) + block.shape[1:])
+
+
+def phasor_4d_dask(arr, harmonics, calibration=None, fill_zero_dc=True):
+    """G, S and DC over first axis of a dask array with the numba kernel
+
+    The kernel runs on each block with `map_blocks`, so G, S and DC come
+    from a single graph reading the data once. The microtime axis is
+    rechunked into a single chunk if needed. Pixels with zero DC get the
+    average DC instead, unless `fill_zero_dc` is False: the average depends
+    on all blocks, so that each output block then only depends on its input
+    block and G and S of these pixels are left undivided.
+    """
+    import dask.array as da
+
+    if arr.numblocks[0] > 1:
+        arr = arr.rechunk({0: -1})
+    n_harmonics = len(harmonics)
+    projections = arr.map_blocks(
+        _phasor_block,
+        harmonics,
+        calibration,
+        chunks=((1 + 2 * n_harmonics,),) + arr.chunks[1:],
+        dtype=np.float32,
+    )
+    dc = projections[0]
+    g = projections[1 : n_harmonics + 1]
+    s = projections[n_harmonics + 1 :]
+    if not fill_zero_dc:
+        return g, s, dc
+
+    # change the zeros to the img average
+    zero_dc = dc == 0
+    mean_dc = dc.mean(dtype=np.float64).astype(np.float32)
+    g = da.where(zero_dc, g / mean_dc, g)
+    s = da.where(zero_dc, s / mean_dc, s)
+    dc = da.where(zero_dc, mean_dc, dc)
+    return g, s, dc
+
+
+def warm_up(dtypes=(np.uint8, np.uint16, np.float32), ndims=(3, 4, 5)):
+    """Compile the numba phasor kernels for common FLIM data signatures.
+
+    Kernels are compiled from their signatures, without running them, so
+    this is safe to call from a worker thread. Compiled kernels are cached
+    on disk, so this is only slow the first time it runs after installation.
+
+    Parameters
+    ----------
+    dtypes : Tuple[np.dtype], optional
+        Data types to compile for, by default (np.uint8, np.uint16,
+        np.float32)
+    ndims : Tuple[int], optional
+        Number of dimensions to compile for (microtime included), by default
+        (3, 4, 5)
+    """
+    # cached weight tables are read-only float32 arrays
+    weights = nb.typeof(get_phasor_weights(1, dtype=np.float32))
+    output_2d = nb.typeof(np.empty((1, 1), dtype=np.float32))
+    output_1d = nb.typeof(np.empty(1, dtype=np.float32))
+    block_size = nb.types.Omitted(256)
+    for dtype in dtypes:
+        # kernels work on data reshaped to (ut, pixels)
+        arr_2d = nb.typeof(np.empty((1, 1), dtype=dtype))
+        signature = (arr_2d, weights, output_2d, output_2d, output_1d)
+        _phasor_kernel.compile(signature + (block_size,))
+        _phasor_kernel_serial.compile(signature + (block_size,))
+        for ndim in ndims:
+            arr = nb.typeof(np.empty((1,) * ndim, dtype=dtype))
+            jit_fft.compile((arr, nb.types.int64))
+
+
+_warm_up_thread = None
+
+
+def warm_up_in_background(**kwargs):
+    """Run `warm_up` once per session on a daemon thread.
+
+    Keyword arguments are passed to `warm_up`.
+
+    Returns
+    -------
+    threading.Thread
+        Thread running (or having run) the warm-up.
+    """
+    global _warm_up_thread
+    if _warm_up_thread is None:
+        # Start numba's threading layer on the calling thread: when it is
+        # first launched from the warm-up thread, the interpreter hangs at
+        # exit after parallel kernels have run on the main thread
+        nb.get_num_threads()
+        _warm_up_thread = threading.Thread(
+            target=warm_up, kwargs=kwargs, daemon=True
+        )
+        _warm_up_thread.start()
+    return _warm_up_thread
+
+
+def get_phasor_components_from_zarr(
+    zarr_path, harmonic=1, harmonics=None, output_path=None
+):
+    """Calculate phasor components of a FLIM zarr and write them to zarr.
+
+    G, S and DC of every channel are computed from a single graph, so the
+    (possibly larger than memory) FLIM stack is read only once, and are
+    streamed chunk by chunk to a zarr group with 'G', 'S' and 'DC' arrays.
+    The DC average of each channel is summed along, and pixels with zero DC
+    are then given the average in the chunks that have them.
+
+    Parameters
+    ----------
+    zarr_path : str or Path
+        Path to a FLIM zarr with dimensions (ch, ut, t, z, y, x), like the
+        ones created by `convert_folder_to_zarr`.
+    harmonic : int, optional
+        Harmonic to calculate, by default 1
+    harmonics : List[int], optional
+        Several harmonics to calculate in a single pass. If provided,
+        `harmonic` is ignored and G and S get an extra dimension after the
+        channel dimension with one entry per harmonic, by default None
+    output_path : str or Path, optional
+        Path to the output zarr group, by default None (saves next to the
+        input as '<name>_phasor.zarr')
+
+    Returns
+    -------
+    Tuple[da.Array, da.Array, da.Array]
+        G, S, and DC components read back from the output zarr group, with
+        dimensions (ch, t, z, y, x).
+    """
+    from pathlib import Path
+    import dask
+    import dask.array as da
+    import zarr
+
+    zarr_path = Path(zarr_path)
+    if output_path is None:
+        output_path = zarr_path.with_name(zarr_path.stem + "_phasor.zarr")
+    output_path = str(output_path)
+
+    flim_data = da.from_zarr(str(zarr_path))
+    harmonic_list = [harmonic] if harmonics is None else list(harmonics)
+    harmonic_index = () if harmonics is None else (slice(None),)
+    # Calculate channels separately, so each channel gets its own DC average
+    components = []
+    for channel in range(flim_data.shape[0]):
+        g, s, dc = phasor_4d_dask(
+            flim_data[channel], harmonic_list, fill_zero_dc=False
+        )
+        if harmonics is None:
+            g, s = g[0], s[0]
+        components.append((g, s, dc))
+    writers = []
+    for name, arrays in zip(["G", "S", "DC"], zip(*components)):
+        array = da.stack(arrays)
+        # zarr needs regular chunks
+        array = array.rechunk(array.chunksize)
+        writers.append(
+            da.to_zarr(
+                array,
+                output_path,
+                component=name,
+                overwrite=True,
+                compute=False,
+            )
+        )
+    dc_means = [dc.mean(dtype=np.float64) for _, _, dc in components]
+    *_, dc_means = dask.compute(*writers, dc_means)
+
+    # change the zeros to the img average, only in chunks that have them
+    group = zarr.open_group(output_path, mode="r+")
+    g_out, s_out, dc_out = group["G"], group["S"], group["DC"]
+    dc_means = np.asarray(dc_means, dtype=np.float32)
+    for block_start in np.ndindex(dc_out.cdata_shape):
+        block = tuple(
+            slice(i * chunk, (i + 1) * chunk)
+            for i, chunk in zip(block_start, dc_out.chunks)
+        )
+        dc_block = dc_out[block]
+        zero_dc = dc_block == 0
+        if not np.any(zero_dc):
+            continue
+        mean_dc = np.broadcast_to(
+            dc_means[block[0]].reshape((-1,) + (1,) * (dc_block.ndim - 1)),
+            dc_block.shape,
+        )[zero_dc]
+        component_block = block[:1] + harmonic_index + block[1:]
+        for component in (g_out, s_out):
+            values = component[component_block]
+            if harmonics is None:
+                values[zero_dc] /= mean_dc
+            else:
+                for i in range(values.shape[1]):
+                    values[:, i][zero_dc] /= mean_dc
+            component[component_block] = values
+        dc_block[zero_dc] = mean_dc
+        dc_out[block] = dc_block
+    return tuple(
+        da.from_zarr(output_path, component=name) for name in ["G", "S", "DC"]
+    )
+
+
+def get_tiled_phasor_components(
+    flim_data,
+    harmonic=1,
+    harmonics=None,
+    memory_budget="1GB",
+    n_workers=None,
+    time_window=None,
+    calibration=None,
+    out=None,
+):
+    """Calculate phasor components tile by tile within a memory budget.
+
+    The (y, x) plane is split into tiles small enough that the tiles read
+    by all workers fit in `memory_budget`. Each tile is read, processed by
+    the numba kernel in a thread pool and written into preallocated G, S and
+    DC outputs, so peak memory does not depend on the size of the mosaic.
+
+    Parameters
+    ----------
+    flim_data : array-like
+        FLIM data with dimensions (ut, time, z, y, x). microtime must be the
+        first dimention. time and z are optional. Any array that can be
+        sliced into NumPy arrays works, like np.memmap, zarr or dask arrays.
+    harmonic : int, optional
+        Harmonic to calculate, by default 1
+    harmonics : List[int], optional
+        Several harmonics to calculate in a single pass over the data. If
+        provided, `harmonic` is ignored and G and S get an extra first
+        dimension with one entry per harmonic, by default None
+    memory_budget : int or str, optional
+        Memory available to the tiles being processed, in bytes or as a
+        string like "500MB", by default "1GB"
+    n_workers : int, optional
+        Number of tiles processed in parallel, by default None (number of
+        threads available to numba)
+    time_window : slice or Tuple[int, int], optional
+        Microtime window (start, stop) to calculate phasors from, by default
+        None (whole microtime axis)
+    calibration : Dict[int, Tuple[float, float]], optional
+        Phase shift (in radians) and modulation factor of each harmonic, by
+        default None
+    out : Tuple[array-like, array-like, array-like], optional
+        Preallocated float32 G, S and DC outputs (e.g. np.memmap or zarr
+        arrays), with the shapes of the returned components. Tiles are
+        aligned to the chunks of chunked outputs, so a tile can exceed the
+        memory budget when a single chunk does, by default None (allocates
+        NumPy arrays)
+
+    Returns
+    -------
+    Tuple[array-like, array-like, array-like]
+        G, S, and DC components. If `harmonics` is provided, G and S have
+        dimensions (harmonic, time, z, y, x).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from dask.utils import parse_bytes
+
+    if harmonics is None:
+        harmonic_list = [harmonic]
+    else:
+        harmonic_list = list(harmonics)
+    if time_window is None:
+        time_window = slice(0, flim_data.shape[0])
+    elif not isinstance(time_window, slice):
+        time_window = slice(*time_window)
+    if isinstance(memory_budget, str):
+        memory_budget = parse_bytes(memory_budget)
+    if n_workers is None:
+        n_workers = nb.get_num_threads()
+
+    n_points = len(range(*time_window.indices(flim_data.shape[0])))
+    n_harmonics = len(harmonic_list)
+    shape = flim_data.shape[1:]
+    tile_shape = _get_tile_shape(
+        shape,
+        n_points,
+        np.dtype(flim_data.dtype).itemsize,
+        n_harmonics,
+        memory_budget // n_workers,
+    )
+
+    # G and S have a harmonic dimension only if `harmonics` is provided
+    if harmonics is None:
+        harmonic_shape, harmonic_index = (), ()
+    else:
+        harmonic_shape, harmonic_index = (n_harmonics,), (slice(None),)
+    if out is None:
+        g = np.empty(harmonic_shape + shape, dtype=np.float32)
+        s = np.empty(harmonic_shape + shape, dtype=np.float32)
+        dc = np.empty(shape, dtype=np.float32)
+    else:
+        g, s, dc = out
+        # chunked outputs are written chunk by chunk: tiles must not share
+        # chunks, or workers would overwrite each other's pixels
+        tile_shape = _align_tile_shape(tile_shape, shape, (g, s, dc))
+
+    leading = (slice(None),) * (len(shape) - 2)
+    tiles = [
+        leading + (slice(y, y + tile_shape[0]), slice(x, x + tile_shape[1]))
+        for y in range(0, shape[-2], tile_shape[0])
+        for x in range(0, shape[-1], tile_shape[1])
+    ]
+
+    def process_tile(tile):
+        block = flim_data[(time_window,) + tile]
+        if hasattr(block, "compute"):
+            # tiles are already processed in parallel
+            block = block.compute(scheduler="synchronous")
+        projections = _phasor_block(
+            np.asarray(block), harmonic_list, calibration
+        )
+        g_tile = projections[1 : n_harmonics + 1]
+        s_tile = projections[n_harmonics + 1 :]
+        if harmonics is None:
+            g_tile, s_tile = g_tile[0], s_tile[0]
+        g[harmonic_index + tile] = g_tile
+        s[harmonic_index + tile] = s_tile
+        dc[tile] = projections[0]
+        return (
+            projections[0].sum(dtype=np.float64),
+            bool(np.any(projections[0] == 0)),
+        )
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        results = list(executor.map(process_tile, tiles))
+
+    # change the zeros to the img average, only in tiles that have them
+    mean_dc = np.float32(sum(dc_sum for dc_sum, _ in results) / np.prod(shape))
+    for tile, (_, has_zero_dc) in zip(tiles, results):
+        if not has_zero_dc:
+            continue
+        dc_tile = np.asarray(dc[tile])
+        zero_dc = dc_tile == 0
+        for component in (g, s):
+            component_tile = np.asarray(component[harmonic_index + tile])
+            component_tile[..., zero_dc] /= mean_dc
+            component[harmonic_index + tile] = component_tile
+        dc_tile[zero_dc] = mean_dc
+        dc[tile] = dc_tile
+    return g, s, dc
+
+
+def _get_tile_shape(shape, n_points, itemsize, n_harmonics, tile_budget):
+    """(y, x) shape of the largest square-ish tile fitting in `tile_budget`
+
+    A tile needs its input data and its float32 DC, G and S outputs.
+    """
+    bytes_per_pixel = int(np.prod(shape[:-2])) * (
+        n_points * itemsize + (1 + 2 * n_harmonics) * 4
+    )
+    n_pixels = tile_budget // bytes_per_pixel
+    if n_pixels < 1:
+        raise ValueError(
+            f"memory budget of {tile_budget} bytes per worker is too small "
+            f"for a single pixel ({bytes_per_pixel} bytes)"
+        )
+    tile_y = min(shape[-2], max(1, math.isqrt(n_pixels)))
+    tile_x = min(shape[-1], max(1, n_pixels // tile_y))
+    if tile_x == shape[-1]:
+        # tiles span full rows, use the remaining budget for more rows
+        tile_y = min(shape[-2], n_pixels // tile_x)
+    return tile_y, tile_x
+
+
+def _align_tile_shape(tile_shape, shape, outputs):
+    """Round a (y, x) tile shape to multiples of the output chunks
+
+    Tiles are rounded down to whole chunks, or up to a single chunk if they
+    are smaller, so that each chunk of the outputs (like zarr arrays) is
+    written by a single tile. Outputs without chunks are left unchanged.
+    """
+    aligned = []
+    for axis, size in zip((-2, -1), tile_shape):
+        chunk_size = 1
+        for output in outputs:
+            chunks = getattr(output, "chunks", None)
+            if isinstance(chunks, tuple) and len(chunks) > 0:
+                chunk_size = math.lcm(chunk_size, int(chunks[axis]))
+        size = max(1, size // chunk_size) * chunk_size
+        aligned.append(min(size, shape[axis]))
+    return tuple(aligned)
+
+
+def get_ptu_phasor_components(
+    path,
+    harmonic=1,
+    harmonics=None,
+    chunk_size=2**22,
+    time_window=None,
+    calibration=None,
+):
+    """Calculate phasor components G and S directly from PTU photon records.
+
+    T3 records are read and decoded in chunks, and the cosine and sine of
+    each photon's arrival time (dtime) are added straight into per-pixel
+    accumulators, so the (C, H, T, Y, X) histogram cube is never built.
+
+    Parameters
+    ----------
+    path : str or Path
+        Path to a T3 image PTU file.
+    harmonic : int, optional
+        Harmonic to calculate, by default 1
+    harmonics : List[int], optional
+        Several harmonics to calculate in a single pass over the records. If
+        provided, `harmonic` is ignored and G and S get an extra first
+        dimension with one entry per harmonic, by default None
+    chunk_size : int, optional
+        Number of records read and decoded at a time, by default 2**22
+    time_window : slice or Tuple[int, int], optional
+        Microtime window (start, stop) to calculate phasors from. Photons
+        outside of it are ignored, by default None (all microtime bins)
+    calibration : Dict[int, Tuple[float, float]], optional
+        Phase shift (in radians) and modulation factor of each harmonic, like
+        the ones returned by `get_calibration_parameters`, by default None
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, np.ndarray]
+        G, S, and DC components with dimensions (ch, t, z, y, x), where z has
+        length 1 (following napari convention). G and S are float32 and DC
+        holds photon counts.
+    """
+    from ptufile import PtuFile
+
+    if harmonics is None:
+        harmonic_list = [harmonic]
+    else:
+        harmonic_list = list(harmonics)
+
+    ptu = PtuFile(path)
+    if not ptu.is_t3 or not ptu.is_image:
+        raise ValueError(f"{path} is not a T3 image PTU file")
+    sizes = ptu.sizes
+    n_frames = sizes.get("T", 1)
+    n_channels = sizes.get("C", 1)
+    n_bins = sizes["H"]
+    first_channel = int(ptu.coords["C"][0]) if "C" in ptu.coords else 0
+
+    # photons outside of the time window get zero weights
+    weights = get_phasor_weights(
+        n_bins, harmonic_list, calibration, time_window=time_window
+    )
+    accumulators = np.zeros(
+        (weights.shape[0], n_channels, n_frames, sizes["Y"], sizes["X"])
+    )
+    # frame, line, inside line flag, line start time
+    state = np.zeros(4, dtype=np.int64)
+
+    records = ptu.read_records(memmap=True)
+    time_offset = 0
+    last_time = 0
+    for start in range(0, records.size, chunk_size):
+        decoded = ptu.decode_records(records[start : start + chunk_size])
+        if start > 0:
+            # Decoding restarts the overflow count at every chunk, so the
+            # first time is re-anchored on the last record of previous chunk
+            boundary = ptu.decode_records(records[start - 1 : start + 1])
+            time_offset = (
+                last_time
+                + int(boundary["time"][1])
+                - int(boundary["time"][0])
+                - int(decoded["time"][0])
+            )
+        times = decoded["time"].astype(np.int64) + time_offset
+        _ptu_phasor_kernel(
+            times,
+            decoded["dtime"],
+            decoded["channel"],
+            decoded["marker"],
+            state,
+            weights,
+            accumulators,
+            first_channel,
+            ptu.global_pixel_time,
+            ptu.line_start_mask,
+            ptu.line_stop_mask,
+            ptu.frame_change_mask,
+            ptu.is_bidirectional,
+        )
+        last_time = int(times[-1])
+    ptu.close()
+
+    n_harmonics = len(harmonic_list)
+    # Add unitary dimension for z
+    accumulators = np.expand_dims(accumulators, axis=3)
+    dc = accumulators[0]
+    # change the zeros to the img average (per channel)
+    dc = np.where(dc != 0, dc, np.mean(dc, axis=(1, 2, 3, 4), keepdims=True))
+    g = (accumulators[1 : n_harmonics + 1] / dc).astype(np.float32)
+    s = (accumulators[n_harmonics + 1 :] / dc).astype(np.float32)
+
+    if harmonics is None:
+        g, s = g[0], s[0]
+    return g, s, dc
+
+
+@nb.njit(cache=True)
+def _ptu_phasor_kernel(
+    times,
+    dtimes,
+    channels,
+    markers,
+    state,
+    weights,
+    accumulators,
+    first_channel,
+    pixel_time,
+    line_start_mask,
+    line_stop_mask,
+    frame_change_mask,
+    bidirectional,
+):
+    """Add decoded T3 records to per-pixel DC, cosine and sine accumulators.
+
+    Photons are assigned to pixels from line start/stop and frame change
+    markers. `state` keeps the scan position between chunks of records.
+    """
+    n_weights, n_channels, n_frames, n_lines, n_pixels = accumulators.shape
+    n_bins = weights.shape[1]
+    frame, line, inside_line, line_start = state
+    for i in range(times.size):
+        if channels[i] < 0:
+            marker = markers[i]
+            if marker & line_stop_mask and inside_line:
+                inside_line = 0
+                line += 1
+            if marker & frame_change_mask and line > 0:
+                frame += 1
+                line = 0
+            if marker & line_start_mask:
+                inside_line = 1
+                line_start = times[i]
+            continue
+        if not inside_line or frame >= n_frames or line >= n_lines:
+            continue
+        dtime = dtimes[i]
+        channel = channels[i] - first_channel
+        if dtime >= n_bins or channel < 0 or channel >= n_channels:
+            continue
+        x = (times[i] - line_start) // pixel_time
+        if x >= n_pixels:
+            continue
+        if bidirectional and line % 2 == 1:
+            x = n_pixels - 1 - x
+        for w in range(n_weights):
+            accumulators[w, channel, frame, line, x] += weights[w, dtime]
+    state[0] = frame
+    state[1] = line
+    state[2] = inside_line
+    state[3] = line_start